@@ -0,0 +1,106 @@
+"""
+Benchmark: adjacency index lookups against the ORM query path
+
+Builds an AdjacencyIndex over synthetic edges, reports its memory per edge
+and the latency of "recommendations for product X" lookups. With --orm the
+same edges are loaded into recommendation_model and the
+find_by_filters(original_product_id=X) + serialize() path is timed too.
+
+Usage:
+    python -m benchmarks.bench_adjacency --edges 1000000 [--orm]
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+from service import app  # pylint: disable=unused-import
+from service.adjacency import AdjacencyIndex
+from service.models import Reason, RecommendationModel, db
+
+ROWS_PER_PRODUCT = 20
+REASONS = list(Reason)
+
+
+def synthetic_rows(edges):
+    """Yields index rows sorted by (original_product_id, id)"""
+    for i in range(edges):
+        product_id = i // ROWS_PER_PRODUCT
+        yield (product_id, i + 1, "product-%d" % product_id, (i * 7919) % edges,
+               "target-%d" % ((i * 7919) % edges), REASONS[i % 4], i % 10 != 0,
+               (i * 7919 % 1000) / 1000.0, None)
+
+
+def timed(func, products, repeat):
+    """Returns median and p99 latency of func(product) in microseconds"""
+    samples = []
+    for _ in range(repeat):
+        product_id = random.choice(products)
+        start = time.perf_counter()
+        func(product_id)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "median_us": round(statistics.median(samples), 1),
+        "p99_us": round(samples[int(len(samples) * 0.99) - 1], 1),
+    }
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--orm", action="store_true", help="also time the ORM path")
+    args = parser.parse_args()
+
+    index = AdjacencyIndex(refresh_seconds=0)
+    start = time.perf_counter()
+    index.start(lambda: synthetic_rows(args.edges), background=False)
+    build_seconds = time.perf_counter() - start
+    graph = index._graph  # pylint: disable=protected-access
+    string_bytes = sum(sys.getsizeof(value) for value in graph.strings)
+    string_bytes += sys.getsizeof(graph.strings)
+    products = list(range(args.edges // ROWS_PER_PRODUCT))
+
+    report = {
+        "edges": args.edges,
+        "products": len(products),
+        "build_seconds": round(build_seconds, 2),
+        "array_bytes_per_edge": round(graph.nbytes() / args.edges, 2),
+        "string_table_bytes_per_edge": round(string_bytes / args.edges, 2),
+        "index_lookup": timed(lambda p: index.lookup([p]), products, args.repeat),
+        "index_lookup_activated": timed(
+            lambda p: index.lookup([p], activated=True), products, args.repeat
+        ),
+    }
+
+    if args.orm:
+        db.session.query(RecommendationModel).delete()
+        db.session.commit()
+        RecommendationModel.create_many(
+            {
+                "name": row[2], "original_product_id": row[0],
+                "recommendation_product_name": row[4], "recommendation_product_id": row[3],
+                "reason": row[5], "activated": row[6],
+            }
+            for row in synthetic_rows(args.edges)
+        )
+        db.session.execute("ANALYZE recommendation_model")
+        db.session.commit()
+
+        def orm_lookup(product_id):
+            recs = RecommendationModel.find_by_filters(original_product_id=product_id)
+            return [rec.serialize() for rec in recs]
+
+        report["orm_lookup"] = timed(orm_lookup, products, args.repeat)
+        db.session.query(RecommendationModel).delete()
+        db.session.commit()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmark: the async read path against the sync Flask app
+
+Starts one server process at a time, gunicorn with the Procfile's single
+sync worker or uvicorn with service.asgi:app, and drives it with C
+concurrent keep-alive connections requesting
+GET /recommendations?original_product_id=X for a fixed time. Reports
+requests/s, latency percentiles and the server's CPU time, from which
+requests/s per core is derived. Linux only (reads /proc).
+
+Usage:
+    python -m benchmarks.bench_async --connections 100,250,500,1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from service import app  # pylint: disable=unused-import
+from service.models import Reason, RecommendationModel, db
+
+ROWS_PER_PRODUCT = 20
+REASONS = list(Reason)
+SERVERS = {
+    "sync": ["-m", "gunicorn", "--workers=1", "--bind=127.0.0.1:{port}", "service:app"],
+    "async": ["-m", "uvicorn", "--workers=1", "--host=127.0.0.1", "--port={port}",
+              "--log-level=warning", "service.asgi:app"],
+}
+
+
+def seed(products):
+    """Replaces the table contents with ROWS_PER_PRODUCT rows per product"""
+    db.session.query(RecommendationModel).delete()
+    db.session.commit()
+    RecommendationModel.create_many(
+        {
+            "name": "product-%d" % (i // ROWS_PER_PRODUCT),
+            "original_product_id": i // ROWS_PER_PRODUCT,
+            "recommendation_product_name": "target-%d" % i,
+            "recommendation_product_id": i,
+            "reason": REASONS[i % 4],
+            "activated": True,
+        }
+        for i in range(products * ROWS_PER_PRODUCT)
+    )
+
+
+def cpu_seconds(pid):
+    """Returns the user + system CPU time of a process and its descendants"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    try:
+        with open("/proc/%d/stat" % pid) as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        total += (int(fields[11]) + int(fields[12])) / ticks
+        with open("/proc/%d/task/%d/children" % (pid, pid)) as children:
+            for child in children.read().split():
+                total += cpu_seconds(int(child))
+    except FileNotFoundError:
+        pass
+    return total
+
+
+async def fetch(reader, writer, path):
+    """Sends one GET and reads the response; returns (status, keep_alive)"""
+    writer.write(("GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n" % path).encode("latin-1"))
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in lines[1:] if ": " in line)
+    await reader.readexactly(int(headers.get("content-length", "0")))
+    return int(lines[0].split()[1]), headers.get("connection") != "close"
+
+
+async def connection(port, products, deadline, latencies, errors):
+    """Sends requests on one connection, reconnecting when the server closes it"""
+    conn = None
+    while time.monotonic() < deadline:
+        path = "/recommendations?original_product_id=%d" % random.randrange(products)
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = await asyncio.open_connection("127.0.0.1", port)
+            code, keep_alive = await fetch(*conn, path)
+        except (OSError, asyncio.IncompleteReadError):
+            code, keep_alive = None, False
+        latencies.append(time.perf_counter() - start)
+        if code != 200:
+            errors.append(code)
+        if not keep_alive and conn is not None:
+            conn[1].close()
+            conn = None
+    if conn is not None:
+        conn[1].close()
+
+
+async def drive(port, connections, seconds, products):
+    """Runs the connections for seconds; returns sorted latencies and errors"""
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[
+        connection(port, products, deadline, latencies, errors) for _ in range(connections)
+    ])
+    return sorted(latencies), errors
+
+
+def start_server(kind, port):
+    """Starts a server and waits until it answers"""
+    command = [sys.executable] + [part.format(port=port) for part in SERVERS[kind]]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            latencies, errors = asyncio.run(drive(port, 1, 0.01, 1))
+            if latencies and not errors:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("%s server did not start" % kind)
+
+
+def percentile(samples, fraction):
+    """Returns a percentile of sorted samples in milliseconds"""
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 1)
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", default="100,250,500,1000")
+    parser.add_argument("--servers", default="sync,async")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    seed(args.products)
+    db.session.remove()
+    results = []
+    for kind in args.servers.split(","):
+        server = start_server(kind, args.port)
+        try:
+            for connections in [int(count) for count in args.connections.split(",")]:
+                cpu = cpu_seconds(server.pid)
+                latencies, errors = asyncio.run(
+                    drive(args.port, connections, args.seconds, args.products)
+                )
+                cores = (cpu_seconds(server.pid) - cpu) / args.seconds
+                ok = len(latencies) - len(errors)
+                results.append({
+                    "server": kind,
+                    "connections": connections,
+                    "requests_per_second": round(ok / args.seconds, 1),
+                    "server_cores": round(cores, 2),
+                    "requests_per_second_per_core": round(ok / args.seconds / max(cores, 0.01), 1),
+                    "errors": len(errors),
+                    "p50_ms": percentile(latencies, 0.50),
+                    "p99_ms": percentile(latencies, 0.99),
+                })
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
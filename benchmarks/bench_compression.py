@@ -0,0 +1,79 @@
+"""
+Benchmark: response size and time per encoding
+
+Serves GET /recommendations (one JSON list of --rows Recommendations) with
+the test client under each encoding and level, and reports the median wall
+microseconds per request, the bytes sent and the compression ratio. Also
+reports the bytes of the built static assets per encoding.
+
+Usage:
+    python -m benchmarks.bench_compression --rows 500 --requests 200
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from service import app
+from service.assets import build_assets
+from service.compression import brotli
+from service.models import RecommendationModel, db
+from tests.factories import RecFactory
+
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_QUALITIES = (1, 4, 11)
+
+
+def seed(rows):
+    """Replaces the table contents with rows Recommendations"""
+    RecommendationModel.delete_many()
+    RecommendationModel.import_rows(
+        (i, RecommendationModel.validate(RecFactory(original_product_id=i).serialize()))
+        for i in range(rows)
+    )
+    db.session.remove()
+
+
+def run(args, encoding):
+    """Returns the figures of one encoding with the current config"""
+    client = app.test_client()
+    headers = {"Accept-Encoding": encoding} if encoding else {}
+    size = len(client.get("/recommendations", headers=headers).data)
+    times = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        client.get("/recommendations", headers=headers)
+        times.append(time.perf_counter() - start)
+    return {"us": round(statistics.median(times) * 1e6, 1), "bytes": size}
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    app.config["COMPRESS_MIN_SIZE"] = 0
+    report = {"rows": args.rows, "requests": args.requests,
+              "encodings": {"identity": run(args, None)}}
+    for level in GZIP_LEVELS:
+        app.config["COMPRESS_GZIP_LEVEL"] = level
+        report["encodings"]["gzip-%d" % level] = run(args, "gzip")
+    if brotli is not None:
+        for quality in BROTLI_QUALITIES:
+            app.config["COMPRESS_BROTLI_QUALITY"] = quality
+            report["encodings"]["br-%d" % quality] = run(args, "br")
+    identity = report["encodings"]["identity"]
+    for figures in report["encodings"].values():
+        figures["ratio"] = round(identity["bytes"] / figures["bytes"], 2)
+        figures["us_over_identity"] = round(figures["us"] - identity["us"], 1)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report["static_bytes"] = build_assets(app.static_folder, tmpdir)["bytes"]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
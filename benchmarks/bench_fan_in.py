@@ -0,0 +1,121 @@
+"""
+Benchmark: reverse lookups and fan-in counts
+
+Fills recommendation_model with synthetic rows where one product is
+recommended by a tenth of them, then reports, in milliseconds:
+
+    page         the first page of GET /products/<id>/recommended-by
+    count        the product's fan-in from its counter (FanIn.current)
+    count(*)     the same number counted from recommendation_model
+
+for that product and for a typical one, and the cost the counter triggers
+add to bulk inserts (create_many with the triggers enabled and disabled).
+
+Usage:
+    DATABASE_URI=postgresql://... python -m benchmarks.bench_fan_in --rows 1000000
+"""
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import text
+
+from service import app
+from service.models import FanIn, RecommendationModel, db
+from tests.factories import RecFactory
+
+HOT_PRODUCT = 0
+
+# a tenth of the rows point at HOT_PRODUCT, the others at one of rows / 10
+SEED_SQL = """
+INSERT INTO recommendation_model
+    (name, original_product_id, recommendation_product_name,
+     recommendation_product_id, reason, activated)
+SELECT 'product-' || (g / 20), g / 20, 'target',
+       CASE WHEN g % 10 = 0 THEN 0 ELSE 1 + (g::bigint * 7919) % :targets END,
+       'UP_SELL', true
+FROM generate_series(1, :rows) AS g
+"""
+
+
+def seed(rows):
+    """Replaces the table contents with rows synthetic Recommendations"""
+    with db.engine.begin() as conn:
+        conn.execute(text("TRUNCATE recommendation_model"))
+        conn.execute(text(SEED_SQL), targets=max(rows // 10, 1), rows=rows)
+    with db.engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("VACUUM ANALYZE recommendation_model")
+        )
+
+
+def timed(call, repeat):
+    """Returns the median milliseconds of call()"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def count_star(product_id):
+    """Counts the Recommendations of product_id without the counter"""
+    return db.session.execute(
+        text("SELECT count(*) FROM recommendation_model WHERE recommendation_product_id = :id"),
+        {"id": product_id},
+    ).scalar()
+
+
+def reads(args, client):
+    """Returns the read timings of the hot product and a typical one"""
+    report = {}
+    for label, product_id in (("hot", HOT_PRODUCT), ("typical", 2)):
+        path = "/products/%d/recommended-by?limit=%d" % (product_id, args.limit)
+        report[label] = {
+            "fan_in": FanIn.current(product_id),
+            "page_ms": timed(lambda path=path: client.get(path), args.repeat),
+            "count_ms": timed(lambda pid=product_id: FanIn.current(pid), args.repeat),
+            "count_star_ms": timed(lambda pid=product_id: count_star(pid), args.repeat),
+        }
+        db.session.rollback()
+    return report
+
+
+def inserts(args):
+    """Returns the create_many milliseconds per batch with and without the triggers"""
+    rows = [
+        RecommendationModel.validate(RecFactory(recommendation_product_id=i % 100).serialize())
+        for i in range(args.batch)
+    ]
+    report = {}
+    for label, enabled in (("triggers", True), ("no_triggers", False), ("triggers_again", True)):
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE recommendation_model %s TRIGGER USER"
+                              % ("ENABLE" if enabled else "DISABLE")))
+        report[label] = timed(lambda: RecommendationModel.create_many(rows), 5)
+    with db.engine.begin() as conn:
+        FanIn.install(conn)
+    return report
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=10000)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    report = {"rows": args.rows, "limit": args.limit, "reads": reads(args, app.test_client())}
+    report["create_many_ms"] = inserts(args)
+    with db.engine.begin() as conn:
+        conn.execute(text("TRUNCATE recommendation_model"))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: loading a feed with COPY against the bulk INSERT path
+
+Writes a synthetic CSV feed of N records (1% of them invalid), then loads it
+into an empty table three ways and reports records/s and peak memory:
+
+    insert  RecommendationModel.create_many() with COPY batches and
+            INSERT ... RETURNING id (POST /recommendations/bulk), on the
+            first --insert-rows records
+    import  flask recommendations import: COPY into staging, then merge
+    merge   the same import again, so every record matches an unchanged row
+
+Usage:
+    python -m benchmarks.bench_import --rows 1000000
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import tempfile
+import time
+
+from service import app  # pylint: disable=unused-import
+from service.importer import FeedImport, open_feed
+from service.models import Reason, RecommendationModel, db
+
+REASONS = list(Reason)
+FIELDS = [
+    "name", "original_product_id", "recommendation_product_name",
+    "recommendation_product_id", "reason", "activated", "score", "rank",
+]
+
+
+def write_feed(path, rows):
+    """Writes a CSV feed with 20 records per product"""
+    with open(path, "w", encoding="utf-8", newline="") as stream:
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+        for i in range(rows):
+            writer.writerow([
+                "product-%d" % (i // 20), i // 20, "target-%d" % i, i,
+                REASONS[i % 4].name if i % 100 else "NOPE", "true" if i % 10 else "false",
+                (i * 7919 % 1000) / 1000.0, (i % 20) + 1,
+            ])
+
+
+def empty_table():
+    """Deletes every Recommendation"""
+    RecommendationModel.delete_many()
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MB"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_import(path):
+    """Imports the feed; returns the importer statistics"""
+    with open_feed(path) as stream:
+        return FeedImport(stream, "csv", progress_every=0).run()
+
+
+def run_insert(path, rows):
+    """Loads the first rows records with create_many(); returns records/s"""
+    with open_feed(path) as stream:
+        feed = FeedImport(stream, "csv", progress_every=0)
+        start = time.perf_counter()
+        records = (row for _, (_, row) in zip(range(rows), feed.rows()))
+        RecommendationModel.create_many(records, app.config["BULK_BATCH_SIZE"])
+        seconds = time.perf_counter() - start
+    return round(feed.read / seconds, 1)
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--insert-rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "feed.csv")
+        write_feed(path, args.rows)
+        empty_table()
+        insert_rate = run_insert(path, min(args.insert_rows, args.rows))
+        empty_table()
+        imported = run_import(path)
+        merged = run_import(path)
+        empty_table()
+        db.session.remove()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "insert_records_per_second": insert_rate,
+        "import": imported,
+        "merge": merged,
+        "peak_rss_mb": peak_rss_mb(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark: find_by_* lookup latency with and without secondary indexes
+
+Builds a scratch copy of recommendation_model in a "bench" schema, fills it
+with synthetic rows, then times the queries each find_by_* method issues
+before and after creating the indexes declared on RecommendationModel.
+
+Usage:
+    DATABASE_URI=postgresql://... python -m benchmarks.bench_indexes --rows 1000000 10000000
+
+Results are printed as JSON, one object per row count.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from sqlalchemy import MetaData, select, text
+
+from service import app  # pylint: disable=unused-import
+from service.models import Reason, RecommendationModel, db
+
+SCHEMA = "bench"
+ROWS_PER_PRODUCT = 20  # roughly 20 recommendations per original product
+
+SEED_SQL = """
+INSERT INTO bench.recommendation_model
+    (id, name, original_product_id, recommendation_product_name,
+     recommendation_product_id, reason, activated)
+SELECT g,
+       'product-' || (g / :fan_out),
+       g / :fan_out,
+       'target-' || ((g::bigint * 7919) % :targets),
+       (g::bigint * 7919) % :targets,
+       (ARRAY['CROSS_SELL', 'UP_SELL', 'ACCESSORY', 'OTHER'])[1 + g % 4]::reason,
+       g % 10 <> 0
+FROM generate_series(1, :rows) AS g
+"""
+
+
+def seed(engine, rows):
+    """Creates an unindexed copy of the table and fills it"""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE SCHEMA IF NOT EXISTS %s" % SCHEMA))
+        conn.execute(text("DROP TABLE IF EXISTS %s.recommendation_model" % SCHEMA))
+        conn.execute(
+            text(
+                "CREATE TABLE %s.recommendation_model "
+                "(LIKE public.recommendation_model INCLUDING DEFAULTS)" % SCHEMA
+            )
+        )
+        conn.execute(
+            text(SEED_SQL), fan_out=ROWS_PER_PRODUCT, targets=max(rows // 10, 1), rows=rows
+        )
+        conn.execute(text("ALTER TABLE %s.recommendation_model ADD PRIMARY KEY (id)" % SCHEMA))
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("VACUUM ANALYZE %s.recommendation_model" % SCHEMA)
+        )
+
+
+def lookups(table, rows):
+    """Returns (label, statement factory) pairs mirroring the find_by_* queries"""
+    products = max(rows // ROWS_PER_PRODUCT, 1)
+    targets = max(rows // 10, 1)
+    return [
+        ("find_by_original_product_id",
+         lambda: select([table]).where(table.c.original_product_id == random.randrange(products))),
+        ("find_by_name",
+         lambda: select([table]).where(table.c.name == "product-%d" % random.randrange(products))),
+        ("find_by_recommendation_product_id",
+         lambda: select([table]).where(table.c.recommendation_product_id == random.randrange(targets))),
+        ("find_by_recommendation_product_name",
+         lambda: select([table]).where(
+             table.c.recommendation_product_name == "target-%d" % random.randrange(targets))),
+        ("find_by_reason (LIMIT 100)",
+         lambda: select([table]).where(table.c.reason == random.choice(list(Reason))).limit(100)),
+        ("find_by_activated(False) (LIMIT 100)",
+         lambda: select([table]).where(table.c.activated.is_(False)).limit(100)),
+    ]
+
+
+def measure(engine, table, rows, repeat):
+    """Times each lookup and reports median/p95 in milliseconds plus the plan"""
+    results = {}
+    with engine.connect() as conn:
+        for label, make in lookups(table, rows):
+            samples = []
+            for _ in range(repeat):
+                stmt = make()
+                start = time.perf_counter()
+                conn.execute(stmt).fetchall()
+                samples.append((time.perf_counter() - start) * 1000)
+            compiled = make().compile(conn, compile_kwargs={"literal_binds": True})
+            plan = conn.execute(text("EXPLAIN " + str(compiled))).fetchall()
+            samples.sort()
+            results[label] = {
+                "median_ms": round(statistics.median(samples), 3),
+                "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+                "plan": plan[0][0].strip(),
+            }
+    return results
+
+
+def run(rows, repeat):
+    """Runs the before/after comparison for one table size"""
+    engine = db.engine
+    seed(engine, rows)
+    table = RecommendationModel.__table__.tometadata(MetaData(), schema=SCHEMA)
+    before = measure(engine, table, rows, repeat)
+    start = time.perf_counter()
+    for index in table.indexes:
+        index.create(bind=engine)
+    build_seconds = time.perf_counter() - start
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("ANALYZE %s.recommendation_model" % SCHEMA)
+        )
+    after = measure(engine, table, rows, repeat)
+    return {
+        "rows": rows,
+        "index_build_seconds": round(build_seconds, 2),
+        "before": before,
+        "after": after,
+    }
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 10000000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    for rows in args.rows:
+        print(json.dumps(run(rows, args.repeat), indent=2))
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA IF EXISTS %s CASCADE" % SCHEMA))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Benchmark: end-to-end HTTP load test of the service
+
+Seeds N Recommendations built with tests.factories.RecFactory through the
+COPY import path, starts the service under gunicorn (the Procfile command,
+with --workers/--threads), and drives it with C concurrent keep-alive
+connections. Each connection picks one operation per request from a
+weighted mix:
+
+    create    POST /recommendations
+    get       GET /recommendations/<id>
+    list      GET /recommendations?original_product_id=X
+    filter    GET /recommendations?reason=R&activated=true&limit=50
+    activate  PUT /recommendations/activate or /deactivate?original_product_id=X
+    delete    DELETE /recommendations/<id>
+
+Reports requests/s, errors and p50/p95/p99 latency per operation and in
+total, plus the git revision, as JSON so that runs can be compared across
+versions. Mixes are "read", "mixed", "write" or weights such as
+"get=60,list=30,create=10".
+
+Usage:
+    python -m benchmarks.bench_load --rows 100000 --connections 32 --mix mixed
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import random
+import subprocess
+import sys
+import time
+
+from service import app  # pylint: disable=unused-import
+from service.models import Reason, RecommendationModel, db
+from tests.factories import RecFactory
+
+MIXES = {
+    "read": {"get": 40, "list": 40, "filter": 14, "create": 4, "activate": 1, "delete": 1},
+    "mixed": {"get": 30, "list": 25, "filter": 10, "create": 20, "activate": 10, "delete": 5},
+    "write": {"create": 50, "activate": 20, "delete": 20, "get": 10},
+}
+REASONS = [reason.name for reason in Reason]
+# request bodies made up front, so that the client does not compete with the
+# server for the CPU while the test runs
+CREATE_BODIES = 1000
+
+
+def parse_mix(value):
+    """Returns the operation weights of a mix name or of "op=weight,..." """
+    if value in MIXES:
+        return dict(MIXES[value])
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in MIXES["mixed"]:
+            raise argparse.ArgumentTypeError("unknown operation: %s" % name)
+        mix[name] = int(weight)
+    return mix
+
+
+def seed(rows, products):
+    """Replaces the table contents with rows factory Recommendations; returns their ids"""
+    RecommendationModel.delete_many()
+    RecommendationModel.import_rows(
+        (i, RecommendationModel.validate(RecFactory(original_product_id=i % products).serialize()))
+        for i in range(rows)
+    )
+    ids = [row[0] for row in db.session.query(RecommendationModel.id)]
+    db.session.remove()
+    return ids
+
+
+def git_revision():
+    """Returns the short git revision of the working tree, if any"""
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Traffic:
+    """The shared state of the connections: known ids, bodies and samples"""
+
+    def __init__(self, ids, products, mix):
+        self.ids = ids
+        self.products = products
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.bodies = [
+            json.dumps(dict(RecFactory(original_product_id=i % products).serialize(), id=None))
+            for i in range(CREATE_BODIES)
+        ]
+        self.reset()
+
+    def reset(self):
+        """Forgets the responses counted so far, e.g. after a warmup"""
+        self.samples = {name: [] for name in self.operations}
+        self.errors = {name: {} for name in self.operations}
+
+    def request(self):
+        """Returns (operation, method, path, body) of a random request"""
+        operation = random.choices(self.operations, self.weights)[0]
+        product_id = random.randrange(self.products)
+        if operation == "create":
+            return operation, "POST", "/recommendations", random.choice(self.bodies)
+        if operation == "list":
+            return operation, "GET", "/recommendations?original_product_id=%d" % product_id, None
+        if operation == "filter":
+            path = "/recommendations?reason=%s&activated=true&limit=50" % random.choice(REASONS)
+            return operation, "GET", path, None
+        if operation == "activate":
+            action = random.choice(("activate", "deactivate"))
+            path = "/recommendations/%s?original_product_id=%d" % (action, product_id)
+            return operation, "PUT", path, None
+        if not self.ids:
+            return operation, "GET", "/recommendations/0", None
+        if operation == "delete":
+            rec_id = self.ids.pop(random.randrange(len(self.ids)))
+            return operation, "DELETE", "/recommendations/%d" % rec_id, None
+        return operation, "GET", "/recommendations/%d" % random.choice(self.ids), None
+
+    def record(self, operation, seconds, code, body):
+        """Counts one response"""
+        self.samples[operation].append(seconds)
+        if code is None or code >= 400:
+            self.errors[operation][str(code)] = self.errors[operation].get(str(code), 0) + 1
+        elif operation == "create":
+            self.ids.append(json.loads(body)["id"])
+
+
+async def send(reader, writer, method, path, body):
+    """Sends one request and reads the response; returns (status, body, keep_alive)"""
+    head = "%s %s HTTP/1.1\r\nHost: localhost\r\n" % (method, path)
+    data = b""
+    if body is not None:
+        data = body.encode("utf-8")
+        head += "Content-Type: application/json\r\n"
+    head += "Content-Length: %d\r\n\r\n" % len(data)
+    writer.write(head.encode("latin-1") + data)
+    response = await reader.readuntil(b"\r\n\r\n")
+    lines = response.decode("latin-1").split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in lines[1:] if ": " in line)
+    payload = await reader.readexactly(int(headers.get("content-length", "0")))
+    return int(lines[0].split()[1]), payload, headers.get("connection") != "close"
+
+
+async def connection(port, traffic, deadline):
+    """Sends requests on one connection until the deadline, reconnecting as needed"""
+    conn = None
+    while time.monotonic() < deadline:
+        operation, method, path, body = traffic.request()
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = await asyncio.open_connection("127.0.0.1", port)
+            code, payload, keep_alive = await send(*conn, method, path, body)
+        except (OSError, asyncio.IncompleteReadError):
+            code, payload, keep_alive = None, b"", False
+        traffic.record(operation, time.perf_counter() - start, code, payload)
+        if not keep_alive and conn is not None:
+            conn[1].close()
+            conn = None
+    if conn is not None:
+        conn[1].close()
+
+
+async def drive(port, traffic, connections, seconds):
+    """Runs the connections for seconds"""
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[connection(port, traffic, deadline) for _ in range(connections)])
+
+
+def start_server(args):
+    """Starts gunicorn and waits until it answers"""
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "--workers=%d" % args.workers,
+            "--threads=%d" % args.threads, "--bind=127.0.0.1:%d" % args.port, "service:app",
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=5)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return server
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+
+def summary(samples, errors, seconds):
+    """Returns the figures of one operation, latencies in milliseconds"""
+    samples = sorted(samples)
+
+    def percentile(fraction):
+        if not samples:
+            return None
+        return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 2)
+
+    return {
+        "requests": len(samples),
+        "errors": sum(errors.values()),
+        "error_statuses": errors,
+        "requests_per_second": round(len(samples) / seconds, 1),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--mix", type=parse_mix, default="mixed")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    traffic = Traffic(seed(args.rows, args.products), args.products, args.mix)
+    server = start_server(args)
+    try:
+        if args.warmup:
+            asyncio.run(drive(args.port, traffic, args.connections, args.warmup))
+            traffic.reset()
+        asyncio.run(drive(args.port, traffic, args.connections, args.seconds))
+    finally:
+        server.terminate()
+        server.wait()
+
+    every_sample = [sample for samples in traffic.samples.values() for sample in samples]
+    every_error = {}
+    for errors in traffic.errors.values():
+        for code, count in errors.items():
+            every_error[code] = every_error.get(code, 0) + count
+    report = {
+        "revision": git_revision(),
+        "rows": args.rows,
+        "products": args.products,
+        "mix": args.mix,
+        "connections": args.connections,
+        "seconds": args.seconds,
+        "workers": args.workers,
+        "threads": args.threads,
+        "operations": {
+            name: summary(traffic.samples[name], traffic.errors[name], args.seconds)
+            for name in traffic.operations
+        },
+        "total": summary(every_sample, every_error, args.seconds),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
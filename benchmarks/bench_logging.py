@@ -0,0 +1,124 @@
+"""
+Benchmark: logging overhead per request
+
+Serves GET /recommendations/<id> from the per-worker cache with the test
+client, so that no database round trip hides the cost of logging, under
+four logging setups writing to a log file the way gunicorn writes to stderr:
+
+    off        level WARNING, nothing is logged (the floor)
+    sync       the handler formats and writes on the request thread
+    queue      the records are queued to a listener thread (LOG_QUEUE)
+    sampled    queued, keeping 1 in 100 INFO records of the routes (LOG_SAMPLING)
+
+The modes take turns for several rounds and the median of each is kept.
+Reports the wall and CPU microseconds per request of each setup, the
+difference to "off", and the bytes logged per request. CPU time includes
+the listener thread, which moves the work but does not remove it.
+
+Usage:
+    python -m benchmarks.bench_logging --requests 5000
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from service import app
+from service.cache import recommendation_cache
+from service.logs import SamplingFilter, configure_sampling, start_queue
+from service.models import RecommendationModel, db
+from tests.factories import RecFactory
+
+MODES = ("off", "sync", "queue", "sampled")
+FORMAT = logging.Formatter(
+    "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
+)
+
+
+def seed(rows):
+    """Replaces the table contents with rows Recommendations; returns their ids"""
+    RecommendationModel.delete_many()
+    RecommendationModel.import_rows(
+        (i, RecommendationModel.validate(RecFactory(original_product_id=i).serialize()))
+        for i in range(rows)
+    )
+    ids = [row[0] for row in db.session.query(RecommendationModel.id)]
+    db.session.remove()
+    return ids
+
+
+def configure(mode, stream):
+    """Sets up app.logger for a mode; returns its QueueListener, if any"""
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(FORMAT)
+    app.logger.handlers = [handler]
+    app.logger.propagate = False
+    app.logger.setLevel(logging.WARNING if mode == "off" else logging.INFO)
+    for old in [f for f in app.logger.filters if isinstance(f, SamplingFilter)]:
+        app.logger.removeFilter(old)
+    if mode == "sampled":
+        configure_sampling("%s=0.01" % app.logger.name)
+    if mode in ("queue", "sampled"):
+        return start_queue(app.logger)
+    return None
+
+
+def run(mode, args, ids, path):
+    """Returns the per-request figures of one mode"""
+    client = app.test_client()
+    paths = ["/recommendations/%d" % ids[i % len(ids)] for i in range(args.requests)]
+    with open(path, "w") as stream:
+        listener = configure(mode, stream)
+        for request_path in paths[:len(ids)]:
+            client.get(request_path)
+        stream.flush()
+        logged = os.path.getsize(path)
+        wall, cpu = time.perf_counter(), time.process_time()
+        for request_path in paths:
+            client.get(request_path)
+        if listener is not None:
+            listener.stop()
+        stream.flush()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        logged = os.path.getsize(path) - logged
+    return {
+        "wall_us": round(wall / args.requests * 1e6, 1),
+        "cpu_us": round(cpu / args.requests * 1e6, 1),
+        "bytes_logged": round(logged / args.requests, 1),
+    }
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    ids = seed(args.rows)
+    # every request is answered from the cache after the warmup
+    recommendation_cache.configure(len(ids), 3600)
+    runs = {mode: [] for mode in MODES}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "service.log")
+        for _ in range(args.rounds):
+            for mode in MODES:
+                runs[mode].append(run(mode, args, ids, path))
+    report = {"requests": args.requests, "rounds": args.rounds, "modes": {
+        mode: {name: statistics.median(figures[name] for figures in runs[mode])
+               for name in runs[mode][0]}
+        for mode in MODES
+    }}
+    floor = report["modes"]["off"]
+    for figures in report["modes"].values():
+        figures["wall_us_over_off"] = round(figures["wall_us"] - floor["wall_us"], 1)
+        figures["cpu_us_over_off"] = round(figures["cpu_us"] - floor["cpu_us"], 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
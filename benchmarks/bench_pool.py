@@ -0,0 +1,168 @@
+"""
+Benchmark: request latency against connection pool size under gunicorn
+
+Starts the service under gunicorn once per pool size (same command as the
+Procfile, plus --threads so that requests in one worker share its pool),
+drives it with concurrent keep-alive clients requesting
+GET /recommendations?original_product_id=X and reports the latency
+percentiles together with the worker's /debug/pool checkout waits.
+
+Usage:
+    python -m benchmarks.bench_pool --pool-sizes 1,2,4,8 --threads 8 --clients 16
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from service import app  # pylint: disable=unused-import
+from service.models import Reason, RecommendationModel, db
+
+ROWS_PER_PRODUCT = 20
+REASONS = list(Reason)
+
+
+def seed(products):
+    """Replaces the table contents with ROWS_PER_PRODUCT rows per product"""
+    db.session.query(RecommendationModel).delete()
+    db.session.commit()
+    RecommendationModel.create_many(
+        {
+            "name": "product-%d" % (i // ROWS_PER_PRODUCT),
+            "original_product_id": i // ROWS_PER_PRODUCT,
+            "recommendation_product_name": "target-%d" % i,
+            "recommendation_product_id": i,
+            "reason": REASONS[i % 4],
+            "activated": True,
+        }
+        for i in range(products * ROWS_PER_PRODUCT)
+    )
+
+
+def start_server(port, args, pool_size):
+    """Starts gunicorn with the given pool size and waits until it answers"""
+    env = dict(
+        os.environ,
+        DB_POOL_SIZE=str(pool_size),
+        DB_MAX_OVERFLOW="0",
+        DB_POOL_TIMEOUT=str(args.pool_timeout),
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "--workers=%d" % args.workers,
+            "--threads=%d" % args.threads, "--bind=127.0.0.1:%d" % port, "service:app",
+        ],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            status, _ = get(http.client.HTTPConnection("127.0.0.1", port), "/debug/pool")
+            if status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+
+def get(conn, path):
+    """Sends one GET on a keep-alive connection and returns (status, body)"""
+    conn.request("GET", path)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def run_clients(port, args):
+    """Runs args.clients clients for args.seconds; returns latencies and errors"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        samples = []
+        failed = 0
+        while time.monotonic() < deadline:
+            path = "/recommendations?original_product_id=%d" % random.randrange(args.products)
+            start = time.perf_counter()
+            try:
+                status, _ = get(conn, path)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+                status = None
+            samples.append(time.perf_counter() - start)
+            if status != 200:
+                failed += 1
+        conn.close()
+        with lock:
+            latencies.extend(samples)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def percentile(samples, fraction):
+    """Returns a percentile of sorted samples in milliseconds"""
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 2)
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pool-sizes", default="1,2,4,8")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--pool-timeout", type=float, default=30)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    seed(args.products)
+    db.session.remove()
+    results = []
+    for pool_size in [int(size) for size in args.pool_sizes.split(",")]:
+        server = start_server(args.port, args, pool_size)
+        try:
+            latencies, errors = run_clients(args.port, args)
+            _, body = get(http.client.HTTPConnection("127.0.0.1", args.port), "/debug/pool")
+        finally:
+            server.terminate()
+            server.wait()
+        pool = json.loads(body)
+        results.append({
+            "pool_size": pool_size,
+            "requests": len(latencies),
+            "errors": errors,
+            "requests_per_second": round(len(latencies) / args.seconds, 1),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "pool_wait_seconds_max": pool["wait_seconds_max"],
+            "pool_wait_ms_histogram": pool["wait_ms_histogram"],
+        })
+
+    print(json.dumps({
+        "workers": args.workers,
+        "threads": args.threads,
+        "clients": args.clients,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
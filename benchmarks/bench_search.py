@@ -0,0 +1,93 @@
+"""
+Benchmark: prefix search latency
+
+Fills recommendation_model with synthetic rows and times
+RecommendationModel.search() for prefixes from one that matches every row
+to one that matches none, with the prefix indexes and with index scans
+disabled (every row's lower(name) is compared). Reports the median and p95
+in milliseconds and the plan of each.
+
+Usage:
+    DATABASE_URI=postgresql://... python -m benchmarks.bench_search --rows 1000000
+"""
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import text
+
+from service import app  # pylint: disable=unused-import
+from service.models import RecommendationModel, db
+
+# names are "product-N" and "target-N", so "p" matches every row
+PREFIXES = ("p", "product-1", "Product-12345", "target-99", "product-123456", "zzz")
+
+SEED_SQL = """
+INSERT INTO recommendation_model
+    (name, original_product_id, recommendation_product_name,
+     recommendation_product_id, reason, activated)
+SELECT 'product-' || (g / 20), g / 20, 'target-' || ((g::bigint * 7919) % :targets),
+       (g::bigint * 7919) % :targets, 'UP_SELL', true
+FROM generate_series(1, :rows) AS g
+"""
+
+
+def seed(rows):
+    """Replaces the table contents with rows synthetic Recommendations"""
+    with db.engine.begin() as conn:
+        conn.execute(text("TRUNCATE recommendation_model"))
+        conn.execute(text(SEED_SQL), targets=max(rows // 10, 1), rows=rows)
+    with db.engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("VACUUM ANALYZE recommendation_model")
+        )
+
+
+def measure(args, indexed):
+    """Times search() for each prefix; returns {prefix: figures}"""
+    results = {}
+    for prefix in PREFIXES:
+        if not indexed:
+            db.session.execute(text("SET enable_indexscan = off"))
+            db.session.execute(text("SET enable_bitmapscan = off"))
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            matches = RecommendationModel.search(prefix, args.limit)
+            samples.append((time.perf_counter() - start) * 1000)
+        sql = RecommendationModel.search_query(prefix, args.limit).compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+        plan = db.session.execute(text("EXPLAIN " + str(sql).replace("%%", "%"))).fetchall()
+        db.session.rollback()
+        samples.sort()
+        results[prefix] = {
+            "matches": len(matches),
+            "median_ms": round(statistics.median(samples), 3),
+            "p95_ms": round(samples[max(int(len(samples) * 0.95) - 1, 0)], 3),
+            "plan": [row[0].strip() for row in plan if "Scan" in row[0]],
+        }
+    return results
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--unindexed-repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    report = {"rows": args.rows, "limit": args.limit, "indexed": measure(args, True)}
+    args.repeat = args.unindexed_repeat
+    report["unindexed"] = measure(args, False)
+    with db.engine.begin() as conn:
+        conn.execute(text("TRUNCATE recommendation_model"))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark: list serialization through the ORM against the column-tuple path
+
+Loads N rows into recommendation_model, then times building the
+GET /recommendations body both ways and checks that the bodies match:
+
+    orm   query -> RecommendationModel instances -> serialize() -> jsonify()
+    fast  RecommendationModel.rows() -> encoding.encode_array()
+
+Usage:
+    python -m benchmarks.bench_serialization --rows 100000
+"""
+import argparse
+import json
+import statistics
+import time
+
+from flask import jsonify
+
+from service import app
+from service.encoding import encode_array
+from service.models import Reason, RecommendationModel, db
+
+REASONS = list(Reason)
+
+
+def seed(rows):
+    """Replaces the table contents with synthetic rows"""
+    db.session.query(RecommendationModel).delete()
+    db.session.commit()
+    RecommendationModel.create_many(
+        {
+            "name": "product-%d" % (i // 20),
+            "original_product_id": i // 20,
+            "recommendation_product_name": "target-%d" % i,
+            "recommendation_product_id": i,
+            "reason": REASONS[i % 4],
+            "activated": i % 10 != 0,
+        }
+        for i in range(rows)
+    )
+
+
+def orm_body():
+    """Builds the list body the way list_recommendations used to"""
+    body = jsonify([rec.serialize() for rec in RecommendationModel.query]).get_data()
+    db.session.expunge_all()
+    return body
+
+
+def fast_body():
+    """Builds the list body from column tuples"""
+    return encode_array(RecommendationModel.rows().fetchall()).encode("utf-8")
+
+
+def best_of(func, repeat):
+    """Returns the result of func and its median run time in seconds"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return result, statistics.median(samples)
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.test_request_context():
+        seed(args.rows)
+        orm, orm_seconds = best_of(orm_body, args.repeat)
+        fast, fast_seconds = best_of(fast_body, args.repeat)
+        db.session.query(RecommendationModel).delete()
+        db.session.commit()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "identical": orm == fast,
+        "bytes": len(fast),
+        "orm_seconds": round(orm_seconds, 3),
+        "fast_seconds": round(fast_seconds, 3),
+        "speedup": round(orm_seconds / fast_seconds, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: per-worker adjacency indexes against one shared mmap snapshot
+
+Forks W worker processes that each load the adjacency index over the same
+synthetic edges, either by building their own CSRGraph (what every worker
+does without a snapshot) or by mapping one snapshot file. With all workers
+alive, reports the load time, lookup latency and the workers' combined PSS
+(proportional set size, which splits shared pages between the processes
+that map them). Linux only (reads /proc).
+
+Usage:
+    python -m benchmarks.bench_snapshot --edges 1000000 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.bench_adjacency import ROWS_PER_PRODUCT, synthetic_rows, timed
+from service.adjacency import AdjacencyIndex, CSRGraph
+from service.models import Reason
+from service.snapshot import SnapshotLoader, write_snapshot
+
+
+def memory_kb():
+    """Returns the Pss and Rss of this process in kB"""
+    values = {}
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            name, _, rest = line.partition(":")
+            if name in ("Pss", "Rss"):
+                values[name.lower()] = int(rest.split()[0])
+    return values
+
+
+def write(path, edges):
+    """Writes the snapshot of the synthetic edges"""
+    write_snapshot(CSRGraph.from_rows(synthetic_rows(edges)), path, time.time())
+
+
+def worker(mode, path, edges, repeat, loaded, results, done):
+    """Loads the index, times lookups and reports its memory once all are loaded"""
+    index = AdjacencyIndex(refresh_seconds=0)
+    if mode == "mmap":
+        loader = SnapshotLoader(path, Reason)
+    else:
+        loader = lambda: synthetic_rows(edges)
+    start = time.perf_counter()
+    index.start(loader, background=False)
+    load_seconds = time.perf_counter() - start
+    products = list(range(edges // ROWS_PER_PRODUCT))
+    lookup = timed(lambda p: index.lookup([p]), products, repeat)
+    # measure with every worker alive, so that shared pages are split
+    loaded.wait()
+    results.put({"load_seconds": load_seconds, "lookup": lookup, **memory_kb()})
+    done.wait()
+
+
+def run(mode, args, path):
+    """Runs the workers of one mode; returns their combined figures"""
+    ctx = multiprocessing.get_context("fork")
+    loaded = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    done = ctx.Event()
+    workers = [
+        ctx.Process(
+            target=worker, args=(mode, path, args.edges, args.repeat, loaded, results, done)
+        )
+        for _ in range(args.workers)
+    ]
+    for process in workers:
+        process.start()
+    reports = [results.get() for _ in workers]
+    done.set()
+    for process in workers:
+        process.join()
+    return {
+        "load_seconds_max": round(max(report["load_seconds"] for report in reports), 3),
+        "lookup_median_us": max(report["lookup"]["median_us"] for report in reports),
+        "lookup_p99_us": max(report["lookup"]["p99_us"] for report in reports),
+        "rss_mb_per_worker": round(max(report["rss"] for report in reports) / 1024, 1),
+        "pss_mb_total": round(sum(report["pss"] for report in reports) / 1024, 1),
+    }
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "recommendations.snapshot")
+        # written by a child so that the workers do not inherit its pages
+        writer = multiprocessing.get_context("fork").Process(target=write, args=(path, args.edges))
+        writer.start()
+        writer.join()
+        report = {
+            "edges": args.edges,
+            "workers": args.workers,
+            "snapshot_mb": round(os.path.getsize(path) / 2 ** 20, 1),
+            "build": run("build", args, path),
+            "mmap": run("mmap", args, path),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark: worker boot time, from import to first request
+
+For each SCHEMA_CHECK mode, runs fresh interpreters that time importing the
+service (which runs init_db) and serving a first request with the test
+client, and reports the medians in milliseconds. Then starts gunicorn with
+and without --preload and reports the time to the first response and the
+time a killed worker takes to be replaced and serve again.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 5 --workers 2
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+MODES = ("migrate", "check", "skip")
+
+# run in a fresh interpreter, prints the timings of one boot
+BOOT = """
+import json, time
+start = time.perf_counter()
+from service import app
+imported = time.perf_counter()
+app.test_client().get("/recommendations/0")
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_request_ms": (served - start) * 1000}))
+"""
+
+
+def boot(mode):
+    """Returns the timings of one boot with a SCHEMA_CHECK mode"""
+    output = subprocess.run(
+        [sys.executable, "-c", BOOT], env=dict(os.environ, SCHEMA_CHECK=mode),
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def wait_for_response(port, deadline):
+    """Polls the server until it answers; returns when it did"""
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/recommendations/0")
+            conn.getresponse().read()
+            return time.perf_counter()
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.005)
+    raise RuntimeError("gunicorn did not answer")
+
+
+def worker_pids(master):
+    """Returns the pids of the workers of a gunicorn master"""
+    output = subprocess.run(
+        ["ps", "-o", "pid=", "--ppid", str(master)], stdout=subprocess.PIPE, text=True,
+        check=False,
+    ).stdout
+    return [int(pid) for pid in output.split()]
+
+
+def serve(args, preload):
+    """Returns the first response and worker replacement times of gunicorn"""
+    command = [
+        sys.executable, "-m", "gunicorn", "--workers=%d" % args.workers,
+        "--bind=127.0.0.1:%d" % args.port, "service:app",
+    ]
+    if preload:
+        command.append("--preload")
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        command, env=dict(os.environ, SCHEMA_CHECK="check"),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        first = wait_for_response(args.port, time.monotonic() + 60) - start
+        # wait until every worker has booted before killing them
+        time.sleep(args.settle)
+        respawns = []
+        for pid in worker_pids(server.pid)[:args.runs]:
+            killed = time.perf_counter()
+            os.kill(pid, signal.SIGKILL)
+            # with one worker, the next response comes from its replacement
+            if args.workers == 1:
+                respawns.append((wait_for_response(args.port, time.monotonic() + 60) - killed) * 1000)
+            time.sleep(args.settle)
+    finally:
+        server.terminate()
+        server.wait()
+    report = {"first_response_ms": round(first * 1000, 1)}
+    if respawns:
+        report["respawn_to_response_ms"] = round(statistics.median(respawns), 1)
+    return report
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="seconds to let workers boot before killing one")
+    parser.add_argument("--port", type=int, default=8768)
+    args = parser.parse_args()
+
+    report = {"runs": args.runs, "workers": args.workers, "boot": {}}
+    for mode in MODES:
+        boots = [boot(mode) for _ in range(args.runs)]
+        report["boot"][mode] = {
+            name: round(statistics.median(timing[name] for timing in boots), 1)
+            for name in ("import_ms", "first_request_ms")
+        }
+    report["gunicorn"] = {
+        "default": serve(args, preload=False),
+        "preload": serve(args, preload=True),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
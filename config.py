@@ -16,7 +16,93 @@ if "VCAP_SERVICES" in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool of each worker process, see /debug/pool for its statistics.
+# Checkouts wait up to DB_POOL_TIMEOUT seconds once DB_POOL_SIZE +
+# DB_MAX_OVERFLOW connections are in use; DB_POOL_RECYCLE reopens connections
+# older than that many seconds (-1 never); DB_STATEMENT_TIMEOUT is in
+# milliseconds (0 for no limit). init_db() turns these into
+# SQLALCHEMY_ENGINE_OPTIONS.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "2"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+# Statements running longer than SLOW_QUERY_MS milliseconds are logged and
+# listed by /debug/slow-queries (0 disables the log). A SLOW_QUERY_SAMPLE_RATE
+# fraction of them is explained in the background, at most
+# SLOW_QUERY_EXPLAINS_PER_MINUTE per worker, each EXPLAIN stopped after
+# SLOW_QUERY_EXPLAIN_TIMEOUT milliseconds; the last SLOW_QUERY_HISTORY are kept.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+SLOW_QUERY_EXPLAINS_PER_MINUTE = int(os.getenv("SLOW_QUERY_EXPLAINS_PER_MINUTE", "6"))
+SLOW_QUERY_EXPLAIN_TIMEOUT = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", "5000"))
+SLOW_QUERY_HISTORY = int(os.getenv("SLOW_QUERY_HISTORY", "50"))
+
+# How each worker makes sure the schema is migrated when it boots: "check"
+# reads the schema version with one query and migrates only if it is behind,
+# "migrate" always runs the migrations (taking their lock and inspecting the
+# catalog), "skip" trusts the deploy to have run `flask recommendations migrate`
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "check")
+
+# Connections of each process of the async read path (service/asgi.py)
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "10"))
+
+# Rows per COPY batch (and per SAVEPOINT) for POST /recommendations/bulk
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "5000"))
+
+# Rows fetched per round trip from the server-side cursor of a streamed list
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Per-worker cache of serialized recommendations for GET /recommendations/<id>
+# (CACHE_SIZE entries, each kept for at most CACHE_TTL seconds; 0 disables it)
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "4096"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+
+# In-memory CSR index that serves GET /recommendations?original_product_id=
+# without a database query; rebuilt every ADJACENCY_INDEX_REFRESH seconds
+ADJACENCY_INDEX_ENABLED = os.getenv("ADJACENCY_INDEX_ENABLED", "false").lower() == "true"
+ADJACENCY_INDEX_REFRESH = float(os.getenv("ADJACENCY_INDEX_REFRESH", "300"))
+
+# Snapshot file written by `flask recommendations snapshot`; when set, every
+# worker maps it read-only as its adjacency index instead of building its
+# own, and maps the new file at the next refresh after it is replaced
+ADJACENCY_SNAPSHOT_PATH = os.getenv("ADJACENCY_SNAPSHOT_PATH", "")
+
+# API responses of at least COMPRESS_MIN_SIZE bytes are compressed with
+# brotli or gzip when the client accepts it (-1 disables compression);
+# streamed NDJSON is compressed whatever its size
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Output of `flask recommendations build-assets`: fingerprinted and
+# precompressed static files, served from /assets/ for ASSETS_MAX_AGE seconds
+ASSETS_DIR = os.getenv(
+    "ASSETS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "build", "assets")
+)
+ASSETS_MAX_AGE = int(os.getenv("ASSETS_MAX_AGE", "31536000"))
+
+# Most original_product_ids plus ids accepted by POST /recommendations/lookup
+LOOKUP_MAX_KEYS = int(os.getenv("LOOKUP_MAX_KEYS", "1000"))
+
+# Page sizes for GET /recommendations?limit=&cursor=
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Results of GET /recommendations/search?q= without a ?limit=, and the
+# longest prefix it accepts
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+SEARCH_MAX_LENGTH = int(os.getenv("SEARCH_MAX_LENGTH", "200"))
+
+# Log records are formatted and written by a listener thread instead of the
+# request thread unless LOG_QUEUE is false. LOG_SAMPLING keeps a fraction or
+# a rate of the INFO records of some loggers, e.g. "service=200/s" for the
+# routes or "service.models.queries=0.01" for the models' per-query messages
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
\ No newline at end of file
@@ -13,12 +13,9 @@ from compare import expect
 def step_impl(context):
     """ Delete all Recommendations and load new ones """
     headers = {'Content-Type': 'application/json'}
-    # list all of the Recommendations and delete them one by one
-    context.resp = requests.get(context.base_url + '/recommendations', headers=headers)
+    # delete all of the Recommendations in one request
+    context.resp = requests.delete(context.base_url + '/recommendations', headers=headers)
     expect(context.resp.status_code).to_equal(200)
-    for recommendation in context.resp.json():
-        context.resp = requests.delete(context.base_url + '/recommendations/' + str(recommendation["id"]), headers=headers)
-        expect(context.resp.status_code).to_equal(204)
     
     # load the database with new Recommendations
     create_url = context.base_url + '/recommendations'
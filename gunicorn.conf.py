@@ -0,0 +1,44 @@
+"""
+Gunicorn settings, read from the working directory by every gunicorn command
+
+With --preload the master imports the app, and so checks the schema, once;
+the workers fork from it with the app loaded. The master closes the
+connections it opened before forking, so that every worker opens its own.
+
+The workers write their Prometheus samples to files in
+PROMETHEUS_MULTIPROC_DIR so that GET /metrics can add up every worker's.
+The directory defaults to one per server under the temporary directory and
+is emptied when the server starts, since samples of an earlier server must
+not be counted again; the live samples of a worker that exits are dropped.
+"""
+import glob
+import os
+import tempfile
+
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "recommendations-metrics-%d" % os.getpid()),
+)
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Empties the metrics directory before the workers start"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for name in glob.glob(os.path.join(path, "*.db")):
+        os.remove(name)
+
+
+def when_ready(server):
+    """Closes the database connections a --preload master opened to load the app"""
+    if server.cfg.preload_app:
+        from service.models import db  # pylint: disable=import-outside-toplevel
+
+        db.engine.dispose()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Forgets the live samples of a worker that exited"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
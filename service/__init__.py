@@ -14,7 +14,7 @@ app = Flask(__name__)
 app.config.from_object("config")
 
 # Import the routes After the Flask app is created
-from service import routes, models, error_handlers
+from service import routes, models, error_handlers, commands, logs, compression
 
 # Set up logging for production
 if __name__ != "__main__":
@@ -28,7 +28,10 @@ if __name__ != "__main__":
     )
     for handler in app.logger.handlers:
         handler.setFormatter(formatter)
+    if app.config["LOG_QUEUE"]:
+        logs.start_queue(app.logger)
     app.logger.info("Logging handler established")
+logs.configure_sampling(app.config["LOG_SAMPLING"])
 
 app.logger.info(70 * "*")
 app.logger.info("  M Y   S E R V I C E   R U N N I N G  ".center(70, "*"))
@@ -0,0 +1,337 @@
+"""
+Module: adjacency
+Compact in-memory index of Recommendations keyed by original_product_id
+
+The index is laid out like a CSR (compressed sparse row) matrix: the
+Recommendations of products[i] are the edges offsets[i] to offsets[i + 1]
+of a set of parallel, array-backed edge columns. Memory use is
+
+    per edge     30 bytes   ids, targets "i" (4 + 4), name_refs,
+                            target_refs "I" (4 + 4), reasons, activated "b" (1 + 1),
+                            scores "d" (8), ranks "i" (4)
+    per product  12 bytes   products "i" (4) and offsets "q" (8)
+
+plus one copy of every distinct name in the string table. Writes made by
+this worker are applied to a small per-product overlay straight away; the
+arrays themselves are rebuilt from the database in a background thread
+when the overlay grows, when the index is older than its refresh interval
+(to pick up other workers' writes) or after a bulk write. A loader may also
+return a ready-made graph, such as a snapshot file mapped by every worker
+(see service/snapshot.py).
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+
+class CSRGraph:
+    """
+    An immutable CSR snapshot of Recommendation edges
+    Rows are (original_product_id, id, name, recommendation_product_id,
+    recommendation_product_name, Reason, activated, score, rank) tuples;
+    reasons are stored as their enum value and a null rank as 0.
+    """
+
+    # wall clock time at which the rows were read, if the graph knows it
+    created_at = 0.0
+    # the snapshot file the columns are mapped from, if any
+    path = None
+
+    def __init__(self):
+        self.products = array("i")
+        self.offsets = array("q", [0])
+        self.ids = array("i")
+        self.targets = array("i")
+        self.name_refs = array("I")
+        self.target_refs = array("I")
+        self.reasons = array("b")
+        self.activated = array("b")
+        self.scores = array("d")
+        self.ranks = array("i")
+        self.strings = []
+        self.reason_members = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds a graph from rows sorted by (original_product_id, id)"""
+        graph = cls()
+        interned = {}
+
+        def intern(value):
+            ref = interned.get(value)
+            if ref is None:
+                ref = interned[value] = len(graph.strings)
+                graph.strings.append(value)
+            return ref
+
+        for product_id, rec_id, name, target, target_name, reason, activated, score, rank in rows:
+            if not graph.products or graph.products[-1] != product_id:
+                if graph.products:
+                    graph.offsets.append(len(graph.ids))
+                graph.products.append(product_id)
+            graph.ids.append(rec_id)
+            graph.targets.append(target)
+            graph.name_refs.append(intern(name))
+            graph.target_refs.append(intern(target_name))
+            graph.reasons.append(reason.value)
+            graph.reason_members[reason.value] = reason
+            graph.activated.append(1 if activated else 0)
+            graph.scores.append(score)
+            graph.ranks.append(rank or 0)
+        if graph.products:
+            graph.offsets.append(len(graph.ids))
+        return graph
+
+    def edges(self, product_id) -> list:
+        """Returns the rows of one product ordered by id"""
+        i = bisect_left(self.products, product_id)
+        if i == len(self.products) or self.products[i] != product_id:
+            return []
+        strings = self.strings
+        reasons = self.reason_members
+        return [
+            (product_id, self.ids[j], strings[self.name_refs[j]], self.targets[j],
+             strings[self.target_refs[j]], reasons[self.reasons[j]], bool(self.activated[j]),
+             self.scores[j], self.ranks[j] or None)
+            for j in range(self.offsets[i], self.offsets[i + 1])
+        ]
+
+    def rows(self):
+        """Yields every row in (original_product_id, id) order"""
+        for product_id in self.products:
+            yield from self.edges(product_id)
+
+    def nbytes(self) -> int:
+        """Returns the size of the arrays, excluding the string table"""
+        columns = (self.products, self.offsets, self.ids, self.targets,
+                   self.name_refs, self.target_refs, self.reasons, self.activated,
+                   self.scores, self.ranks)
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+def serialize_row(row) -> dict:
+    """Returns an index row in the RecommendationModel.serialize() format"""
+    product_id, rec_id, name, target, target_name, reason, activated, score, rank = row
+    return {
+        "id": rec_id,
+        "name": name,
+        "original_product_id": product_id,
+        "recommendation_product_name": target_name,
+        "recommendation_product_id": target,
+        "reason": reason.name,
+        "activated": activated,
+        "score": score,
+        "rank": rank,
+    }
+
+
+class AdjacencyIndex:
+    """
+    Serving index for "recommendations for product X" queries
+    The index answers lookups only while ready; callers fall back to the
+    database otherwise.
+    """
+
+    def __init__(self, refresh_seconds: float = 300, compact_threshold: int = 10000,
+                 retry_seconds: float = 5):
+        self.refresh_seconds = refresh_seconds
+        self.compact_threshold = compact_threshold
+        self.retry_seconds = retry_seconds
+        self._loader = None
+        self._lock = threading.Lock()
+        self._graph = CSRGraph()
+        self._overlay = {}
+        self._built_at = 0.0
+        self._building = False
+        self._invalidations = 0
+        self._invalidated_at = 0.0
+        self.ready = False
+        self.lookups = 0
+
+    def start(self, loader, refresh_seconds: float = None, background: bool = True):
+        """
+        Enables the index and builds it from loader
+        Args:
+            loader (callable): returns rows sorted by (original_product_id, id),
+                or a CSRGraph whose created_at tells when its rows were read
+            background (bool): build in a background thread instead of now
+        """
+        self._loader = loader
+        if refresh_seconds is not None:
+            self.refresh_seconds = refresh_seconds
+        self.refresh(background)
+
+    def stop(self):
+        """Disables the index and frees its memory"""
+        with self._lock:
+            self._loader = None
+            self._graph = CSRGraph()
+            self._overlay = {}
+            self.ready = False
+
+    @property
+    def enabled(self) -> bool:
+        """True if the index has been started"""
+        return self._loader is not None
+
+    def refresh(self, background: bool = True):
+        """Rebuilds the arrays from the database, keeping newer overlay rows"""
+        with self._lock:
+            if self._loader is None or self._building:
+                return
+            self._building = True
+        if background:
+            threading.Thread(target=self._rebuild, name="adjacency-index", daemon=True).start()
+        else:
+            self._rebuild()
+
+    def _rebuild(self):
+        """Loads a new graph and swaps it in"""
+        with self._lock:
+            invalidations = self._invalidations
+            loader = self._loader
+        try:
+            start = time.perf_counter()
+            started_at = time.time()
+            graph = loader()
+            if not isinstance(graph, CSRGraph):
+                graph = CSRGraph.from_rows(graph)
+            created_at = graph.created_at or started_at
+            with self._lock:
+                if self._loader is None:
+                    return
+                self._graph = graph
+                # keep overlay rows written after the graph's rows were read
+                self._overlay = {
+                    product_id: entry for product_id, entry in self._overlay.items()
+                    if entry[1] > created_at
+                }
+                self._built_at = time.monotonic()
+                # a bulk write during the load, or after the snapshot was
+                # written, may be missing from this graph
+                self.ready = created_at >= self._invalidated_at
+            logger.info(
+                "Adjacency index built: %d products, %d edges, %d bytes in %.2fs",
+                len(graph.products), len(graph.ids), graph.nbytes(), time.perf_counter() - start,
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Adjacency index build failed: %s", error)
+        finally:
+            with self._lock:
+                self._building = False
+                again = self._loader is not None and not self.ready
+        if again and invalidations != self._invalidations:
+            self.refresh()
+        elif again and self.retry_seconds:
+            # a failed load or a snapshot older than a bulk write
+            retry = threading.Timer(self.retry_seconds, self.refresh)
+            retry.daemon = True
+            retry.start()
+
+    def invalidate(self, background: bool = True):
+        """Stops serving until a rebuild has picked up a bulk write"""
+        with self._lock:
+            self._invalidations += 1
+            self._invalidated_at = time.time()
+            self.ready = False
+        self.refresh(background)
+
+    def after_fork(self):
+        """Restarts a build or retry of the parent, whose threads the fork did not copy"""
+        self._lock = threading.Lock()
+        self._building = False
+        if self.enabled and not self.ready:
+            self.refresh()
+
+    def edges(self, product_id) -> list:
+        """Returns the current rows of one product ordered by id"""
+        with self._lock:
+            entry = self._overlay.get(product_id)
+            graph = self._graph
+        if entry is not None:
+            return entry[0]
+        return graph.edges(product_id)
+
+    def lookup(self, product_ids, activated=None, reasons=None, top=None) -> list:
+        """
+        Returns serialized Recommendations for the given products
+        Args:
+            product_ids (list): original_product_id values
+            activated (bool): only return rows with this activated value
+            reasons (list): only return rows with one of these Reasons
+            top (int): only return the top best scored rows of each product,
+            ordered like RecommendationModel.top()
+        """
+        self.lookups += 1
+        if self.refresh_seconds and time.monotonic() - self._built_at > self.refresh_seconds:
+            self.refresh()
+        reasons = None if reasons is None else set(reasons)
+        # a product listed twice is returned once, as by the database
+        if top is not None:
+            product_ids = sorted(set(product_ids))
+        else:
+            product_ids = list(dict.fromkeys(product_ids))
+        results = []
+        for product_id in product_ids:
+            rows = [
+                row for row in self.edges(product_id)
+                if (activated is None or row[6] == activated)
+                and (reasons is None or row[5] in reasons)
+            ]
+            if top is not None:
+                rows = heapq.nsmallest(top, rows, key=lambda row: (-row[7], row[1]))
+            results.extend(serialize_row(row) for row in rows)
+        return results
+
+    def apply(self, row, previous_product_id=None):
+        """Adds or replaces one row after a local write"""
+        if not self.enabled:
+            return
+        if previous_product_id is not None and previous_product_id != row[0]:
+            self.remove(previous_product_id, row[1])
+        rows = [edge for edge in self.edges(row[0]) if edge[1] != row[1]]
+        rows.append(row)
+        rows.sort(key=lambda edge: edge[1])
+        self._set_overlay(row[0], rows)
+
+    def remove(self, product_id, rec_id):
+        """Removes one row after a local delete"""
+        if not self.enabled:
+            return
+        rows = [edge for edge in self.edges(product_id) if edge[1] != rec_id]
+        self._set_overlay(product_id, rows)
+
+    def _set_overlay(self, product_id, rows):
+        """Stores the rows of a product in the overlay"""
+        with self._lock:
+            self._overlay[product_id] = (rows, time.time())
+            oversized = len(self._overlay) > self.compact_threshold
+        if oversized:
+            self.refresh()
+
+    def stats(self) -> dict:
+        """Returns the size of the index"""
+        with self._lock:
+            graph = self._graph
+            return {
+                "ready": self.ready,
+                "snapshot": graph.path,
+                "created_at": graph.created_at or None,
+                "products": len(graph.products),
+                "edges": len(graph.ids),
+                "array_bytes": graph.nbytes(),
+                "strings": len(graph.strings),
+                "overlay_products": len(self._overlay),
+                "lookups": self.lookups,
+            }
+
+
+# The serving index used by list_recommendations, started by init_db()
+adjacency_index = AdjacencyIndex()
+os.register_at_fork(after_in_child=adjacency_index.after_fork)
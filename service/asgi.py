@@ -0,0 +1,335 @@
+"""
+Module: asgi
+Async read path for the recommendations API
+
+An ASGI application that serves the read endpoints
+
+    GET /recommendations          filters, ?limit=&cursor= pages, ?top=, NDJSON
+    GET /recommendations/{id}
+
+from an asyncpg connection pool, so that one process keeps hundreds of
+requests waiting on Postgres at once instead of one per gunicorn worker.
+Writes stay on the Flask app: every other path or method is answered with
+404 or 405. Run it next to (or instead of) gunicorn with
+
+    uvicorn service.asgi:app --workers N
+
+The app reuses the Flask app's config, the RecommendationModel table and
+filter parsing, and the column-tuple encoder, so the bodies, Link headers,
+ETags and error documents are the same as those of the Flask routes. It
+always encodes with Flask's default JSON settings. If-None-Match is
+compared weakly, as by the Flask routes, so that the weak ETags of their
+compressed responses revalidate here too.
+"""
+import asyncio
+import json
+import logging
+
+import asyncpg
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import NotFound
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.urls import url_decode, url_encode
+
+from service import app as flask_app
+from service import status
+from service.encoding import encode_array, encode_row
+from service.models import DataValidationError, Generation, Reason, RecommendationModel
+from service.routes import (
+    decode_cursor, encode_cursor, hash_list_etag, ndjson_requested, page_limit, top_k
+)
+
+logger = logging.getLogger(__name__)
+
+TABLE = RecommendationModel.__tablename__
+COLUMNS = ", ".join(RecommendationModel.ROW_COLUMNS)
+SELECT_ROWS = "SELECT %s FROM %s" % (COLUMNS, TABLE)
+ORDER_BY_SCORE = " ORDER BY original_product_id, score DESC, id"
+SELECT_ONE = "SELECT %s, version FROM %s WHERE id = $1" % (
+    ", ".join(RecommendationModel.ROW_COLUMNS), TABLE
+)
+SELECT_GENERATIONS = "SELECT scope, generation FROM %s WHERE scope = ANY($1)" % (
+    Generation.__tablename__
+)
+REASONS = {reason.name: reason for reason in Reason}
+JSON_MIMETYPE = flask_app.config["JSONIFY_MIMETYPE"]
+
+
+def to_row(record) -> tuple:
+    """Returns an asyncpg record as a RecommendationModel.rows() tuple"""
+    (activated, rec_id, name, original_product_id, rank, reason,
+     target, target_name, score) = record[:9]
+    return (activated, rec_id, name, original_product_id, rank, REASONS[reason],
+            target, target_name, score)
+
+
+def list_query(filters: dict, limit: int = None, after_id: int = None, params=None):
+    """
+    Returns the SQL and arguments of a list query
+    Like find_by_filters(), every filter is ANDed and a list of values
+    becomes = ANY($n); pages are ordered by id like page_query().
+    """
+    clauses = []
+    params = [] if params is None else params
+    for key, values in filters.items():
+        if key not in RecommendationModel.FILTER_PARSERS:
+            raise DataValidationError("Invalid filter: " + key)
+        if key == "reason":
+            values = [reason.name for reason in values]
+        params.append(list(values))
+        clauses.append("%s = ANY($%d)" % (key, len(params)))
+    if after_id is not None:
+        params.append(after_id)
+        clauses.append("id > $%d" % len(params))
+    sql = SELECT_ROWS
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    if limit is not None:
+        params.append(limit)
+        sql += " ORDER BY id LIMIT $%d" % len(params)
+    return sql, params
+
+
+def top_query(filters: dict, top: int):
+    """
+    Returns the SQL and arguments of a ?top= query, like RecommendationModel.top()
+    The products of an original_product_id filter each get a LATERAL
+    ORDER BY score DESC, id LIMIT top subquery; otherwise a row_number()
+    window ranks every product.
+    """
+    filters = dict(filters)
+    product_ids = filters.pop("original_product_id", None)
+    if product_ids is None:
+        sql, params = list_query(filters)
+        sql = sql.replace(
+            " FROM ", ", row_number() OVER (PARTITION BY original_product_id "
+            "ORDER BY score DESC, id) AS position FROM ", 1
+        )
+        params.append(top)
+        return "SELECT %s FROM (%s) AS ranked WHERE position <= $%d%s" % (
+            COLUMNS, sql, len(params), ORDER_BY_SCORE
+        ), params
+    params = [sorted(set(product_ids))]
+    sql, params = list_query(filters, params=params)
+    sql += (" AND " if " WHERE " in sql else " WHERE ") + "original_product_id = product_id"
+    params.append(top)
+    return (
+        "SELECT %s FROM unnest($1::integer[]) AS products(product_id) CROSS JOIN LATERAL "
+        "(%s ORDER BY score DESC, id LIMIT $%d) AS best%s"
+    ) % (COLUMNS, sql, len(params), ORDER_BY_SCORE), params
+
+
+def error_body(code: int, error: str, message: str) -> bytes:
+    """Returns the JSON error document of service.error_handlers"""
+    body = {"error": error, "message": message, "status": code}
+    return (json.dumps(body, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class Request:
+    """The parts of an ASGI HTTP scope that the read endpoints use"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.path = scope["path"]
+        self.method = scope["method"]
+        self.args = url_decode(scope.get("query_string", b"").decode("latin-1"))
+        self.headers = {
+            name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]
+        }
+        self.accept_mimetypes = parse_accept_header(self.headers.get("accept"), MIMEAccept)
+        self.if_none_match = parse_etags(self.headers.get("if-none-match"))
+
+    def url(self, path: str, args: dict) -> str:
+        """Returns an absolute URL on this host, like url_for(_external=True)"""
+        host = self.headers.get("host", "localhost")
+        query = url_encode(args)
+        return "%s://%s%s%s%s" % (
+            self.scope.get("scheme", "http"), host, self.scope.get("root_path", ""),
+            path, "?" + query if query else "",
+        )
+
+
+class RecommendationsApp:
+    """
+    ASGI application for the read endpoints
+    The asyncpg pool is opened by the lifespan startup event, or lazily by
+    the first request if the server does not send lifespan events.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = None
+        self._opening = None
+
+    async def open(self):
+        """Opens the connection pool, once"""
+        if self._opening is None:
+            self._opening = asyncio.ensure_future(self._create_pool())
+        await self._opening
+
+    async def _create_pool(self):
+        """Creates the asyncpg pool with the DB_* settings that apply to it"""
+        server_settings = {}
+        if self.config["DB_STATEMENT_TIMEOUT"]:
+            server_settings["statement_timeout"] = str(self.config["DB_STATEMENT_TIMEOUT"])
+        self.pool = await asyncpg.create_pool(
+            self.config["SQLALCHEMY_DATABASE_URI"],
+            min_size=1,
+            max_size=self.config["ASYNC_POOL_SIZE"],
+            server_settings=server_settings,
+        )
+        logger.info("Async read path connected with %d connections", self.config["ASYNC_POOL_SIZE"])
+
+    async def close(self):
+        """Closes the connection pool"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self._opening = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if self.pool is None:
+            await self.open()
+        request = Request(scope)
+        try:
+            await self.dispatch(request, send)
+        except DataValidationError as error:
+            await self.respond(send, status.HTTP_400_BAD_REQUEST,
+                               error_body(status.HTTP_400_BAD_REQUEST, "Bad Request", str(error)))
+        except NotFound as error:
+            await self.respond(send, status.HTTP_404_NOT_FOUND,
+                               error_body(status.HTTP_404_NOT_FOUND, "Not Found", str(error)))
+
+    async def lifespan(self, receive, send):
+        """Opens and closes the pool with the server"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.open()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, request: Request, send):
+        """Routes a request to the read endpoints"""
+        parts = request.path.rstrip("/").split("/")
+        if len(parts) not in (2, 3) or parts[1] != "recommendations":
+            raise NotFound()
+        if request.method != "GET":
+            await self.respond(send, status.HTTP_405_METHOD_NOT_ALLOWED, error_body(
+                status.HTTP_405_METHOD_NOT_ALLOWED, "Method not Allowed",
+                "405 Method Not Allowed: writes are served by the Flask app",
+            ))
+            return
+        if len(parts) == 2:
+            await self.list_recommendations(request, send)
+            return
+        if not parts[2].isdigit():
+            raise NotFound()
+        await self.get_recommendation(request, send, int(parts[2]))
+
+    async def get_recommendation(self, request: Request, send, rec_id: int):
+        """GET /recommendations/{id}"""
+        record = await self.pool.fetchrow(SELECT_ONE, rec_id)
+        if record is None:
+            raise NotFound("Recommendation with id '{}' was not found.".format(rec_id))
+        etag = "%s-%s" % (rec_id, record["version"])  # as RecommendationModel.etag()
+        if request.if_none_match.contains_weak(etag):
+            await self.respond(send, status.HTTP_304_NOT_MODIFIED, b"", etag=etag)
+            return
+        body = (encode_row(to_row(record)) + "\n").encode("utf-8")
+        await self.respond(send, status.HTTP_200_OK, body, etag=etag)
+
+    async def list_recommendations(self, request: Request, send):
+        """GET /recommendations, see routes.list_recommendations()"""
+        filters = RecommendationModel.filters_from_args(request.args)
+        ndjson = ndjson_requested(request.args, request.accept_mimetypes)
+        top = top_k(request.args)
+        etag = await self.list_etag(request, filters, ndjson)
+        if request.if_none_match.contains_weak(etag):
+            await self.respond(send, status.HTTP_304_NOT_MODIFIED, b"", etag=etag)
+            return
+
+        if top is not None:
+            sql, params = top_query(filters, top)
+        elif "limit" in request.args or "cursor" in request.args:
+            await self.page(request, send, filters, etag)
+            return
+        else:
+            sql, params = list_query(filters)
+        if ndjson:
+            await self.stream(send, sql, params, etag)
+        else:
+            rows = [to_row(record) for record in await self.pool.fetch(sql, *params)]
+            await self.respond(send, status.HTTP_200_OK, encode_array(rows).encode("utf-8"), etag=etag)
+
+    async def list_etag(self, request: Request, filters: dict, ndjson: bool) -> str:
+        """Returns the list ETag from the generation counters, as routes.list_etag()"""
+        scopes = Generation.scopes(filters.get("original_product_id"))
+        found = dict(await self.pool.fetch(SELECT_GENERATIONS, scopes))
+        generations = tuple(found.get(scope, 0) for scope in scopes)
+        return hash_list_etag(generations, request.args, ndjson)
+
+    async def page(self, request: Request, send, filters: dict, etag: str):
+        """Sends one keyset page with a Link to the next one"""
+        limit = page_limit(request.args)
+        after_id = decode_cursor(request.args["cursor"]) if "cursor" in request.args else None
+        sql, params = list_query(filters, limit + 1, after_id)
+        rows = [to_row(record) for record in await self.pool.fetch(sql, *params)]
+        headers = []
+        if len(rows) > limit:
+            rows = rows[:limit]
+            cursor = encode_cursor(rows[-1][1])
+            args = request.args.to_dict()
+            args["cursor"] = cursor
+            args["limit"] = limit
+            next_url = request.url("/recommendations", args)
+            headers.append((b"link", ('<%s>; rel="next"' % next_url).encode("latin-1")))
+            headers.append((b"x-next-cursor", cursor.encode("latin-1")))
+        body = encode_array(rows).encode("utf-8")
+        await self.respond(send, status.HTTP_200_OK, body, headers, etag=etag)
+
+    async def stream(self, send, sql: str, params: list, etag: str):
+        """Streams the rows of a query as NDJSON from a server-side cursor"""
+        batch_size = self.config["STREAM_BATCH_SIZE"]
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_200_OK,
+            "headers": [(b"content-type", b"application/x-ndjson"),
+                        (b"etag", ('"%s"' % etag).encode("latin-1"))],
+        })
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                lines = []
+                async for record in conn.cursor(sql, *params, prefetch=batch_size):
+                    lines.append(encode_row(to_row(record)))
+                    if len(lines) >= batch_size:
+                        chunk = "\n".join(lines) + "\n"
+                        await send({"type": "http.response.body",
+                                    "body": chunk.encode("utf-8"), "more_body": True})
+                        lines = []
+        chunk = "\n".join(lines) + "\n" if lines else ""
+        await send({"type": "http.response.body", "body": chunk.encode("utf-8")})
+
+    @staticmethod
+    async def respond(send, code: int, body: bytes, headers=(), etag: str = None):
+        """Sends a complete response"""
+        all_headers = [(b"content-length", str(len(body)).encode("latin-1"))]
+        if code != status.HTTP_304_NOT_MODIFIED:
+            all_headers.append((b"content-type", JSON_MIMETYPE.encode("latin-1")))
+        if etag is not None:
+            all_headers.append((b"etag", ('"%s"' % etag).encode("latin-1")))
+        all_headers.extend(headers)
+        await send({"type": "http.response.start", "status": code, "headers": all_headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+# The application served by "uvicorn service.asgi:app"
+app = RecommendationsApp(flask_app.config)
@@ -0,0 +1,123 @@
+"""
+Module: assets
+Fingerprinted and precompressed static assets
+
+`flask recommendations build-assets` copies every file of service/static to
+ASSETS_DIR under a name that carries a hash of its contents, e.g.
+
+    js/rest_api.js -> js/rest_api.5d41402abc4b.js
+
+next to .gz and .br copies compressed at the highest levels, and writes an
+index.html whose static/ references point to the fingerprinted names under
+/assets/. A fingerprinted file never changes, so it is served with a
+one-year immutable Cache-Control; index.html is revalidated on every load.
+The precompressed copy the client accepts is sent as is, so no CPU is
+spent compressing static files per request.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import send_from_directory
+
+from service.compression import accepted_encoding, brotli
+
+MANIFEST = "manifest.json"
+# extensions worth compressing; images are already compressed
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".html", ".json", ".svg", ".txt"}
+# static/... in the src and href attributes of index.html
+STATIC_REFERENCE = re.compile(r'((?:src|href)\s*=\s*")static/([^"]+)(")')
+
+
+def fingerprinted(name: str, data: bytes) -> str:
+    """Returns name with a hash of data before its extension"""
+    root, ext = os.path.splitext(name)
+    return "%s.%s%s" % (root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def _write(out_dir: str, name: str, data: bytes) -> dict:
+    """Writes a file and its compressed copies; returns their sizes"""
+    path = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sizes = {"identity": len(data)}
+    variants = {"identity": data}
+    if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+        # mtime 0 so that a rebuild writes the same bytes
+        variants["gzip"] = gzip.compress(data, 9, mtime=0)
+        if brotli is not None:
+            variants["br"] = brotli.compress(data, quality=11)
+    for encoding, body in variants.items():
+        if encoding != "identity" and len(body) >= len(data):
+            continue
+        suffix = {"identity": "", "gzip": ".gz", "br": ".br"}[encoding]
+        with open(path + suffix, "wb") as file:
+            file.write(body)
+        sizes[encoding] = len(body)
+    return sizes
+
+
+def build_assets(static_dir: str, out_dir: str) -> dict:
+    """
+    Writes the fingerprinted and compressed copies of the static files
+    Args:
+        static_dir (str): the source files, with index.html at the top
+        out_dir (str): where to write them; older builds' files are kept, so
+            pages still cached by clients can load their assets
+    Returns the manifest: {"files": {name: fingerprinted name}, "bytes": {...}}
+    """
+    files = {}
+    totals = {"identity": 0, "gzip": 0, "br": 0}
+    for root, _, names in os.walk(static_dir):
+        for filename in sorted(names):
+            name = os.path.relpath(os.path.join(root, filename), static_dir).replace(os.sep, "/")
+            if name == "index.html":
+                continue
+            with open(os.path.join(static_dir, name), "rb") as file:
+                data = file.read()
+            files[name] = fingerprinted(name, data)
+            for encoding, size in _write(out_dir, files[name], data).items():
+                totals[encoding] += size
+    with open(os.path.join(static_dir, "index.html"), encoding="utf-8") as file:
+        page = STATIC_REFERENCE.sub(
+            lambda match: "%sassets/%s%s" % (
+                match.group(1), files.get(match.group(2), match.group(2)), match.group(3)
+            ),
+            file.read(),
+        )
+    _write(out_dir, "index.html", page.encode("utf-8"))
+    manifest = {"files": files, "bytes": totals}
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+def assets_built(out_dir: str) -> bool:
+    """True if build_assets has written out_dir"""
+    return os.path.exists(os.path.join(out_dir, MANIFEST))
+
+
+def send_asset(out_dir: str, name: str, accept_encodings, cache_control: str):
+    """
+    Returns a response for a built asset, precompressed if the client accepts it
+    Args:
+        out_dir (str): the ASSETS_DIR of build_assets
+        name (str): the file, relative to out_dir
+        accept_encodings: the request's Accept-Encoding header
+        cache_control (str): the Cache-Control header of the response
+    """
+    mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    encoding = None
+    if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+        encoding = accepted_encoding(accept_encodings)
+    suffix = {"br": ".br", "gzip": ".gz"}.get(encoding)
+    if suffix is None or not os.path.isfile(os.path.join(out_dir, name + suffix)):
+        encoding, suffix = None, ""
+    response = send_from_directory(out_dir, name + suffix, mimetype=mimetype)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,110 @@
+"""
+Module: cache
+In-process caches for serialized Recommendations
+
+Each worker process keeps its own cache; entries are invalidated by the
+model whenever this process writes a Recommendation, and expire after a
+TTL so that writes made by other workers become visible.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A bounded, thread safe LRU cache whose entries expire after a TTL
+
+    Reads that miss should call version() before querying the database and
+    pass it to set(), so a value read before a concurrent invalidation is
+    not stored after it.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, maxsize: int, ttl: float):
+        """Resizes the cache and changes the TTL, dropping every entry"""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+            self._version += 1
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, version: int = None):
+        """
+        Stores value under key, evicting the least recently used entry if full
+        Args:
+            version (int): the version() read before value was loaded; the
+            value is dropped if an invalidation happened since then
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def version(self) -> int:
+        """Returns a token that changes on every invalidation"""
+        return self._version
+
+    def invalidate(self, *keys):
+        """Removes the given keys"""
+        with self._lock:
+            self._version += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the cache counters"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# Serialized Recommendations keyed by id, sized from config in init_db()
+recommendation_cache = LRUCache()
@@ -0,0 +1,119 @@
+"""
+Module: commands
+Flask CLI commands of the service
+
+flask recommendations import FEED - loads a CSV or JSONL feed with COPY
+flask recommendations snapshot [PATH] - writes the adjacency index snapshot
+flask recommendations migrate - applies the pending schema migrations
+flask recommendations build-assets - fingerprints and precompresses service/static
+"""
+import time
+
+import click
+from flask.cli import AppGroup
+from service import app
+from service.adjacency import CSRGraph
+from service.assets import build_assets
+from service.importer import FORMATS, FeedImport, detect_format, open_feed
+from service.models import DataValidationError, RecommendationModel, migrate
+from service.snapshot import write_snapshot
+
+recommendations_cli = AppGroup("recommendations", help="Manage Recommendations.")
+
+
+@recommendations_cli.command("import")
+@click.argument("feed", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS),
+              help="Feed format; guessed from the file name (.csv, .jsonl, .ndjson, .gz).")
+@click.option("--rejects", type=click.Path(dir_okay=False, writable=True),
+              help="Write the rejected records to this JSONL file.")
+@click.option("--progress", "progress_every", type=click.IntRange(min=0), default=100000,
+              show_default=True, help="Report progress every N records, 0 for never.")
+@click.option("--max-rejects", type=click.IntRange(min=-1), default=-1, show_default=True,
+              help="Abort without importing anything after more rejected records, -1 for no limit.")
+def import_feed(feed, fmt, rejects, progress_every, max_rejects):
+    """Import the Recommendations of a CSV or JSONL FEED.
+
+    A CSV feed has a header line naming the serialize() fields; a JSONL feed
+    has one Recommendation object per line. Records are matched on
+    (original_product_id, recommendation_product_id): matching
+    Recommendations are updated, the others created, all in one transaction.
+    """
+    fmt = fmt or detect_format(feed)
+    if fmt is None:
+        raise click.BadParameter("cannot guess the format, use --format", param_hint="FEED")
+
+    def report(feed_import):
+        click.echo(
+            "%d records read, %d rejected (%.0f records/s)"
+            % (feed_import.read, feed_import.rejected, feed_import.rate),
+            err=True,
+        )
+
+    reject_file = open(rejects, "w", encoding="utf-8") if rejects else None
+    try:
+        with open_feed(feed) as stream:
+            feed_import = FeedImport(stream, fmt, reject_file, report, progress_every, max_rejects)
+            stats = feed_import.run()
+    except DataValidationError as error:
+        raise click.ClickException(str(error)) from error
+    finally:
+        if reject_file is not None:
+            reject_file.close()
+    click.echo(
+        "Imported {read} records in {seconds:.1f}s ({rows_per_second:.0f} records/s): "
+        "{inserted} inserted, {updated} updated, {unchanged} unchanged, "
+        "{rejected} rejected".format(**stats)
+    )
+
+
+@recommendations_cli.command("snapshot")
+@click.argument("path", required=False, type=click.Path(dir_okay=False, writable=True))
+def snapshot(path):
+    """Write every Recommendation to the snapshot file at PATH.
+
+    PATH defaults to ADJACENCY_SNAPSHOT_PATH. The new file replaces the old
+    one atomically; workers map it at their next index refresh.
+    """
+    path = path or app.config["ADJACENCY_SNAPSHOT_PATH"]
+    if not path:
+        raise click.UsageError("give a PATH or set ADJACENCY_SNAPSHOT_PATH")
+    start = time.perf_counter()
+    created_at = time.time()
+    graph = CSRGraph.from_rows(RecommendationModel.adjacency_rows(app))
+    size = write_snapshot(graph, path, created_at)
+    click.echo(
+        "Wrote %d products, %d recommendations, %d strings (%d bytes) to %s in %.1fs"
+        % (len(graph.products), len(graph.ids), len(graph.strings), size, path,
+           time.perf_counter() - start)
+    )
+
+
+@recommendations_cli.command("migrate")
+def migrate_schema():
+    """Apply the pending schema migrations.
+
+    Run it once per deploy when the workers boot with SCHEMA_CHECK=skip.
+    """
+    click.echo("Schema at version %d" % migrate())
+
+
+@recommendations_cli.command("build-assets")
+@click.option("--output", type=click.Path(file_okay=False, writable=True),
+              help="Write the assets here instead of ASSETS_DIR.")
+def build_static_assets(output):
+    """Fingerprint and precompress the static files.
+
+    Run it at build time; while ASSETS_DIR holds a build, / serves its
+    index.html, which loads the fingerprinted files from /assets/.
+    """
+    output = output or app.config["ASSETS_DIR"]
+    manifest = build_assets(app.static_folder, output)
+    click.echo(
+        "Built {files} assets in {output}: {identity} bytes, {gzip} gzip, {br} brotli".format(
+            files=len(manifest["files"]), output=output, **manifest["bytes"]
+        )
+    )
+
+
+app.cli.add_command(recommendations_cli)
@@ -0,0 +1,103 @@
+"""
+Module: compression
+gzip and brotli compression of the API responses
+
+Responses of a COMPRESSIBLE_MIMETYPES type are compressed with the best
+encoding the client accepts: brotli when the Brotli package is installed,
+else gzip. Bodies known in full are compressed only from COMPRESS_MIN_SIZE
+bytes; streamed NDJSON bodies are compressed chunk by chunk, and each chunk
+is flushed so that the client still gets every batch as it is produced.
+Every response to a client that accepts an encoding gets a weak ETag,
+since a compressed body's bytes differ from the identity encoding's, and
+the 200 and 304 responses must agree. The views compare If-None-Match
+weakly, so either form revalidates. Static files are served precompressed
+by service.assets instead.
+"""
+import zlib
+
+from flask import request
+
+from . import app
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "application/x-ndjson", "text/html", "text/plain",
+    "text/css", "text/javascript", "application/javascript",
+}
+
+
+def accepted_encoding(accept_encodings) -> str:
+    """Returns "br", "gzip" or None for an Accept-Encoding header"""
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return accept_encodings.best_match(offered)
+
+
+def compressor(encoding: str, config):
+    """Returns a compressobj-like object for an encoding"""
+    if encoding == "br":
+        return brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+    # wbits 31: a gzip header and trailer around the deflate stream
+    return zlib.compressobj(config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 31)
+
+
+def compress(data: bytes, encoding: str, config) -> bytes:
+    """Returns data compressed with an encoding"""
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+    stream = compressor(encoding, config)
+    return stream.compress(data) + stream.flush()
+
+
+def compress_chunks(chunks, encoding: str, config):
+    """Yields the compressed stream of chunks, flushed after each chunk"""
+    stream = compressor(encoding, config)
+    for chunk in chunks:
+        if encoding == "br":
+            data = stream.process(chunk) + stream.flush()
+        else:
+            data = stream.compress(chunk) + stream.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield stream.finish() if encoding == "br" else stream.flush()
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses the body when the client accepts an encoding"""
+    min_size = app.config["COMPRESS_MIN_SIZE"]
+    if min_size < 0 or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding(request.accept_encodings)
+    if encoding is None or response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    # weak whether or not this body is compressed, so that the 200 and 304
+    # responses to a client carry the same ETag
+    weaken_etag(response)
+    if (
+        request.method == "HEAD"
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+    ):
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.iter_encoded(), encoding, app.config)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding, app.config))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def weaken_etag(response):
+    """Marks a strong ETag weak, since the body is not the identity encoding's"""
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
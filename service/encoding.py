@@ -0,0 +1,83 @@
+"""
+Module: encoding
+Fast JSON encoding of Recommendation column tuples for the list endpoints
+
+The list endpoints select plain column tuples (RecommendationModel.rows())
+instead of hydrating RecommendationModel instances, and format each one
+with a fixed template. The output is byte-for-byte what jsonify() produces for
+serialize() dictionaries with Flask's default JSON settings: sorted keys,
+compact separators and ASCII-only strings.
+"""
+from json.encoder import encode_basestring_ascii
+
+from service.models import Reason
+
+# Formats a row in RecommendationModel.ROW_COLUMNS order
+ROW_TEMPLATE = (
+    '{"activated":%s,"id":%d,"name":%s,"original_product_id":%d,"rank":%s,"reason":%s,'
+    '"recommendation_product_id":%d,"recommendation_product_name":%s,"score":%s}'
+)
+
+# Formats one (original_product_id, rows) group of RecommendationModel.lookup()
+GROUP_TEMPLATE = '{"original_product_id":%d,"recommendations":[%s]}'
+
+# Precomputed JSON for the values that repeat on every row
+REASON_JSON = {reason: encode_basestring_ascii(reason.name) for reason in Reason}
+BOOLEAN_JSON = {True: "true", False: "false"}
+
+
+def encode_row(row) -> str:
+    """Returns the JSON text of one RecommendationModel.rows() tuple"""
+    (activated, rec_id, name, original_product_id, rank, reason,
+     target_id, target_name, score) = row
+    return ROW_TEMPLATE % (
+        BOOLEAN_JSON[activated],
+        rec_id,
+        encode_basestring_ascii(name),
+        original_product_id,
+        "null" if rank is None else "%d" % rank,
+        REASON_JSON[reason],
+        target_id,
+        encode_basestring_ascii(target_name),
+        float.__repr__(score),  # as the json module writes finite floats
+    )
+
+
+def encode_array(rows) -> str:
+    """Returns the JSON array text of rows() tuples, as jsonify() would"""
+    return "[" + ",".join(map(encode_row, rows)) + "]\n"
+
+
+def encode_groups(groups) -> str:
+    """Returns the JSON array text of lookup() groups, as jsonify() would"""
+    return "[" + ",".join(
+        GROUP_TEMPLATE % (product_id, ",".join(map(encode_row, rows)))
+        for product_id, rows in groups
+    ) + "]\n"
+
+
+def row_to_dict(row) -> dict:
+    """Returns a rows() tuple as a serialize() dictionary"""
+    (activated, rec_id, name, original_product_id, rank, reason,
+     target_id, target_name, score) = row
+    return {
+        "id": rec_id,
+        "name": name,
+        "original_product_id": original_product_id,
+        "recommendation_product_name": target_name,
+        "recommendation_product_id": target_id,
+        "reason": reason.name,
+        "activated": activated,
+        "score": score,
+        "rank": rank,
+    }
+
+
+def fast_encoding_allowed(config) -> bool:
+    """True if the app JSON settings match the ones the template assumes"""
+    return (
+        config["JSON_SORT_KEYS"]
+        and config["JSON_AS_ASCII"]
+        and not config["JSONIFY_PRETTYPRINT_REGULAR"]
+        and not config["DEBUG"]
+    )
@@ -0,0 +1,202 @@
+"""
+Module: importer
+Streaming import of Recommendation feeds
+
+A CSV or JSONL feed is read one record at a time. Each record is validated
+like POST /recommendations, plus the checks that the database would
+otherwise make halfway through the COPY (integer ranges, string lengths).
+Valid rows go to RecommendationModel.import_rows(), which COPYs them into a
+staging table while they are being read. Rejected records go to a JSONL
+reject file with their line number and error. Memory use does not depend
+on the size of the feed.
+"""
+import csv
+import gzip
+import json
+import time
+
+from service.models import INTEGER_MAX, INTEGER_MIN, DataValidationError, RecommendationModel
+
+FORMATS = ("csv", "jsonl")
+
+# Longest value of each string column
+STRING_LENGTHS = {
+    name: RecommendationModel.__table__.c[name].type.length
+    for name in ("name", "recommendation_product_name")
+}
+
+
+def _parse_float(value: str) -> float:
+    """ Parses a CSV score """
+    try:
+        return float(value)
+    except ValueError as error:
+        raise DataValidationError("Invalid number: " + value) from error
+
+
+# CSV fields that are not strings, and how to parse each one; an empty
+# field is null, which makes score and rank take their defaults
+CSV_PARSERS = {
+    "original_product_id": RecommendationModel.FILTER_PARSERS["original_product_id"],
+    "recommendation_product_id": RecommendationModel.FILTER_PARSERS["recommendation_product_id"],
+    "activated": RecommendationModel.FILTER_PARSERS["activated"],
+    "score": _parse_float,
+    "rank": RecommendationModel.FILTER_PARSERS["id"],
+}
+
+
+def detect_format(path: str) -> str:
+    """ Returns the format of a feed from its file name, or None """
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return None
+
+
+def open_feed(path: str):
+    """ Opens a feed for reading as text, decompressing .gz files """
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def check_row(row: dict):
+    """
+    Checks the column values of a validated row against the table
+    COPY aborts the whole load on the first value that does not fit, so
+    these are rejected up front instead.
+    """
+    for name in ("original_product_id", "recommendation_product_id", "rank"):
+        value = row[name]
+        if value is None and name == "rank":
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or not INTEGER_MIN <= value <= INTEGER_MAX:
+            raise DataValidationError("Invalid {}: {}".format(name, value))
+    for name, length in STRING_LENGTHS.items():
+        value = row[name]
+        if not isinstance(value, str) or "\x00" in value:
+            raise DataValidationError("Invalid {}: {}".format(name, value))
+        if len(value) > length:
+            raise DataValidationError("Invalid {}: longer than {} characters".format(name, length))
+    if row["activated"] is not None and not isinstance(row["activated"], bool):
+        raise DataValidationError("Invalid activated: {}".format(row["activated"]))
+
+
+class FeedImport:
+    """
+    One import of a feed
+    Args:
+        stream: the feed, open in text mode
+        fmt (str): "csv" (with a header line) or "jsonl"
+        rejects: a text file for the rejected records, or None
+        progress: called with this import every progress_every records
+        progress_every (int): records between progress calls, 0 for none
+        max_rejects (int): abort the import after more rejected records
+            than this, -1 for no limit
+    """
+
+    def __init__(self, stream, fmt: str, rejects=None, progress=None,
+                 progress_every: int = 100000, max_rejects: int = -1):
+        if fmt not in FORMATS:
+            raise DataValidationError("Unknown feed format: {}".format(fmt))
+        self.stream = stream
+        self.fmt = fmt
+        self.rejects = rejects
+        self.progress = progress
+        self.progress_every = progress_every
+        self.max_rejects = max_rejects
+        self.read = 0
+        self.rejected = 0
+        self.started = None
+
+    @property
+    def seconds(self) -> float:
+        """ Seconds since the import started """
+        return time.monotonic() - self.started if self.started else 0.0
+
+    @property
+    def rate(self) -> float:
+        """ Records read per second so far """
+        seconds = self.seconds
+        return self.read / seconds if seconds else 0.0
+
+    def records(self):
+        """ Yields (line, record) for every record of the feed """
+        if self.fmt == "csv":
+            reader = csv.DictReader(self.stream, restkey="_extra")
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line, text in enumerate(self.stream, 1):
+            if text.strip():
+                yield line, text
+
+    def parse(self, record) -> dict:
+        """ Returns the validate() input of one record """
+        if self.fmt == "jsonl":
+            try:
+                data = json.loads(record)
+            except ValueError as error:
+                raise DataValidationError("Invalid JSON: {}".format(error)) from error
+            if not isinstance(data, dict):
+                raise DataValidationError("Invalid recommendation: not a JSON object")
+            return data
+        if "_extra" in record:
+            raise DataValidationError("Invalid recommendation: too many fields")
+        data = {}
+        for key, value in record.items():
+            if value is None:  # a short line
+                continue
+            if key in CSV_PARSERS:
+                value = CSV_PARSERS[key](value) if value != "" else None
+            data[key] = value
+        if data.get("score") is None:
+            data.pop("score", None)
+        return data
+
+    def rows(self):
+        """ Yields (line, row) for every valid record, rejecting the others """
+        for line, record in self.records():
+            self.read += 1
+            try:
+                row = RecommendationModel.validate(self.parse(record))
+                check_row(row)
+            except DataValidationError as error:
+                self.reject(line, record, str(error))
+                row = None
+            if self.progress and self.progress_every and self.read % self.progress_every == 0:
+                self.progress(self)
+            if row is not None:
+                yield line, row
+
+    def reject(self, line: int, record, error: str):
+        """ Writes one rejected record to the reject file """
+        self.rejected += 1
+        if self.rejects is not None:
+            if self.fmt == "jsonl":
+                record = record.rstrip("\r\n")
+            self.rejects.write(json.dumps({"line": line, "error": error, "record": record}) + "\n")
+        if 0 <= self.max_rejects < self.rejected:
+            raise DataValidationError(
+                "Import aborted: more than {} rejected records".format(self.max_rejects)
+            )
+
+    def run(self) -> dict:
+        """
+        Imports the feed with RecommendationModel.import_rows()
+        Returns its counts plus the records read and rejected, the elapsed
+        seconds and the records read per second
+        """
+        self.started = time.monotonic()
+        stats = RecommendationModel.import_rows(self.rows())
+        stats.update({
+            "read": self.read,
+            "rejected": self.rejected,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rate, 1),
+        })
+        return stats
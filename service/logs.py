@@ -0,0 +1,138 @@
+"""
+Module: logs
+Queued and sampled logging
+
+start_queue() moves the handlers of a logger behind a QueueListener: the
+request thread only appends the record to a queue, and a listener thread
+formats it and writes it out. Records are queued unformatted, so the
+message arguments must not be changed after the call that logs them. The
+modules log through children of app.logger (service.models, ...), whose
+records propagate to its queue.
+
+LOG_SAMPLING keeps only some of the INFO and DEBUG records of a logger, e.g.
+
+    service=200/s,service.models.queries=0.01
+
+keeps at most 200 records a second of the routes (app.logger is named
+after the app; its filter does not see its children's records) and one
+"Processing ... query" record of the models in a hundred. Warnings and
+errors are always kept. Records are sampled before they are queued, so
+dropped ones cost no more than building the record.
+"""
+import atexit
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class DeferredQueueHandler(QueueHandler):
+    """A QueueHandler that leaves the formatting to the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes a fraction of the INFO and DEBUG records of a logger, or at most N a second
+    Args:
+        rate (str): "0.01" keeps every 100th record, "50/s" at most 50 a second
+    """
+
+    def __init__(self, rate: str, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self.per_second = None
+        self.every = 1
+        try:
+            if rate.endswith("/s"):
+                self.per_second = int(rate[:-2])
+            else:
+                fraction = float(rate)
+                self.every = round(1 / fraction) if fraction > 0 else 0
+        except (ValueError, ZeroDivisionError) as error:
+            raise ValueError("Invalid log sampling rate: {}".format(rate)) from error
+        self._window_start = clock()
+        self._window_count = 0
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.per_second is not None:
+            with self._lock:
+                now = self._clock()
+                if now - self._window_start >= 1:
+                    self._window_start = now
+                    self._window_count = 0
+                if self._window_count < self.per_second:
+                    self._window_count += 1
+                    return True
+                self.dropped += 1
+                return False
+        if self.every and next(self._counter) % self.every == 0:
+            return True
+        self.dropped += 1
+        return False
+
+
+def parse_sampling(value: str) -> dict:
+    """Returns {logger name: rate} of a LOG_SAMPLING setting"""
+    sampling = {}
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        name, sep, rate = part.partition("=")
+        if not sep or not name.strip():
+            raise ValueError("Invalid LOG_SAMPLING entry: {}".format(part))
+        sampling[name.strip()] = rate.strip()
+    return sampling
+
+
+def configure_sampling(value: str) -> dict:
+    """
+    Replaces the SamplingFilters of the loggers named in a LOG_SAMPLING setting
+    Returns {logger name: SamplingFilter}
+    """
+    filters = {}
+    for name, rate in parse_sampling(value).items():
+        logger = logging.getLogger(name)
+        for old in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+            logger.removeFilter(old)
+        filters[name] = SamplingFilter(rate)
+        logger.addFilter(filters[name])
+    return filters
+
+
+def start_queue(logger: logging.Logger) -> QueueListener:
+    """
+    Moves the handlers of a logger behind a queue and a listener thread
+    The listener is stopped, flushing the queue, when the process exits, and
+    restarted in forked children, which do not inherit its thread. A child
+    gets a new queue: the inherited one may be locked by the parent's
+    listener, and its pending records are the parent's to write.
+    """
+    handler = DeferredQueueHandler(queue.SimpleQueue())
+    listener = QueueListener(handler.queue, *logger.handlers, respect_handler_level=True)
+    logger.handlers = [handler]
+    listener.start()
+
+    def stop():
+        if listener._thread is not None:  # pylint: disable=protected-access
+            listener.stop()
+
+    def restart():
+        handler.queue = listener.queue = queue.SimpleQueue()
+        listener._thread = None  # pylint: disable=protected-access
+        listener.start()
+
+    atexit.register(stop)
+    os.register_at_fork(after_in_child=restart)
+    return listener
@@ -0,0 +1,160 @@
+"""
+Module: metrics
+Per-request timing and the Prometheus metrics of the service
+
+Every request counts the SQL statements it runs and their time (through
+SQLAlchemy engine events), the time spent encoding JSON and its total time.
+The figures go back to the client in a Server-Timing header, e.g.
+
+    Server-Timing: db;dur=1.84;desc="2 queries", serialize;dur=0.21, total;dur=3.05
+
+and into Prometheus histograms labelled by route, served by GET /metrics.
+Under gunicorn each worker writes its samples to files in
+PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py) and /metrics adds up the
+files of every worker, so a scrape sees the whole server whichever worker
+answers it. Statements sent on a raw DBAPI cursor (the COPY import and the
+execute_values() bulk insert) bypass the engine events and are not counted.
+Streamed NDJSON bodies are encoded after the response has left the view,
+so their encoding time and size are not recorded either.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask.json import JSONEncoder
+from prometheus_client import REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import app
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time from the start of a request to its response",
+    ["method", "route", "status"], buckets=SECONDS_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements run by a request",
+    ["method", "route"], buckets=QUERY_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time a request spent running SQL statements",
+    ["method", "route"], buckets=SECONDS_BUCKETS,
+)
+SERIALIZE_SECONDS = Histogram(
+    "http_request_serialize_seconds", "Time a request spent encoding its JSON response",
+    ["method", "route"], buckets=SECONDS_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes", "Size of the response bodies that are not streamed",
+    ["method", "route"], buckets=SIZE_BUCKETS,
+)
+
+
+class RequestTimer:
+    """The timings of the current request, kept in flask.g"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+
+def current_timer():
+    """Returns the RequestTimer of the current request, None outside of one"""
+    if not has_request_context():
+        return None
+    return g.get("request_timer")
+
+
+@contextmanager
+def serializing():
+    """Adds the time spent in the with block to the request's encoding time"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer = current_timer()
+        if timer is not None:
+            timer.serialize_seconds += time.perf_counter() - start
+
+
+class TimedJSONEncoder(JSONEncoder):
+    """Flask's JSON encoder, timing every jsonify() of a request"""
+
+    def encode(self, o):
+        with serializing():
+            return super().encode(o)
+
+
+def route_label():
+    """Returns the URL rule of the request, so that ids do not become labels"""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def metrics_text() -> bytes:
+    """Returns the metrics of every worker in the Prometheus text format"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+######################################################################
+# SQLALCHEMY EVENTS
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Notes when a statement of the current request starts"""
+    if current_timer() is not None:
+        conn.info["query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Counts a finished statement against the current request"""
+    timer = current_timer()
+    start = conn.info.pop("query_start", None)
+    if timer is not None and start is not None:
+        timer.db_queries += 1
+        timer.db_seconds += time.perf_counter() - start
+
+
+######################################################################
+# REQUEST HOOKS
+######################################################################
+@app.before_request
+def start_timer():
+    """Starts timing the request"""
+    g.request_timer = RequestTimer()
+
+
+@app.after_request
+def record_timings(response):
+    """Adds the Server-Timing header and observes the request's metrics"""
+    timer = g.pop("request_timer", None)
+    if timer is None:
+        return response
+    total = time.perf_counter() - timer.start
+    response.headers["Server-Timing"] = (
+        'db;dur=%.2f;desc="%d queries", serialize;dur=%.2f, total;dur=%.2f'
+        % (timer.db_seconds * 1000, timer.db_queries, timer.serialize_seconds * 1000, total * 1000)
+    )
+    method, route = request.method, route_label()
+    REQUEST_SECONDS.labels(method, route, str(response.status_code)).observe(total)
+    DB_QUERIES.labels(method, route).observe(timer.db_queries)
+    DB_SECONDS.labels(method, route).observe(timer.db_seconds)
+    SERIALIZE_SECONDS.labels(method, route).observe(timer.serialize_seconds)
+    if not response.is_streamed:
+        RESPONSE_BYTES.labels(method, route).observe(response.calculate_content_length() or 0)
+    return response
+
+
+app.json_encoder = TimedJSONEncoder
@@ -3,12 +3,30 @@ Models for RecommendationModel
 All of the models are stored in this module
 """
 import logging
+import math
+import re
+from datetime import datetime
 from enum import Enum
 from tokenize import Triple
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+import psycopg2
+from psycopg2.extras import execute_values
+from sqlalchemy import and_, func, inspect, or_, select, text, true, union_all
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.schema import CreateIndex
+from service.cache import recommendation_cache
+from service.adjacency import adjacency_index
+from service.pool import engine_options
+from service.slow_queries import slow_query_log
+from service.snapshot import SnapshotLoader
 
-logger = logging.getLogger("flask.app")
+# children of app.logger (named after the service package), so that they
+# share its handlers, its level and its log queue
+logger = logging.getLogger(__name__)
+# the per-query "Processing ..." messages, which LOG_SAMPLING can thin out
+query_logger = logging.getLogger(__name__ + ".queries")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
@@ -25,6 +43,91 @@ class Reason(Enum):
     ACCESSORY = 2
     OTHER  = 3
 
+
+# range of the INTEGER id columns
+INTEGER_MIN = -2 ** 31
+INTEGER_MAX = 2 ** 31 - 1
+
+
+def _parse_int(value: str) -> int:
+    """ Parses an integer filter value """
+    try:
+        return int(value)
+    except ValueError as error:
+        raise DataValidationError("Invalid integer: " + value) from error
+
+
+def _parse_id(key: str, value) -> int:
+    """ Parses a product id of a request body, which may be a numeric string """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError as error:
+            raise DataValidationError("Invalid {}: {!r}".format(key, value)) from error
+    if isinstance(value, bool) or not isinstance(value, int) or not INTEGER_MIN <= value <= INTEGER_MAX:
+        raise DataValidationError("Invalid {}: {!r}".format(key, value))
+    return value
+
+
+def _parse_reason(value: str) -> Reason:
+    """ Parses a Reason filter value from its name """
+    try:
+        return Reason[value.upper()]
+    except KeyError as error:
+        raise DataValidationError("Invalid reason: " + value) from error
+
+
+def _parse_bool(value: str) -> bool:
+    """ Parses a boolean filter value """
+    if value.lower() in ("true", "1", "yes"):
+        return True
+    if value.lower() in ("false", "0", "no"):
+        return False
+    raise DataValidationError("Invalid boolean: " + value)
+
+
+# Characters that must be escaped in a COPY text format field
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class _CopyReader:
+    """
+    A file-like object that joins COPY data lines on demand
+    copy_expert() pulls it in chunks, so only one chunk of the input is in
+    memory at a time. An exception raised by the lines is kept in error,
+    since psycopg2 replaces it with a QueryCanceled.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.pending = ""
+        self.count = 0
+        self.error = None
+
+    def read(self, size: int = -1) -> str:
+        """ Returns up to size characters, or everything left if size < 0 """
+        chunks = [self.pending]
+        length = len(self.pending)
+        while size < 0 or length < size:
+            try:
+                line = next(self.lines, None)
+            except Exception as error:
+                self.error = error
+                raise
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+            self.count += 1
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self.pending = data[size:]
+        return data[:size]
+
+
 class RecommendationModel(db.Model):
     """
     Class that represents a Recommendation
@@ -32,6 +135,124 @@ class RecommendationModel(db.Model):
 
     app = None
 
+    # Secondary indexes for every column the find_by_* queries filter on.
+    # They are declared here so create_all() builds them on a fresh database,
+    # and migration 2 adds them CONCURRENTLY to tables that already exist.
+    __table_args__ = (
+        db.Index("ix_recommendation_product_activated_reason",
+                 "original_product_id", "activated", "reason"),
+        db.Index("ix_recommendation_name", "name"),
+        db.Index("ix_recommendation_reason_activated", "reason", "activated"),
+        # (recommendation_product_id, id) pages through the Recommendations of
+        # a target in id order; migration 7 replaced the single column index
+        db.Index("ix_recommendation_target_page", "recommendation_product_id", "id"),
+        db.Index("ix_recommendation_target_name", "recommendation_product_name"),
+        db.Index("ix_recommendation_activated", "activated"),
+    )
+
+    # The ?top=k index is declared after the class, since it sorts on score DESC
+
+    # Columns that find_by_filters() can filter on, and how to parse each
+    # one from a query string value
+    FILTER_PARSERS = {
+        "id": _parse_int,
+        "original_product_id": _parse_int,
+        "name": str,
+        "recommendation_product_id": _parse_int,
+        "recommendation_product_name": str,
+        "reason": _parse_reason,
+        "activated": _parse_bool,
+    }
+
+    # Columns returned by rows(), in the sorted order of the serialize() keys
+    ROW_COLUMNS = (
+        "activated",
+        "id",
+        "name",
+        "original_product_id",
+        "rank",
+        "reason",
+        "recommendation_product_id",
+        "recommendation_product_name",
+        "score",
+    )
+
+    # Columns that search() matches a prefix of
+    SEARCH_FIELDS = ("name", "recommendation_product_name")
+
+    # Statement used by create_many() for a row that is retried on its own;
+    # the column order matches _insert_tuple()
+    BULK_INSERT_SQL = (
+        "INSERT INTO recommendation_model (name, original_product_id, "
+        "recommendation_product_name, recommendation_product_id, reason, activated, "
+        "score, rank) "
+        "VALUES %s RETURNING id, original_product_id"
+    )
+
+    # Statements used by import_rows(); the staging table has the column
+    # types of the real one and the COPY column order matches _copy_line()
+    IMPORT_STAGING_SQL = (
+        "CREATE TEMPORARY TABLE recommendation_import ON COMMIT DROP AS "
+        "SELECT 0::bigint AS line, name, original_product_id, recommendation_product_name, "
+        "recommendation_product_id, reason, activated, score, rank "
+        "FROM recommendation_model WITH NO DATA"
+    )
+    # characters that copy_expert() reads from the rows at a time
+    IMPORT_CHUNK_SIZE = 65536
+    IMPORT_COPY_SQL = (
+        "COPY recommendation_import (line, name, original_product_id, "
+        "recommendation_product_name, recommendation_product_id, reason, activated, "
+        "score, rank) FROM STDIN"
+    )
+    # used by create_many() to insert a batch copied into the staging table;
+    # the ids are drawn from the sequence in line order
+    BULK_COPY_INSERT_SQL = (
+        "INSERT INTO recommendation_model (name, original_product_id, "
+        "recommendation_product_name, recommendation_product_id, reason, activated, "
+        "score, rank) "
+        "SELECT name, original_product_id, recommendation_product_name, "
+        "recommendation_product_id, reason, activated, score, rank "
+        "FROM recommendation_import ORDER BY line "
+        "RETURNING id, original_product_id"
+    )
+    # keeps the last row of each (original_product_id, recommendation_product_id)
+    IMPORT_LATEST_SQL = (
+        "CREATE TEMPORARY TABLE recommendation_import_latest ON COMMIT DROP AS "
+        "SELECT DISTINCT ON (original_product_id, recommendation_product_id) * "
+        "FROM recommendation_import "
+        "ORDER BY original_product_id, recommendation_product_id, line DESC"
+    )
+    IMPORT_UPDATE_SQL = (
+        "WITH updated AS ("
+        "UPDATE recommendation_model AS r SET name = s.name, "
+        "recommendation_product_name = s.recommendation_product_name, reason = s.reason, "
+        "activated = s.activated, score = s.score, rank = s.rank, version = r.version + 1 "
+        "FROM recommendation_import_latest AS s "
+        "WHERE r.original_product_id = s.original_product_id "
+        "AND r.recommendation_product_id = s.recommendation_product_id "
+        "AND (r.name, r.recommendation_product_name, r.reason, r.activated, r.score, r.rank) "
+        "IS DISTINCT FROM "
+        "(s.name, s.recommendation_product_name, s.reason, s.activated, s.score, s.rank) "
+        "RETURNING r.original_product_id, r.recommendation_product_id"
+        ") SELECT original_product_id, count(*), count(DISTINCT recommendation_product_id) "
+        "FROM updated GROUP BY original_product_id"
+    )
+    IMPORT_INSERT_SQL = (
+        "WITH inserted AS ("
+        "INSERT INTO recommendation_model (name, original_product_id, "
+        "recommendation_product_name, recommendation_product_id, reason, activated, "
+        "score, rank) "
+        "SELECT name, original_product_id, recommendation_product_name, "
+        "recommendation_product_id, reason, activated, score, rank "
+        "FROM recommendation_import_latest AS s WHERE NOT EXISTS ("
+        "SELECT 1 FROM recommendation_model AS r "
+        "WHERE r.original_product_id = s.original_product_id "
+        "AND r.recommendation_product_id = s.recommendation_product_id) "
+        "ORDER BY s.line "
+        "RETURNING original_product_id"
+        ") SELECT original_product_id, count(*), count(*) FROM inserted GROUP BY original_product_id"
+    )
+
     # Table Schema
 
     id = db.Column(db.Integer, primary_key=True)
@@ -48,6 +269,13 @@ class RecommendationModel(db.Model):
 
     activated = db.Column(db.Boolean(), nullable=False, default=True)
 
+    # how good the recommendation is (higher first) and an optional curated position
+    score = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    rank = db.Column(db.Integer, nullable=True)
+
+    # incremented by every update(); the ETag of GET /recommendations/<id>
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
     def __repr__(self):
         return "<Recommendation %r id=[%s]>" % (self.name, self.id)
 
@@ -58,7 +286,281 @@ class RecommendationModel(db.Model):
         logger.info("Creating Recommendation for %s", self.name)
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
+        Generation.bump([self.original_product_id])
         db.session.commit()
+        adjacency_index.apply(self.adjacency_row())
+
+    @classmethod
+    def create_many(cls, rows, batch_size: int = 1000):
+        """
+        Creates many Recommendations in a single transaction
+        Rows are loaded in batches of up to batch_size, each inside a SAVEPOINT:
+        the batch is COPYed into the staging table of import_rows() and moved
+        with one INSERT ... SELECT ... RETURNING id. If a batch is rejected by
+        the database it is retried row by row so that only the offending rows fail.
+        Args:
+            rows (iterable): column value dictionaries, as returned by validate()
+            batch_size (int): the maximum number of rows per COPY
+        Returns:
+            (ids, errors): the new ids in input order (None for a failed row)
+            and a dict mapping the position of each failed row to its error
+        """
+        logger.info("Creating Recommendations in bulk")
+        ids = []
+        errors = {}
+        batch = []
+        # the products of the rows actually inserted, as returned by the database
+        product_ids = set()
+        try:
+            db.session.execute(text(cls.IMPORT_STAGING_SQL))
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    cls._insert_batch(batch, ids, errors, product_ids)
+                    batch = []
+            if batch:
+                cls._insert_batch(batch, ids, errors, product_ids)
+            Generation.bump(product_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        adjacency_index.invalidate()
+        logger.info("Created %d Recommendations in bulk", len(ids) - len(errors))
+        return ids, errors
+
+    @classmethod
+    def import_rows(cls, rows) -> dict:
+        """
+        Loads rows with COPY into a staging table and merges them in one transaction
+        A row matches the Recommendations with the same original_product_id
+        and recommendation_product_id: those are updated (and versioned) if
+        any column differs, and rows without a match are inserted. Of several
+        rows for the same pair the last one wins. The rows are rendered as
+        COPY data while the server reads them, so the input is never held
+        in memory; if the iterator raises, nothing is imported.
+        Args:
+            rows (iterable): (line, row) pairs, row as returned by validate()
+        Returns a dict of the loaded, inserted, updated and unchanged counts
+        """
+        logger.info("Importing Recommendations")
+        stats = {}
+        try:
+            db.session.execute(text(cls.IMPORT_STAGING_SQL))
+            reader = _CopyReader(cls._copy_line(line, row) for line, row in rows)
+            cursor = db.session.connection().connection.cursor()
+            try:
+                cursor.copy_expert(cls.IMPORT_COPY_SQL, reader, size=cls.IMPORT_CHUNK_SIZE)
+            except psycopg2.Error:
+                if reader.error is not None:
+                    raise reader.error  # pylint: disable=raise-missing-from
+                raise
+            finally:
+                cursor.close()
+            stats["loaded"] = reader.count
+            db.session.execute(text(cls.IMPORT_LATEST_SQL))
+            db.session.execute(text("ANALYZE recommendation_import_latest"))
+            distinct = db.session.execute(
+                text("SELECT count(*) FROM recommendation_import_latest")
+            ).scalar()
+            product_ids = set()
+            # rows written, and rows of the file they came from (a file row
+            # updates every Recommendation with its pair)
+            for name, sql in (("updated", cls.IMPORT_UPDATE_SQL), ("inserted", cls.IMPORT_INSERT_SQL)):
+                counts = db.session.execute(text(sql)).fetchall()
+                stats[name] = sum(row[1] for row in counts)
+                distinct -= sum(row[2] for row in counts)
+                product_ids.update(row[0] for row in counts)
+            stats["unchanged"] = distinct
+            if product_ids:
+                Generation.bump(product_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if product_ids:
+            recommendation_cache.clear()
+            adjacency_index.invalidate()
+        logger.info("Imported Recommendations: %s", stats)
+        return stats
+
+    @classmethod
+    def delete_many(cls, **filters) -> int:
+        """
+        Deletes every Recommendation that matches the filters in one statement
+        The filters are those of find_by_filters(). Without any filter the
+        table is emptied with TRUNCATE, which does not scan it; ids are not
+        reused afterwards, so cached ETags can never match a new row.
+        Args:
+            filters: column name to a value or a list of values
+        Returns the number of Recommendations deleted
+        """
+        logger.info("Deleting Recommendations matching %s", filters)
+        table = cls.__table__
+        try:
+            if filters:
+                deleted = table.delete().where(
+                    and_(*cls.filter_conditions(filters))
+                ).returning(table.c.original_product_id).cte("deleted")
+                counts = db.session.execute(
+                    select([deleted.c.original_product_id, func.count()])
+                    .group_by(deleted.c.original_product_id)
+                ).fetchall()
+                count = sum(row[1] for row in counts)
+                if counts:
+                    Generation.bump(row[0] for row in counts)
+            else:
+                db.session.execute(text("LOCK TABLE %s IN ACCESS EXCLUSIVE MODE" % table.name))
+                count = db.session.execute(select([func.count()]).select_from(table)).scalar()
+                db.session.execute(text("TRUNCATE %s" % table.name))
+                Generation.bump(truncated=True)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if count:
+            recommendation_cache.clear()
+            adjacency_index.invalidate()
+        logger.info("Deleted %d Recommendations", count)
+        return count
+
+    @classmethod
+    def set_activated(cls, activated: bool, **filters):
+        """
+        Sets activated on every Recommendation that matches the filters
+        A single conditional UPDATE ... WHERE activated <> :activated changes
+        only the rows not already in the target state, so those are the only
+        rows locked, versioned and counted as written.
+        Args:
+            activated (bool): the target state
+            filters: find_by_filters() arguments, at least one
+        Returns:
+            (changed, unchanged): the ids updated and the ids already in the
+            target state, each in id order
+        """
+        logger.info("Setting activated=%s on Recommendations matching %s", activated, filters)
+        if not filters:
+            raise DataValidationError("set_activated called without a filter")
+        table = cls.__table__
+        conditions = cls.filter_conditions(filters)
+        try:
+            unchanged = db.session.execute(
+                select([table.c.id]).where(and_(table.c.activated == activated, *conditions))
+            ).fetchall()
+            changed = db.session.execute(
+                table.update()
+                .where(and_(table.c.activated != activated, *conditions))
+                .values(activated=activated, version=table.c.version + 1)
+                .returning(table.c.id, table.c.original_product_id)
+            ).fetchall()
+            if changed:
+                Generation.bump({row[1] for row in changed})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        changed = sorted(row[0] for row in changed)
+        if changed:
+            recommendation_cache.invalidate(*changed)
+            adjacency_index.invalidate()
+        # a row flipped by another writer since the SELECT is reported as changed
+        unchanged = sorted(set(row[0] for row in unchanged) - set(changed))
+        return changed, unchanged
+
+    @classmethod
+    def _insert_batch(cls, rows: list, ids: list, errors: dict, product_ids: set):
+        """ Inserts one batch, falling back to row by row if it is rejected """
+        try:
+            inserted = cls._copy_rows(rows)
+        except psycopg2.Error:
+            logger.warning("Bulk insert batch rejected, retrying row by row")
+        else:
+            ids.extend(row[0] for row in inserted)
+            product_ids.update(row[1] for row in inserted)
+            return
+        for row in rows:
+            try:
+                inserted = cls._insert_rows([cls._insert_tuple(row)])
+            except psycopg2.Error as error:
+                errors[len(ids)] = str(error).strip()
+                ids.append(None)
+            else:
+                ids.append(inserted[0][0])
+                product_ids.add(inserted[0][1])
+
+    @classmethod
+    def _copy_rows(cls, rows: list) -> list:
+        """
+        COPYs rows into the staging table and inserts them inside a SAVEPOINT
+        Returns the (id, original_product_id) of the new rows, in the order of rows
+        """
+        savepoint = db.session.begin_nested()
+        reader = _CopyReader(cls._copy_line(line, row) for line, row in enumerate(rows))
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(cls.IMPORT_COPY_SQL, reader, size=cls.IMPORT_CHUNK_SIZE)
+            cursor.execute(cls.BULK_COPY_INSERT_SQL)
+            result = cursor.fetchall()
+            cursor.execute("TRUNCATE recommendation_import")
+        except psycopg2.Error:
+            savepoint.rollback()
+            raise
+        finally:
+            cursor.close()
+        savepoint.commit()
+        # ids ascend in line order, whatever order RETURNING uses
+        return sorted(result)
+
+    @classmethod
+    def _insert_rows(cls, rows: list) -> list:
+        """
+        Runs a multi-row INSERT ... RETURNING id, original_product_id inside a SAVEPOINT
+        psycopg2's execute_values renders the VALUES list directly, which avoids
+        compiling a SQLAlchemy statement with thousands of bind parameters.
+        """
+        savepoint = db.session.begin_nested()
+        cursor = db.session.connection().connection.cursor()
+        try:
+            result = execute_values(
+                cursor, cls.BULK_INSERT_SQL, rows, page_size=len(rows), fetch=True
+            )
+        except psycopg2.Error:
+            savepoint.rollback()
+            raise
+        finally:
+            cursor.close()
+        savepoint.commit()
+        return result
+
+    @staticmethod
+    def _insert_tuple(row: dict) -> tuple:
+        """ Returns the BULK_INSERT_SQL values for a validated row """
+        return (
+            row["name"],
+            row["original_product_id"],
+            row["recommendation_product_name"],
+            row["recommendation_product_id"],
+            row["reason"].name,
+            True if row["activated"] is None else row["activated"],
+            row.get("score", 0.0),
+            row.get("rank"),
+        )
+
+    @staticmethod
+    def _copy_line(line: int, row: dict) -> str:
+        """ Returns the IMPORT_COPY_SQL data line of a validated row """
+        rank = row.get("rank")
+        return "%d\t%s\t%d\t%s\t%d\t%s\t%s\t%r\t%s\n" % (
+            line,
+            row["name"].translate(_COPY_ESCAPES),
+            row["original_product_id"],
+            row["recommendation_product_name"].translate(_COPY_ESCAPES),
+            row["recommendation_product_id"],
+            row["reason"].name,
+            "f" if row["activated"] is False else "t",
+            float(row.get("score", 0.0)),
+            "\\N" if rank is None else rank,
+        )
 
     def update(self):
         """
@@ -67,13 +569,21 @@ class RecommendationModel(db.Model):
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        previous = inspect(self).attrs.original_product_id.history.deleted
+        self.version = RecommendationModel.version + 1  # evaluated by the database
+        Generation.bump([self.original_product_id] + list(previous))
         db.session.commit()
+        recommendation_cache.invalidate(self.id)
+        adjacency_index.apply(self.adjacency_row(), previous[0] if previous else None)
 
     def delete(self):
         """ Removes a RecommendationModel from the data store """
         logger.info("Deleting Recommendation for %s", self.name)
         db.session.delete(self)
+        Generation.bump([self.original_product_id])
         db.session.commit()
+        recommendation_cache.invalidate(self.id)
+        adjacency_index.remove(self.original_product_id, self.id)
 
     def serialize(self):
         """ Serializes a YourResourceModel into a dictionary """
@@ -84,22 +594,84 @@ class RecommendationModel(db.Model):
             "recommendation_product_name": self.recommendation_product_name,
             "recommendation_product_id": self.recommendation_product_id,
             "reason" :self.reason.name,
-            "activated" :self.activated
+            "activated" :self.activated,
+            "score": self.score,
+            "rank": self.rank,
         }
 
+    def etag(self) -> str:
+        """ Returns the strong ETag of this Recommendation's current version """
+        return "%s-%s" % (self.id, self.version)
+
+    def adjacency_row(self) -> tuple:
+        """ Returns this Recommendation as an adjacency index row """
+        return (
+            self.original_product_id,
+            self.id,
+            self.name,
+            self.recommendation_product_id,
+            self.recommendation_product_name,
+            self.reason,
+            self.activated,
+            self.score,
+            self.rank,
+        )
+
+    @classmethod
+    def adjacency_rows(cls, app: Flask):
+        """
+        Yields every Recommendation as an adjacency index row
+        Uses its own connection and a server-side cursor so that it can run in
+        a background thread without touching the request session.
+        """
+        query_logger.info("Processing adjacency index load ...")
+        table = cls.__table__
+        query = select([
+            table.c.original_product_id,
+            table.c.id,
+            table.c.name,
+            table.c.recommendation_product_id,
+            table.c.recommendation_product_name,
+            table.c.reason,
+            table.c.activated,
+            table.c.score,
+            table.c.rank,
+        ]).order_by(table.c.original_product_id, table.c.id)
+        with db.get_engine(app).connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query)
+            for row in result:
+                yield tuple(row)
+
     def deserialize(self, data):
         """
         Deserializes a Recommendation from a dictionary
         Args:
             data (dict): A dictionary containing the resource data
         """
+        for key, value in self.validate(data).items():
+            setattr(self, key, value)
+        return self
+
+    @staticmethod
+    def validate(data) -> dict:
+        """
+        Validates a Recommendation dictionary without building a model instance
+        score and rank are optional and default to 0.0 and null.
+        Args:
+            data (dict): A dictionary containing the resource data
+        Returns a dictionary of column values
+        """
         try:
-            self.name = data["name"]
-            self.original_product_id = data["original_product_id"]
-            self.recommendation_product_name = data["recommendation_product_name"]
-            self.recommendation_product_id = data["recommendation_product_id"]
-            self.reason = getattr(Reason, data["reason"])  # create enum from string
-            self.activated = data["activated"]
+            row = {
+                "name": data["name"],
+                "original_product_id": data["original_product_id"],
+                "recommendation_product_name": data["recommendation_product_name"],
+                "recommendation_product_id": data["recommendation_product_id"],
+                "reason": getattr(Reason, data["reason"]),  # create enum from string
+                "activated": data["activated"],
+                "score": data.get("score", 0.0),
+                "rank": data.get("rank"),
+            }
         except AttributeError as error:
             raise DataValidationError("Invalid attribute: " + error.args[0]) from error
         except KeyError as error:
@@ -108,36 +680,245 @@ class RecommendationModel(db.Model):
             raise DataValidationError(
                 "Invalid recommendation: body of request contained bad or no data " + str(error)
             ) from error
-        return self
+        for key in ("original_product_id", "recommendation_product_id"):
+            row[key] = _parse_id(key, row[key])
+        score, rank = row["score"], row["rank"]
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not math.isfinite(score):
+            raise DataValidationError("Invalid score: {}".format(score))
+        if rank is not None and (isinstance(rank, bool) or not isinstance(rank, int) or rank < 1):
+            raise DataValidationError("Invalid rank: {}".format(rank))
+        row["score"] = float(score)
+        return row
 
     @classmethod
     def init_db(cls, app: Flask):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
+        recommendation_cache.configure(app.config["CACHE_SIZE"], app.config["CACHE_TTL"])
+        slow_query_log.configure(
+            app.config["SLOW_QUERY_MS"],
+            app.config["SLOW_QUERY_SAMPLE_RATE"],
+            app.config["SLOW_QUERY_EXPLAINS_PER_MINUTE"],
+            app.config["SLOW_QUERY_HISTORY"],
+            app.config["SLOW_QUERY_EXPLAIN_TIMEOUT"],
+        )
+        # pool settings from the DB_* config, unless set explicitly
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            **engine_options(app.config), **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+        }
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        check_schema(app.config["SCHEMA_CHECK"])
+        if app.config["ADJACENCY_INDEX_ENABLED"]:
+            if app.config["ADJACENCY_SNAPSHOT_PATH"]:
+                loader = SnapshotLoader(app.config["ADJACENCY_SNAPSHOT_PATH"], Reason)
+            else:
+                loader = lambda: cls.adjacency_rows(app)
+            adjacency_index.start(loader, app.config["ADJACENCY_INDEX_REFRESH"])
 
     @classmethod
     def all(cls) -> list:
         """ Returns all of the RecommendationModel in the database """
-        logger.info("Processing all RecommendationModels")
+        query_logger.info("Processing all RecommendationModels")
         return cls.query.all()
 
+    @classmethod
+    def rows(cls, query=None, batch_size: int = None):
+        """
+        Returns the ROW_COLUMNS tuples of the Recommendations a query matches
+        The columns are selected directly, so no model instances are built
+        and nothing is added to the session identity map.
+        Args:
+            query (Query): the query to run, all Recommendations if None
+            batch_size (int): if given, stream the rows from a server-side
+            cursor, holding at most batch_size of them in memory at a time
+        """
+        query_logger.info("Processing row query ...")
+        query = cls.query if query is None else query
+        columns = [getattr(cls, name) for name in cls.ROW_COLUMNS]
+        statement = query.with_entities(*columns).statement
+        if batch_size:
+            statement = statement.execution_options(
+                stream_results=True, max_row_buffer=batch_size
+            )
+        return db.session.execute(statement)
+
+    @classmethod
+    def lookup(cls, product_ids=(), ids=(), limit: int = None, **filters) -> list:
+        """
+        Returns the Recommendations of many products, grouped by product
+        Everything is resolved with one query: rows whose original_product_id
+        is in product_ids or whose id is in ids, narrowed by the filters. Each
+        product's rows are ordered best score first; with a limit only the
+        first limit of them are kept, see ranked().
+        Args:
+            product_ids (list): original_product_id values
+            ids (list): Recommendation ids, grouped under their own products
+            limit (int): the maximum number of Recommendations per product
+            filters: further find_by_filters() arguments, e.g. reason, activated
+        Returns a list of (original_product_id, [ROW_COLUMNS tuples]) for every
+        requested product in order, followed by the other products of ids
+        """
+        query_logger.info("Processing lookup for products %s and ids %s ...", product_ids, ids)
+        table = cls.__table__
+        keys = []
+        if product_ids:
+            keys.append(table.c.original_product_id.in_(product_ids))
+        if ids:
+            keys.append(table.c.id.in_(ids))
+        groups = {product_id: [] for product_id in product_ids}
+        if not keys:
+            return list(groups.items())
+        conditions = [or_(*keys)] + cls.filter_conditions(filters)
+        if limit:
+            query = cls.ranked(conditions, limit)
+        else:
+            query = select([table.c[name] for name in cls.ROW_COLUMNS]).where(
+                and_(*conditions)
+            ).order_by(table.c.original_product_id, table.c.score.desc(), table.c.id)
+        for row in db.session.execute(query):
+            groups.setdefault(row.original_product_id, []).append(row)
+        return list(groups.items())
+
+    @classmethod
+    def ranked(cls, conditions: list, limit: int):
+        """
+        Returns a select of the limit best scored rows of each product
+        A row_number() window over every matching row; top() uses the
+        (original_product_id, score DESC, id) index instead when it knows
+        the products. Rows are ordered by product, then score descending.
+        """
+        table = cls.__table__
+        position = func.row_number().over(
+            partition_by=table.c.original_product_id,
+            order_by=[table.c.score.desc(), table.c.id],
+        ).label("position")
+        columns = [table.c[name] for name in cls.ROW_COLUMNS]
+        ranked = select(columns + [position]).where(and_(*conditions)).alias("ranked")
+        return select([ranked.c[name] for name in cls.ROW_COLUMNS]).where(
+            ranked.c.position <= limit
+        ).order_by(ranked.c.original_product_id, ranked.c.score.desc(), ranked.c.id)
+
+    @classmethod
+    def top(cls, top: int, batch_size: int = None, **filters):
+        """
+        Returns the ROW_COLUMNS tuples of the top Recommendations of each product
+        With an original_product_id filter, each product is a LATERAL
+        ORDER BY score DESC, id LIMIT top subquery that reads only its first
+        top entries of ix_recommendation_product_score. Otherwise every
+        product is ranked with a window, see ranked().
+        Args:
+            top (int): the number of Recommendations to return per product
+            batch_size (int): stream the rows, as in rows()
+            filters: find_by_filters() arguments
+        """
+        query_logger.info("Processing top %d query for %s ...", top, filters)
+        table = cls.__table__
+        filters = dict(filters)
+        product_ids = filters.pop("original_product_id", None)
+        conditions = cls.filter_conditions(filters)
+        if product_ids is None:
+            query = cls.ranked(conditions, top)
+        else:
+            if not isinstance(product_ids, (list, tuple, set)):
+                product_ids = [product_ids]
+            products = select([
+                func.unnest(postgresql.array(sorted(set(product_ids)))).label("product_id")
+            ]).alias("products")
+            best = select([table.c[name] for name in cls.ROW_COLUMNS]).where(
+                and_(table.c.original_product_id == products.c.product_id, *conditions)
+            ).order_by(table.c.score.desc(), table.c.id).limit(top).lateral("best")
+            query = select([best.c[name] for name in cls.ROW_COLUMNS]).select_from(
+                products.join(best, true())
+            ).order_by(best.c.original_product_id, best.c.score.desc(), best.c.id)
+        if batch_size:
+            query = query.execution_options(stream_results=True, max_row_buffer=batch_size)
+        return db.session.execute(query)
+
+    @classmethod
+    def page_query(cls, query, limit: int, after_id: int = None):
+        """
+        Returns a query for one keyset page of Recommendations ordered by id
+        The page seeks past after_id on the primary key index rather than
+        skipping rows with OFFSET, so every page costs the same.
+        Args:
+            query (Query): the filtered query to page through
+            limit (int): the maximum number of Recommendations to return
+            after_id (int): the id of the last Recommendation on the previous page
+        """
+        query_logger.info("Processing page query after id %s ...", after_id)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(cls.id).limit(limit)
+
+    @classmethod
+    def paginate(cls, query, limit: int, after_id: int = None) -> list:
+        """ Returns one keyset page of Recommendations, see page_query() """
+        return cls.page_query(query, limit, after_id).all()
+
     @classmethod
     def find(cls, recommendation_id : int):
         """ Finds a Recommendation by its ID """
-        logger.info("Processing lookup for id %s ...", recommendation_id)
+        query_logger.info("Processing lookup for id %s ...", recommendation_id)
         return cls.query.get(recommendation_id)
 
     @classmethod
     def find_or_404(cls, original_product_id : int):
         """ Find a Recommendation by it's id """
-        logger.info("Processing lookup or 404 for id %s ...", original_product_id)
+        query_logger.info("Processing lookup or 404 for id %s ...", original_product_id)
         return cls.query.get_or_404(original_product_id)
 
+    @classmethod
+    def filters_from_args(cls, args) -> dict:
+        """
+        Parses query string arguments into find_by_filters() keyword arguments
+        Repeating a parameter gives a list of values; numeric, reason and
+        activated parameters also accept a comma separated list.
+        Args:
+            args (MultiDict): the request query string arguments
+        """
+        filters = {}
+        for key, parse in cls.FILTER_PARSERS.items():
+            values = []
+            for value in args.getlist(key):
+                if parse is not str:
+                    values.extend(parse(item.strip()) for item in value.split(",") if item.strip())
+                elif value:
+                    values.append(value)
+            if values:
+                filters[key] = values
+        return filters
+
+    @classmethod
+    def find_by_filters(cls, **filters):
+        """
+        Returns all Recommendations that match every given filter
+        The filters are ANDed into a single query; a list of values becomes
+        an IN (...) condition. Columns without a filter are not constrained.
+        Args:
+            filters: column name to a value or a list of values
+        """
+        query_logger.info("Processing filter query for %s ...", filters)
+        return cls.query.filter(*cls.filter_conditions(filters))
+
+    @classmethod
+    def filter_conditions(cls, filters: dict) -> list:
+        """ Returns the SQL conditions for find_by_filters() keyword arguments """
+        conditions = []
+        for key, values in filters.items():
+            if key not in cls.FILTER_PARSERS:
+                raise DataValidationError("Invalid filter: " + key)
+            column = getattr(cls, key)
+            if not isinstance(values, (list, tuple, set)):
+                conditions.append(column == values)
+            elif len(values) == 1:
+                conditions.append(column == list(values)[0])
+            else:
+                conditions.append(column.in_(values))
+        return conditions
+
     @classmethod
     def find_by_name(cls, name : str) -> list:
 
@@ -145,7 +926,7 @@ class RecommendationModel(db.Model):
         Args:
             name (string): the name of the RecommendationModel you want to match
         """
-        logger.info("Processing name query for %s ...", name)
+        query_logger.info("Processing name query for %s ...", name)
         return cls.query.filter(cls.name == name)
 
     @classmethod
@@ -154,7 +935,7 @@ class RecommendationModel(db.Model):
         Args:
             name (string): the reason of the Recommendation you want to match
         """
-        logger.info("Processing name query for %s ...", reason)
+        query_logger.info("Processing name query for %s ...", reason)
         return cls.query.filter(cls.reason == reason)
     
     @classmethod
@@ -163,7 +944,7 @@ class RecommendationModel(db.Model):
         Args:
             original_product_id (ints): the recommended product ID of the Recommendation you want to match
         """
-        logger.info("Processing name query for %s ...", original_product_id)
+        query_logger.info("Processing name query for %s ...", original_product_id)
         return cls.query.filter(cls.original_product_id == original_product_id)
 
     @classmethod
@@ -172,7 +953,7 @@ class RecommendationModel(db.Model):
         Args:
             recommendation_product_id (int): the recommended product ID of the Recommendation you want to match
         """
-        logger.info("Processing name query for %s ...", recommendation_product_id)
+        query_logger.info("Processing name query for %s ...", recommendation_product_id)
         return cls.query.filter(cls.recommendation_product_id == recommendation_product_id)
 
     @classmethod
@@ -181,14 +962,477 @@ class RecommendationModel(db.Model):
         Args:
             name (string): the recommended product name of the Recommendation you want to match
         """
-        logger.info("Processing name query for %r ...", recommendation_product_name)
+        query_logger.info("Processing name query for %r ...", recommendation_product_name)
         return cls.query.filter(cls.recommendation_product_name == recommendation_product_name)
     
+    @classmethod
+    def search(cls, prefix: str, limit: int, fields=SEARCH_FIELDS, **filters) -> list:
+        """
+        Returns the ROW_COLUMNS tuples of the Recommendations whose name or
+        recommendation_product_name starts with prefix, ignoring case
+        Rows are ordered by the matching name, then id; a row that matches on
+        both fields is returned once. See search_query().
+        Args:
+            prefix (str): the start of the name, in any case
+            limit (int): the maximum number of Recommendations to return
+            fields (list): the columns to search, among SEARCH_FIELDS
+            filters: further find_by_filters() arguments, e.g. activated
+        """
+        query_logger.info("Processing search for %r in %s ...", prefix, fields)
+        seen = set()
+        results = []
+        for row in db.session.execute(cls.search_query(prefix, limit, fields, **filters)):
+            if row.id not in seen and len(results) < limit:
+                seen.add(row.id)
+                results.append(row)
+        return results
+
+    @classmethod
+    def search_query(cls, prefix: str, limit: int, fields=SEARCH_FIELDS, **filters):
+        """
+        Returns the select of search()
+        Each field is an ORDER BY ... LIMIT scan of its lower(field) COLLATE "C"
+        index: in byte order the names that start with a prefix are one range
+        of the index, so only the first limit entries of it are read however
+        many rows match. The scans of several fields are merged by UNION ALL.
+        """
+        table = cls.__table__
+        pattern = re.sub(r"([\\%_])", r"\\\1", prefix.lower()) + "%"
+        conditions = cls.filter_conditions(filters)
+        columns = [table.c[name] for name in cls.ROW_COLUMNS]
+        scans = []
+        for field in fields:
+            key = func.lower(table.c[field]).collate("C")
+            scans.append(
+                select(columns + [key.label("match")])
+                .where(and_(key.like(pattern, escape="\\"), *conditions))
+                .order_by(key, table.c.id)
+                .limit(limit)
+            )
+        matches = (union_all(*scans) if len(scans) > 1 else scans[0]).alias("matches")
+        return select([matches.c[name] for name in cls.ROW_COLUMNS]).order_by(
+            matches.c.match, matches.c.id
+        )
+
     @classmethod
     def find_by_activated(cls, activated = True) -> list:
         """Returns all Recommendations given if they were activated or not
         Args:
             activated (bool): the recommended product name of the Recommendation you want to match
         """
-        logger.info("Processing name query for %r ...", activated)
-        return cls.query.filter(cls.activated == activated)
\ No newline at end of file
+        query_logger.info("Processing name query for %r ...", activated)
+        return cls.query.filter(cls.activated == activated)
+
+
+# Serves ?top=k: a product's best scored Recommendations are the first
+# entries of its range, so ORDER BY score DESC, id LIMIT k reads k entries
+db.Index(
+    "ix_recommendation_product_score",
+    RecommendationModel.original_product_id,
+    RecommendationModel.score.desc(),
+    RecommendationModel.id,
+)
+
+
+# Serve /recommendations/search: lower() in byte order ("C" collation) makes
+# the names that start with a prefix a range of the index, which a LIKE
+# 'prefix%' seeks into and reads in ORDER BY order
+db.Index(
+    "ix_recommendation_name_prefix",
+    func.lower(RecommendationModel.name).collate("C"),
+    RecommendationModel.id,
+)
+db.Index(
+    "ix_recommendation_target_name_prefix",
+    func.lower(RecommendationModel.recommendation_product_name).collate("C"),
+    RecommendationModel.id,
+)
+
+######################################################################
+#  G E N E R A T I O N   C O U N T E R S
+######################################################################
+
+class Generation(db.Model):
+    """
+    Class that counts the writes to the Recommendations of each product
+    The row with scope GLOBAL counts every write, and TRUNCATED counts the
+    deletes that empty every product at once. List ETags are derived from
+    these counters, so revalidating a list costs one primary key lookup.
+    """
+
+    __tablename__ = "recommendation_generation"
+
+    # scope of the counter that every write bumps
+    GLOBAL = "*"
+    # scope of the counter bumped when the table is truncated; it is part of
+    # every per-product ETag, since a truncate does not bump the products
+    TRUNCATED = "truncated"
+
+    # Used by bump(); rows are locked in scope order so writers cannot deadlock
+    BUMP_SQL = text(
+        "INSERT INTO recommendation_generation (scope, generation) "
+        "SELECT scope, 1 FROM unnest(CAST(:scopes AS varchar[])) AS scope ORDER BY scope "
+        "ON CONFLICT (scope) DO UPDATE "
+        "SET generation = recommendation_generation.generation + 1"
+    )
+
+    scope = db.Column(db.String(16), primary_key=True)
+    generation = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<Generation %r generation=[%s]>" % (self.scope, self.generation)
+
+    @classmethod
+    def bump(cls, product_ids=(), truncated: bool = False):
+        """
+        Increments the global counter and the counters of the given products
+        Runs in the current transaction, so the new generations commit
+        together with the write that caused them.
+        Args:
+            product_ids (iterable): original_product_id values that were written
+            truncated (bool): also increment the TRUNCATED counter
+        """
+        scopes = {cls.GLOBAL} | {str(product_id) for product_id in product_ids}
+        if truncated:
+            scopes.add(cls.TRUNCATED)
+        scopes = sorted(scopes)
+        db.session.execute(cls.BUMP_SQL, {"scopes": scopes})
+
+    @classmethod
+    def scopes(cls, product_ids=None) -> list:
+        """ Returns the scopes whose counters current() reads """
+        if product_ids is None:
+            return [cls.GLOBAL]
+        return [cls.TRUNCATED] + [str(product_id) for product_id in product_ids]
+
+    @classmethod
+    def current(cls, product_ids=None) -> tuple:
+        """
+        Returns the generations of the given products, or the global one
+        Products that have never been written are at generation 0. The
+        product generations are preceded by the TRUNCATED counter.
+        Args:
+            product_ids (list): original_product_id values, None for the global counter
+        """
+        scopes = cls.scopes(product_ids)
+        found = dict(db.session.query(cls.scope, cls.generation).filter(cls.scope.in_(scopes)))
+        return tuple(found.get(scope, 0) for scope in scopes)
+
+
+######################################################################
+#  F A N - I N   C O U N T E R S
+######################################################################
+
+class FanIn(db.Model):
+    """
+    Class that counts the Recommendations that point at each product
+    The counters are kept by triggers on recommendation_model (migration 8),
+    so every write, including bulk deletes, COPY imports and TRUNCATE,
+    changes them in its own transaction. Reading a product's fan-in is one
+    primary key lookup instead of a COUNT(*) over its Recommendations.
+    """
+
+    __tablename__ = "recommendation_fan_in"
+
+    # Applies the changes of one statement to the counters. The deltas are
+    # upserted in product order, so concurrent writers lock counter rows in
+    # the same order and cannot deadlock. INSERT and DELETE run once per
+    # statement over its transition table; UPDATE runs per row, and only
+    # for rows whose recommendation_product_id changed.
+    TRIGGER_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION recommendation_fan_in_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO recommendation_fan_in AS f (recommendation_product_id, count)
+        SELECT recommendation_product_id, count(*) FROM new_rows
+        GROUP BY recommendation_product_id ORDER BY recommendation_product_id
+        ON CONFLICT (recommendation_product_id) DO UPDATE SET count = f.count + EXCLUDED.count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO recommendation_fan_in AS f (recommendation_product_id, count)
+        SELECT recommendation_product_id, -count(*) FROM old_rows
+        GROUP BY recommendation_product_id ORDER BY recommendation_product_id
+        ON CONFLICT (recommendation_product_id) DO UPDATE SET count = f.count + EXCLUDED.count;
+    ELSE
+        DELETE FROM recommendation_fan_in;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+    TRIGGER_FUNCTION_ROW_SQL = """
+CREATE OR REPLACE FUNCTION recommendation_fan_in_move() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO recommendation_fan_in AS f (recommendation_product_id, count)
+    SELECT product_id, delta FROM (
+        VALUES (OLD.recommendation_product_id, -1), (NEW.recommendation_product_id, 1)
+    ) AS deltas (product_id, delta) ORDER BY product_id
+    ON CONFLICT (recommendation_product_id) DO UPDATE SET count = f.count + EXCLUDED.count;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+    TRIGGERS_SQL = (
+        "CREATE TRIGGER recommendation_fan_in_insert AFTER INSERT ON recommendation_model "
+        "REFERENCING NEW TABLE AS new_rows "
+        "FOR EACH STATEMENT EXECUTE FUNCTION recommendation_fan_in_apply()",
+        "CREATE TRIGGER recommendation_fan_in_delete AFTER DELETE ON recommendation_model "
+        "REFERENCING OLD TABLE AS old_rows "
+        "FOR EACH STATEMENT EXECUTE FUNCTION recommendation_fan_in_apply()",
+        "CREATE TRIGGER recommendation_fan_in_truncate AFTER TRUNCATE ON recommendation_model "
+        "FOR EACH STATEMENT EXECUTE FUNCTION recommendation_fan_in_apply()",
+        "CREATE TRIGGER recommendation_fan_in_update "
+        "AFTER UPDATE OF recommendation_product_id ON recommendation_model FOR EACH ROW "
+        "WHEN (OLD.recommendation_product_id IS DISTINCT FROM NEW.recommendation_product_id) "
+        "EXECUTE FUNCTION recommendation_fan_in_move()",
+    )
+    RECOUNT_SQL = (
+        "INSERT INTO recommendation_fan_in (recommendation_product_id, count) "
+        "SELECT recommendation_product_id, count(*) FROM recommendation_model "
+        "GROUP BY recommendation_product_id"
+    )
+
+    recommendation_product_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<FanIn %r count=[%s]>" % (self.recommendation_product_id, self.count)
+
+    @classmethod
+    def current(cls, product_id: int) -> int:
+        """ Returns the number of Recommendations of product_id, 0 if none """
+        query_logger.info("Processing fan-in lookup for %s ...", product_id)
+        found = db.session.query(cls.count).filter(
+            cls.recommendation_product_id == product_id
+        ).scalar()
+        return found or 0
+
+    @classmethod
+    def install(cls, conn):
+        """
+        Creates the counter triggers and recounts every product
+        Creating the triggers locks recommendation_model against writes until
+        the transaction commits, so the recount cannot miss a write.
+        """
+        conn.execute(text(cls.TRIGGER_FUNCTION_SQL))
+        conn.execute(text(cls.TRIGGER_FUNCTION_ROW_SQL))
+        for trigger in ("insert", "delete", "truncate", "update"):
+            conn.execute(text(
+                "DROP TRIGGER IF EXISTS recommendation_fan_in_%s ON recommendation_model" % trigger
+            ))
+        for sql in cls.TRIGGERS_SQL:
+            conn.execute(text(sql))
+        conn.execute(text("DELETE FROM recommendation_fan_in"))
+        conn.execute(text(cls.RECOUNT_SQL))
+
+
+######################################################################
+#  S C H E M A   M I G R A T I O N S
+######################################################################
+
+class SchemaVersion(db.Model):
+    """
+    Class that records which schema migrations have been applied
+    """
+
+    __tablename__ = "schema_version"
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(127), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return "<SchemaVersion %r version=[%s]>" % (self.description, self.version)
+
+    @classmethod
+    def current(cls) -> int:
+        """ Returns the highest migration version applied, 0 if none """
+        return db.session.query(db.func.coalesce(db.func.max(cls.version), 0)).scalar()
+
+
+# Arbitrary key for the advisory lock that serializes concurrent migrators
+MIGRATION_LOCK_ID = 7200417
+
+
+def _create_tables(conn):
+    """ Creates any missing tables (and their indexes, for new tables) """
+    db.Model.metadata.create_all(bind=conn)
+
+
+def _create_indexes_concurrently(conn, names):
+    """
+    Adds declared RecommendationModel indexes to a live table
+    CREATE INDEX CONCURRENTLY does not block writers, but it cannot run inside a
+    transaction block, so this step runs on an autocommit connection. A build
+    that was interrupted leaves an INVALID index behind; those are dropped and
+    rebuilt so that IF NOT EXISTS does not skip them.
+    Args:
+        names (list): the names of the indexes to build
+    """
+    table = RecommendationModel.__table__
+    for index in sorted(table.indexes, key=lambda idx: idx.name):
+        if index.name not in names:
+            continue
+        valid = conn.execute(
+            text(
+                "SELECT i.indisvalid FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ),
+            name=index.name,
+        ).scalar()
+        if valid is False:
+            logger.warning("Dropping invalid index %s", index.name)
+            conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS %s" % index.name))
+        ddl = str(CreateIndex(index).compile(dialect=conn.dialect))
+        ddl = ddl.replace("CREATE INDEX ", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ", 1)
+        logger.info("Building index %s", index.name)
+        conn.execute(text(ddl))
+
+
+def _create_filter_indexes(conn):
+    """
+    Builds the indexes of the find_by_* filter columns
+    ix_recommendation_target_id is no longer declared, so a database that
+    has yet to apply this step skips it; migration 7 builds its replacement,
+    ix_recommendation_target_page, and drops it where it was built.
+    """
+    _create_indexes_concurrently(conn, [
+        "ix_recommendation_product_activated_reason",
+        "ix_recommendation_name",
+        "ix_recommendation_reason_activated",
+        "ix_recommendation_target_id",
+        "ix_recommendation_target_name",
+        "ix_recommendation_activated",
+    ])
+
+
+def _create_score_index(conn):
+    """ Builds the index of the ?top=k queries """
+    _create_indexes_concurrently(conn, ["ix_recommendation_product_score"])
+
+
+def _create_search_indexes(conn):
+    """ Builds the indexes of the prefix searches """
+    _create_indexes_concurrently(conn, [
+        "ix_recommendation_name_prefix",
+        "ix_recommendation_target_name_prefix",
+    ])
+
+
+def _create_target_page_index(conn):
+    """ Replaces the recommendation_product_id index with the (.., id) one """
+    _create_indexes_concurrently(conn, ["ix_recommendation_target_page"])
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_recommendation_target_id"))
+
+
+def _add_fan_in(conn):
+    """ Adds the fan-in counters table and the triggers that keep it """
+    FanIn.__table__.create(bind=conn, checkfirst=True)
+    FanIn.install(conn)
+
+
+def _add_versions(conn):
+    """
+    Adds the row version column and the generation counters table
+    A column with a constant default is added without rewriting the table
+    (Postgres 11+), so this only holds its lock for a moment.
+    """
+    conn.execute(text(
+        "ALTER TABLE recommendation_model "
+        "ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"
+    ))
+    Generation.__table__.create(bind=conn, checkfirst=True)
+
+
+def _add_scores(conn):
+    """ Adds the score and rank columns, without rewriting the table """
+    conn.execute(text(
+        "ALTER TABLE recommendation_model "
+        "ADD COLUMN IF NOT EXISTS score DOUBLE PRECISION NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS rank INTEGER"
+    ))
+
+
+# Ordered list of (version, description, step, transactional).
+# Append new migrations to the end; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, "create tables", _create_tables, True),
+    (2, "secondary indexes on filter columns", _create_filter_indexes, False),
+    (3, "row versions and generation counters", _add_versions, True),
+    (4, "score and rank columns", _add_scores, True),
+    (5, "score index for top-k queries", _create_score_index, False),
+    (6, "lower-case name indexes for prefix search", _create_search_indexes, False),
+    (7, "target index for paging reverse lookups", _create_target_page_index, False),
+    (8, "fan-in counters", _add_fan_in, True),
+]
+
+
+def migrate(target: int = None) -> int:
+    """
+    Applies every pending migration up to target (default: the latest)
+    A Postgres advisory lock makes concurrent workers wait for whichever one
+    migrates first instead of racing on the same DDL.
+    Returns the schema version after migrating
+    """
+    target = target if target is not None else MIGRATIONS[-1][0]
+    engine = db.engine
+    with engine.connect() as lock_conn:
+        lock_conn = lock_conn.execution_options(isolation_level="AUTOCOMMIT", slow_query_log=False)
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), id=MIGRATION_LOCK_ID)
+        # index builds can outlast DB_STATEMENT_TIMEOUT
+        lock_conn.execute(text("SET statement_timeout = 0"))
+        try:
+            SchemaVersion.__table__.create(bind=lock_conn, checkfirst=True)
+            current = lock_conn.execute(
+                text("SELECT coalesce(max(version), 0) FROM schema_version")
+            ).scalar()
+            for version, description, step, transactional in MIGRATIONS:
+                if version <= current or version > target:
+                    continue
+                logger.info("Applying migration %d: %s", version, description)
+                if transactional:
+                    with engine.begin() as conn:
+                        conn = conn.execution_options(slow_query_log=False)
+                        conn.execute(text("SET LOCAL statement_timeout = 0"))
+                        step(conn)
+                else:
+                    step(lock_conn)
+                lock_conn.execute(
+                    SchemaVersion.__table__.insert().values(
+                        version=version, description=description, applied_at=datetime.utcnow()
+                    )
+                )
+                current = version
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), id=MIGRATION_LOCK_ID)
+            lock_conn.execute(text("RESET statement_timeout"))
+    return current
+
+
+def schema_version() -> int:
+    """ Returns the applied schema version with one query, 0 without a schema """
+    with db.engine.connect() as conn:
+        try:
+            return conn.execute(text("SELECT max(version) FROM schema_version")).scalar() or 0
+        except ProgrammingError:
+            return 0
+
+
+def check_schema(mode: str = "check") -> int:
+    """
+    Brings the schema up to date at boot
+    Args:
+        mode (str): "migrate" always runs migrate(), which takes the migration
+            lock and inspects the catalog; "check" reads the schema version with
+            one query and migrates only if it is behind; "skip" trusts that the
+            schema was migrated by the deploy (flask recommendations migrate)
+    Returns the schema version, None when skipped
+    """
+    if mode == "skip":
+        return None
+    if mode == "check":
+        version = schema_version()
+        if version >= MIGRATIONS[-1][0]:
+            return version
+    elif mode != "migrate":
+        raise ValueError("Invalid SCHEMA_CHECK: {}".format(mode))
+    return migrate()
@@ -0,0 +1,144 @@
+"""
+Module: pool
+Database connection pool telemetry
+
+InstrumentedQueuePool is a QueuePool that times every connection checkout:
+how long a request waited for a connection, including the time to open a
+new one. The waits are counted in a fixed-bucket histogram so that queueing
+inside the pool shows up in /debug/pool before it shows up as request latency.
+Each worker process has its own pool and its own statistics.
+
+Pooled connections remember the process that opened them. A process forked
+after connecting, such as a gunicorn worker of a --preload master, discards
+its parent's connections on checkout instead of sharing their sockets.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds of the wait time histogram buckets, in seconds
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class WaitHistogram:
+    """
+    A thread safe histogram of connection checkout waits
+    Bucket i counts the waits of at most WAIT_BUCKETS[i] seconds that did not
+    fit an earlier bucket; the last bucket counts everything slower.
+    """
+
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears every counter"""
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.total = 0
+            self.seconds = 0.0
+            self.max_seconds = 0.0
+            self.timeouts = 0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        """Counts one checkout that took seconds"""
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += 1
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def stats(self) -> dict:
+        """Returns the counters, with the histogram keyed by bucket bound in ms"""
+        with self._lock:
+            labels = ["%g" % (bound * 1000) for bound in self.buckets] + ["+Inf"]
+            return {
+                "checkouts": self.total,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.seconds, 6),
+                "wait_seconds_max": round(self.max_seconds, 6),
+                "wait_ms_histogram": dict(zip(labels, self.counts)),
+            }
+
+
+# Checkout waits of every InstrumentedQueuePool in this process
+pool_waits = WaitHistogram()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long each checkout waited in pool_waits
+    The time covers waiting for a free connection, opening a new one and the
+    pre-ping, if enabled. Select it with SQLALCHEMY_ENGINE_OPTIONS["poolclass"].
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_waits.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_waits.record(time.perf_counter() - start)
+        return connection
+
+
+@event.listens_for(InstrumentedQueuePool, "connect")
+def remember_process(dbapi_connection, connection_record):
+    """Notes which process opened a connection"""
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(InstrumentedQueuePool, "checkout")
+def check_process(dbapi_connection, connection_record, connection_proxy):
+    """Replaces a connection inherited from the parent of a forked process"""
+    pid = connection_record.info.get("pid", os.getpid())
+    if pid != os.getpid():
+        # forget the socket without closing it, the parent may still use it
+        connection_record.connection = connection_proxy.connection = None
+        raise DisconnectionError(
+            "Connection opened by process %d, checked out by %d" % (pid, os.getpid())
+        )
+
+
+def pool_stats(pool) -> dict:
+    """Returns the live state of a pool plus the checkout wait statistics"""
+    stats = {"pool": pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,  # pylint: disable=protected-access
+            "timeout": pool.timeout(),
+        })
+    stats.update(pool_waits.stats())
+    return stats
+
+
+def engine_options(config) -> dict:
+    """Returns SQLALCHEMY_ENGINE_OPTIONS for the DB_* pool settings in config"""
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    if config["DB_STATEMENT_TIMEOUT"]:
+        # applied by the server to every statement on the connection
+        options["connect_args"] = {
+            "options": "-c statement_timeout=%d" % config["DB_STATEMENT_TIMEOUT"]
+        }
+    return options
@@ -2,21 +2,49 @@
 The recommendations resource is a representation a product recommendation based on
 another product. In essence it is just a relationship between two products that "go
 together" (e.g., radio and batteries, printers and ink, shirts and pants, etc.).
-GET /recommendations - Returns a list all of the recommendations
+GET /recommendations - Returns a list all of the recommendations (NDJSON when streamed)
+GET /recommendations?limit=N&cursor=C - Returns one page of recommendations
+GET /recommendations?top=K - Returns the K best scored recommendations of each product
+GET /recommendations/search?q=P - Returns the Recommendations whose names start with P
 GET /recommendations/{id} - Returns the Recommendation with a given id number
+    (GET responses carry an ETag; send If-None-Match to get 304 Not Modified)
 POST /recommendations - creates a new Recommendation record in the database
+POST /recommendations/bulk - creates many Recommendation records in one transaction
+POST /recommendations/lookup - returns the Recommendations of many products at once
 PUT /recommendations/{id} - updates a Recommendation record in the database
 DELETE /recommendations/{id} - deletes a Recommendation record in the database
+DELETE /recommendations?filters - deletes every matching Recommendation (all if unfiltered)
+PUT /recommendations/activate?filters - activates every matching Recommendation
+PUT /recommendations/deactivate?filters - deactivates every matching Recommendation
+GET /products/{id}/recommended-by - Returns the Recommendations of other products that point at product id
+GET /products/{id}/recommended-by/count - Returns how many Recommendations point at product id
+GET /assets/{file} - Returns a fingerprinted static file of flask recommendations build-assets
+GET /metrics - Returns the request metrics of every worker in the Prometheus text format
 """
 
-from flask import jsonify, request, url_for, make_response, abort
+import base64
+import binascii
+import hashlib
+import json
+from flask import jsonify, request, url_for, make_response, abort, Response, stream_with_context
+from flask import json as flask_json
+from prometheus_client import CONTENT_TYPE_LATEST
 from werkzeug.exceptions import NotFound
 from . import status  # HTTP Status Codes
 from . import app  # Import Flask application
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
-from service.models import RecommendationModel
+from service.models import RecommendationModel, DataValidationError, FanIn, Generation, db
+from service.cache import recommendation_cache
+from service.adjacency import adjacency_index
+from service.pool import pool_stats
+from service.slow_queries import slow_query_log
+from service.assets import assets_built, send_asset
+from service.metrics import metrics_text, serializing
+from service.encoding import (
+    encode_array, encode_groups, encode_row, fast_encoding_allowed, row_to_dict
+)
 
 
 ######################################################################
@@ -26,6 +54,11 @@ from service.models import RecommendationModel
 def index():
 
     """Based URL response"""
+    if assets_built(app.config["ASSETS_DIR"]):
+        # references fingerprinted assets, so it is revalidated on every load
+        return send_asset(
+            app.config["ASSETS_DIR"], "index.html", request.accept_encodings, "no-cache"
+        )
     return app.send_static_file("index.html")
 
     # app.logger.info("Request for Root URL")
@@ -38,6 +71,17 @@ def index():
     #    status.HTTP_200_OK,
 #    )
 
+######################################################################
+# FINGERPRINTED STATIC ASSETS
+######################################################################
+@app.route("/assets/<path:filename>")
+def assets(filename):
+    """Serves a file of `flask recommendations build-assets`, precompressed if accepted"""
+    return send_asset(
+        app.config["ASSETS_DIR"], filename, request.accept_encodings,
+        "public, max-age=%d, immutable" % app.config["ASSETS_MAX_AGE"],
+    )
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
@@ -71,6 +115,145 @@ def create_recommendations():
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
 
+#####################################################################
+# ADD MANY RECOMMENDATIONS
+#####################################################################
+@app.route("/recommendations/bulk", methods=["POST"])
+def create_recommendations_bulk():
+    """
+    Creates many Recommendations
+    This endpoint accepts a JSON array or an NDJSON body (one recommendation per
+    line). Every row is validated with the deserialize rules and the valid ones are
+    inserted in one transaction. Invalid rows are reported by their position
+    in the body and do not stop the rest of the batch.
+    """
+    app.logger.info("Request to create recommendations in bulk")
+    check_content_type("application/json", "application/x-ndjson")
+    errors = {}
+    if request.headers.get("Content-Type") == "application/json":
+        rows = request.get_json()
+        if not isinstance(rows, list):
+            raise DataValidationError("Invalid request: body must be a JSON array")
+        rows = enumerate(rows)
+    else:
+        rows = _read_ndjson(request.stream, errors)
+
+    positions = []
+
+    def valid_rows():
+        for index, data in rows:
+            try:
+                row = RecommendationModel.validate(data)
+            except DataValidationError as error:
+                errors[index] = str(error)
+                continue
+            positions.append(index)
+            yield row
+
+    ids, failures = RecommendationModel.create_many(
+        valid_rows(), app.config["BULK_BATCH_SIZE"]
+    )
+    for position, message in failures.items():
+        errors[positions[position]] = message
+    created = [rec_id for rec_id in ids if rec_id is not None]
+
+    app.logger.info("Created %d recommendations, %d rows rejected", len(created), len(errors))
+    message = {
+        "created": len(created),
+        "ids": created,
+        "errors": [{"index": index, "message": errors[index]} for index in sorted(errors)],
+    }
+    if errors and not created:
+        return make_response(jsonify(message), status.HTTP_400_BAD_REQUEST)
+    return make_response(jsonify(message), status.HTTP_201_CREATED)
+
+######################################################################
+# LOOK UP THE RECOMMENDATIONS OF MANY PRODUCTS
+######################################################################
+@app.route("/recommendations/lookup", methods=["POST"])
+def lookup_recommendations():
+    """
+    Looks up the Recommendations of many products in one query
+    The JSON body has "original_product_ids" and/or "ids" lists, and optionally
+    a per-product "limit", a "reason" (a name or a list of names) and an
+    "activated" flag, e.g.
+    {"original_product_ids": [1, 2, 3], "limit": 5, "activated": true}
+    Returns [{"original_product_id": 1, "recommendations": [...]}, ...] with a
+    group for every requested product, in request order, followed by the
+    products of any ids; each group is ordered by score, highest first
+    """
+    app.logger.info("Request to look up recommendations")
+    check_content_type("application/json")
+    lookup = read_lookup(request.get_json())
+    groups = RecommendationModel.lookup(**lookup)
+    app.logger.info("Returning recommendations for %d products", len(groups))
+    if fast_encoding_allowed(app.config):
+        with serializing():
+            body = encode_groups(groups)
+        response = app.response_class(body, mimetype=app.config["JSONIFY_MIMETYPE"])
+    else:
+        response = jsonify([
+            {"original_product_id": product_id, "recommendations": [row_to_dict(row) for row in rows]}
+            for product_id, rows in groups
+        ])
+    return make_response(response, status.HTTP_200_OK)
+
+######################################################################
+# SEARCH RECOMMENDATIONS BY NAME PREFIX
+######################################################################
+@app.route("/recommendations/search", methods=["GET"])
+def search_recommendations():
+    """
+    Searches Recommendations by the start of their names
+    ?q= is matched, ignoring case, against the start of the name and of the
+    recommendation_product_name of every Recommendation, e.g. ?q=radi finds
+    "Radio" and "radiator". Send ?field=name or ?field=recommendation_product_name
+    to search one of them, and ?limit=N for more than SEARCH_PAGE_SIZE results.
+    The list filters (activated, reason, ...) narrow the results further.
+    Results are ordered by the matching name.
+    """
+    app.logger.info("Request to search recommendations")
+    prefix = request.args.get("q", "")
+    if not prefix.strip():
+        raise DataValidationError("Invalid request: q is required")
+    if len(prefix) > app.config["SEARCH_MAX_LENGTH"]:
+        raise DataValidationError(
+            "Invalid q: longer than {} characters".format(app.config["SEARCH_MAX_LENGTH"])
+        )
+    fields = search_fields(request.args)
+    limit = page_limit(request.args, app.config["SEARCH_PAGE_SIZE"])
+    filters = RecommendationModel.filters_from_args(request.args)
+    rows = RecommendationModel.search(prefix, limit, fields, **filters)
+    app.logger.info("Returning %d recommendations starting with %r", len(rows), prefix)
+    return rows_response(rows)
+
+######################################################################
+# LIST THE RECOMMENDATIONS THAT POINT AT A PRODUCT
+######################################################################
+@app.route("/products/<int:product_id>/recommended-by", methods=["GET"])
+def list_recommended_by(product_id):
+    """
+    Lists the Recommendations whose recommendation_product_id is product_id
+    One page at a time in id order, from the (recommendation_product_id, id)
+    index; the next page is linked as in GET /recommendations?limit=N.
+    X-Total-Count is the product's fan-in, read from its counter.
+    """
+    app.logger.info("Request to list the recommendations of product %s", product_id)
+    recs = RecommendationModel.find_by_recommendation_product_id(product_id)
+    response = page_response(recs, "list_recommended_by", product_id=product_id)
+    response.headers["X-Total-Count"] = FanIn.current(product_id)
+    return response
+
+
+@app.route("/products/<int:product_id>/recommended-by/count", methods=["GET"])
+def count_recommended_by(product_id):
+    """Returns the number of Recommendations that point at a product"""
+    app.logger.info("Request to count the recommendations of product %s", product_id)
+    count = FanIn.current(product_id)
+    return make_response(
+        jsonify(recommendation_product_id=product_id, count=count), status.HTTP_200_OK
+    )
+
 ######################################################################
 # UPDATE AN EXISTING RECOMMENDATION
 ######################################################################
@@ -100,39 +283,63 @@ def list_recommendations():
     """
     Lists all Recommendations
     This endpoint will list all recommendations in the database.
+    Every filter parameter given is applied, e.g.
+    ?original_product_id=5&activated=true&reason=UP_SELL,ACCESSORY
+    Send "Accept: application/x-ndjson" or ?stream=true to stream the results
+    as NDJSON from a server-side cursor instead of building one JSON array.
+    Send ?limit=N to get one page instead; the next page is linked from the
+    Link header and its opaque ?cursor= token is also in X-Next-Cursor.
+    Send ?top=K to get only the K best scored recommendations of each
+    product, ordered by product and then by score, highest first.
+    Send If-None-Match with a previous ETag to get 304 Not Modified if none
+    of the listed products has been written since.
     """
     app.logger.info("Request to list all recommendations")
 
-    recs = []
-
-    original_product_id = request.args.get("original_product_id")
-    name = request.args.get("name")
-    recommendation_product_name = request.args.get("recommendation_product_name")
-    reason = request.args.get("reason")
-    activated = request.args.get("activated")
-
-
-    if original_product_id:
-        app.logger.info("Filtering by original product ID: %s", original_product_id)
-        recs = RecommendationModel.find_by_original_product_id(original_product_id)
-    elif name:
-        app.logger.info("Filtering by name: %s", name)
-        recs = RecommendationModel.find_by_name(name)
-    elif recommendation_product_name:
-        app.logger.info("Filtering by Recommended Product Name: %s", recommendation_product_name)
-        recs = RecommendationModel.find_by_recommendation_product_name(recommendation_product_name)
-    elif reason:
-        app.logger.info("Filtering by reason: %s", original_product_id)
-        recs = RecommendationModel.find_by_reason(reason)
-    elif activated:
-        app.logger.info("Filtering by whether it is activated: %s", activated)
-        recs = RecommendationModel.find_by_reason(activated)
+    filters = RecommendationModel.filters_from_args(request.args)
+    if filters:
+        app.logger.info("Filtering by %s", filters)
+
+    top = top_k(request.args)
+    if served_by_adjacency_index(filters):
+        # ?activated=false&activated=false filters; true and false do not
+        activated = set(filters.get("activated", []))
+        results = adjacency_index.lookup(
+            filters["original_product_id"],
+            activated.pop() if len(activated) == 1 else None,
+            filters.get("reason"),
+            top,
+        )
+        app.logger.info("Returning %d recommendations from the index", len(results))
+        response = make_response(jsonify(results), status.HTTP_200_OK)
+        # the index can lag other workers' writes, so its ETag hashes the body
+        response.add_etag()
+        return response.make_conditional(request)
+
+    etag = list_etag(filters)
+    if request.if_none_match.contains_weak(etag):
+        app.logger.info("Recommendations not modified")
+        return not_modified(etag)
+
+    recs = RecommendationModel.find_by_filters(**filters)
+
+    if top is not None:
+        batch_size = app.config["STREAM_BATCH_SIZE"] if wants_ndjson() else None
+        rows = RecommendationModel.top(top, batch_size, **filters)
+        response = ndjson_response(rows) if batch_size else rows_response(rows.fetchall())
+    elif "limit" in request.args or "cursor" in request.args:
+        response = page_response(recs)
+    elif wants_ndjson():
+        app.logger.info("Streaming recommendations as NDJSON")
+        response = ndjson_response(
+            RecommendationModel.rows(recs, app.config["STREAM_BATCH_SIZE"])
+        )
     else:
-        recs = RecommendationModel.all()
-
-    results = [rec.serialize() for rec in recs]
-    app.logger.info("Returning %d recommendations", len(results))
-    return make_response(jsonify(results), status.HTTP_200_OK)
+        rows = RecommendationModel.rows(recs).fetchall()
+        app.logger.info("Returning %d recommendations", len(rows))
+        response = rows_response(rows)
+    response.set_etag(etag)
+    return response
 
 
 
@@ -141,17 +348,264 @@ def list_recommendations():
 ######################################################################
 
 
-def check_content_type(media_type):
+def check_content_type(*media_types):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
-    if content_type and content_type == media_type:
+    if content_type and content_type in media_types:
         return
     app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-        "Content-Type must be {}".format(media_type),
+        "Content-Type must be {}".format(" or ".join(media_types)),
     )
 
+
+def served_by_adjacency_index(filters):
+    """Returns True if the adjacency index can answer this list request"""
+    if not adjacency_index.ready or "original_product_id" not in filters:
+        return False
+    if not set(filters) <= {"original_product_id", "activated", "reason"}:
+        return False
+    if "limit" in request.args or "cursor" in request.args:
+        return False
+    return not wants_ndjson()
+
+
+def list_etag(filters):
+    """
+    Returns the ETag of a list response from the generation counters
+    Lists filtered by original_product_id depend only on the counters of
+    those products, any other list on the global counter. The counters are
+    read before the list itself, so a write that commits in between can only
+    make the ETag older than the body, never newer. The query string and the
+    response format are hashed in as well, since each gives a different body.
+    """
+    generations = Generation.current(filters.get("original_product_id"))
+    return hash_list_etag(generations, request.args, wants_ndjson())
+
+
+def hash_list_etag(generations, args, ndjson):
+    """Returns the list ETag of the given counters, query arguments and format"""
+    key = repr((generations, sorted(args.items(multi=True)), ndjson))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def not_modified(etag):
+    """Returns an empty 304 Not Modified response carrying the ETag"""
+    response = make_response("", status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+
+def page_response(recs, endpoint="list_recommendations", **values):
+    """
+    Returns one keyset page of Recommendations with a Link to the next one
+    Args:
+        recs (Query): the Recommendations to page through
+        endpoint (str): the view that the Link points at, with its URL values
+    """
+    limit = page_limit(request.args)
+    after_id = decode_cursor(request.args["cursor"]) if "cursor" in request.args else None
+
+    page = RecommendationModel.rows(RecommendationModel.page_query(recs, limit + 1, after_id)).fetchall()
+    headers = {}
+    if len(page) > limit:
+        page = page[:limit]
+        cursor = encode_cursor(page[-1].id)
+        args = request.args.to_dict()
+        args["cursor"] = cursor
+        args["limit"] = limit
+        next_url = url_for(endpoint, _external=True, **dict(args, **values))
+        headers["Link"] = '<{}>; rel="next"'.format(next_url)
+        headers["X-Next-Cursor"] = cursor
+
+    app.logger.info("Returning page of %d recommendations", len(page))
+    return rows_response(page, headers)
+
+
+def bulk_filters():
+    """
+    Returns the find_by_filters() arguments of a bulk write request
+    The query parameters are the list endpoint's filters, and a JSON body
+    can add {"ids": [...]}. Unknown or empty parameters are rejected rather
+    than ignored, so a typo cannot widen a write to the whole table.
+    Returns None if the ids leave nothing to match.
+    """
+    unknown = set(request.args) - set(RecommendationModel.FILTER_PARSERS)
+    if unknown:
+        raise DataValidationError("Invalid filter: " + ", ".join(sorted(unknown)))
+    filters = RecommendationModel.filters_from_args(request.args)
+    if request.args and not filters:
+        raise DataValidationError("Invalid request: filters have no values")
+    if request.get_data():
+        check_content_type("application/json")
+        ids = read_ids(request.get_json())
+        if "id" in filters:
+            ids = [rec_id for rec_id in ids if rec_id in set(filters["id"])]
+        if not ids:
+            return None
+        filters["id"] = ids
+    return filters
+
+
+def read_lookup(data):
+    """Returns the RecommendationModel.lookup() arguments of a lookup body"""
+    if not isinstance(data, dict):
+        raise DataValidationError("Invalid request: body must be a JSON object")
+    lookup = {}
+    for key, argument in (("original_product_ids", "product_ids"), ("ids", "ids")):
+        values = data.get(key, [])
+        if not isinstance(values, list) or not all(
+                isinstance(value, int) and not isinstance(value, bool) for value in values):
+            raise DataValidationError("Invalid {}: must be a list of integers".format(key))
+        lookup[argument] = values
+    keys = len(lookup["product_ids"]) + len(lookup["ids"])
+    if not keys:
+        raise DataValidationError("Invalid request: give original_product_ids or ids")
+    if keys > app.config["LOOKUP_MAX_KEYS"]:
+        raise DataValidationError(
+            "Invalid request: at most {} keys per lookup".format(app.config["LOOKUP_MAX_KEYS"])
+        )
+    if "limit" in data:
+        limit = data["limit"]
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            raise DataValidationError("Invalid limit: {}".format(limit))
+        lookup["limit"] = min(limit, app.config["MAX_PAGE_SIZE"])
+    if "reason" in data:
+        reasons = data["reason"] if isinstance(data["reason"], list) else [data["reason"]]
+        if not all(isinstance(reason, str) for reason in reasons):
+            raise DataValidationError("Invalid reason: {}".format(data["reason"]))
+        lookup["reason"] = [RecommendationModel.FILTER_PARSERS["reason"](reason) for reason in reasons]
+    if "activated" in data:
+        if not isinstance(data["activated"], bool):
+            raise DataValidationError("Invalid activated: {}".format(data["activated"]))
+        lookup["activated"] = data["activated"]
+    return lookup
+
+
+def read_ids(data):
+    """Returns the list of Recommendation ids in a {"ids": [...]} body"""
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(
+            isinstance(rec_id, int) and not isinstance(rec_id, bool) for rec_id in ids):
+        raise DataValidationError('Invalid request: body must be {"ids": [integers]}')
+    return ids
+
+
+def top_k(args):
+    """Returns the ?top= number of recommendations per product, or None"""
+    if "top" not in args:
+        return None
+    if "limit" in args or "cursor" in args:
+        raise DataValidationError("Invalid request: top cannot be combined with limit or cursor")
+    try:
+        top = int(args["top"])
+    except ValueError as error:
+        raise DataValidationError("Invalid top: {}".format(args["top"])) from error
+    if top < 1:
+        raise DataValidationError("Invalid top: {}".format(top))
+    return min(top, app.config["MAX_PAGE_SIZE"])
+
+
+def page_limit(args, default=None):
+    """Returns the ?limit= page size, capped at MAX_PAGE_SIZE"""
+    limit = args.get("limit", default or app.config["DEFAULT_PAGE_SIZE"])
+    try:
+        limit = int(limit)
+    except ValueError as error:
+        raise DataValidationError("Invalid limit: {}".format(limit)) from error
+    if limit < 1:
+        raise DataValidationError("Invalid limit: {}".format(limit))
+    return min(limit, app.config["MAX_PAGE_SIZE"])
+
+
+def search_fields(args):
+    """Returns the ?field= columns of a search, all SEARCH_FIELDS by default"""
+    fields = [
+        field.strip() for value in args.getlist("field") for field in value.split(",")
+        if field.strip()
+    ]
+    for field in fields:
+        if field not in RecommendationModel.SEARCH_FIELDS:
+            raise DataValidationError("Invalid field: {}".format(field))
+    return tuple(dict.fromkeys(fields)) or RecommendationModel.SEARCH_FIELDS
+
+
+def rows_response(rows, headers=None):
+    """Returns a JSON array of RecommendationModel.rows() tuples"""
+    if fast_encoding_allowed(app.config):
+        with serializing():
+            body = encode_array(rows)
+        response = app.response_class(body, mimetype=app.config["JSONIFY_MIMETYPE"])
+    else:
+        response = jsonify([row_to_dict(row) for row in rows])
+    return make_response(response, status.HTTP_200_OK, headers or {})
+
+
+def encode_cursor(last_id):
+    """Encodes the id of the last row on a page as an opaque cursor"""
+    token = json.dumps({"id": last_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(token).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor back into the last id"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))["id"]
+    except (ValueError, KeyError, TypeError, binascii.Error) as error:
+        raise DataValidationError("Invalid cursor: {}".format(cursor)) from error
+    if not isinstance(last_id, int):
+        raise DataValidationError("Invalid cursor: {}".format(cursor))
+    return last_id
+
+
+def wants_ndjson():
+    """Returns True if the client asked for a streamed NDJSON response"""
+    return ndjson_requested(request.args, request.accept_mimetypes)
+
+
+def ndjson_requested(args, accept_mimetypes):
+    """Returns True if the query arguments or Accept header ask for NDJSON"""
+    if args.get("stream", "").lower() in ("true", "1"):
+        return True
+    best = accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+    return best == "application/x-ndjson"
+
+
+def ndjson_response(rows):
+    """Streams RecommendationModel.rows() tuples as NDJSON, one chunk per batch"""
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+    if fast_encoding_allowed(app.config):
+        encode = encode_row
+    else:
+        encode = lambda row: flask_json.dumps(row_to_dict(row))  # noqa: E731
+
+    def generate():
+        lines = []
+        for row in rows:
+            lines.append(encode(row))
+            if len(lines) >= batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return Response(
+        stream_with_context(generate()), status.HTTP_200_OK, mimetype="application/x-ndjson"
+    )
+
+
+def _read_ndjson(stream, errors):
+    """Yields (line index, object) for each non-blank NDJSON line"""
+    for index, line in enumerate(stream):
+        if not line.strip():
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError as error:
+            errors[index] = "Invalid JSON: {}".format(error)
+
 ######################################################################
 # RETRIEVE A RECOMMENDATION
 ######################################################################
@@ -160,14 +614,29 @@ def get_recommendation(recommendations_id):
     """
     Retrieve a single recommendation
     This endpoint will return a recommendation based on it's id
+    Serialized recommendations and their ETags are cached per worker and
+    invalidated on write, so a matching If-None-Match is answered with
+    304 Not Modified without touching the database.
     """
     app.logger.info("Request for recommendation with id: %s", recommendations_id)
-    recommendation = RecommendationModel.find(recommendations_id)
-    if not recommendation:
-        raise NotFound("Recommendation with id '{}' was not found.".format(recommendations_id))
-
-    app.logger.info("Returning recommendation: %s", recommendation.name)
-    return make_response(jsonify(recommendation.serialize()), status.HTTP_200_OK)
+    cached = recommendation_cache.get(recommendations_id)
+    if cached is None:
+        version = recommendation_cache.version()
+        rec = RecommendationModel.find(recommendations_id)
+        if not rec:
+            raise NotFound("Recommendation with id '{}' was not found.".format(recommendations_id))
+        cached = (rec.serialize(), rec.etag())
+        recommendation_cache.set(recommendations_id, cached, version)
+
+    recommendation, etag = cached
+    if request.if_none_match.contains_weak(etag):
+        app.logger.info("Recommendation %s not modified", recommendations_id)
+        return not_modified(etag)
+
+    app.logger.info("Returning recommendation: %s", recommendation["name"])
+    response = make_response(jsonify(recommendation), status.HTTP_200_OK)
+    response.set_etag(etag)
+    return response
 
 ######################################################################
 # DELETE A RECOMMENDATION
@@ -185,6 +654,28 @@ def delete_recommendations(recommendations_id):
     app.logger.info("Recommendations with ID [%s] delete complete.", recommendations_id)
     return make_response("", status.HTTP_204_NO_CONTENT)
 
+######################################################################
+# DELETE MANY RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations", methods=["DELETE"])
+def delete_recommendations_bulk():
+    """Delete many Recommendations
+    This endpoint takes the filters of the list endpoint, e.g.
+    ?original_product_id=5&reason=UP_SELL, and/or a JSON body {"ids": [1, 2]},
+    and deletes every matching Recommendation with one statement.
+    Without any filter every Recommendation is deleted. Unknown query
+    parameters are rejected rather than ignored, so a typo cannot empty
+    the table. Returns {"deleted": n}
+    """
+    app.logger.info("Request to delete recommendations matching %s", request.args)
+    filters = bulk_filters()
+    if filters is None:
+        return make_response(jsonify(deleted=0), status.HTTP_200_OK)
+
+    deleted = RecommendationModel.delete_many(**filters)
+    app.logger.info("Deleted %d recommendations", deleted)
+    return make_response(jsonify(deleted=deleted), status.HTTP_200_OK)
+
 ########################################################
 #CREATE A FUNCTION TO MANUALLY ACTIVATE RECOMMENDATION #
 ########################################################
@@ -205,3 +696,77 @@ def activate_recommendation(recommendations_id):
     rec.update()
     return jsonify(rec.serialize()), status.HTTP_200_OK
 
+
+@app.route("/recommendations/activate", methods=["PUT"])
+def activate_recommendations_bulk():
+    """Endpoint to Activate many Recommendations, see set_activated_bulk()"""
+    return set_activated_bulk(True)
+
+
+@app.route("/recommendations/deactivate", methods=["PUT"])
+def deactivate_recommendations_bulk():
+    """Endpoint to Deactivate many Recommendations, see set_activated_bulk()"""
+    return set_activated_bulk(False)
+
+
+def set_activated_bulk(activated):
+    """
+    Sets activated on every Recommendation that matches the request
+    Takes the filters of the list endpoint, e.g. ?original_product_id=5, and/or
+    a JSON body {"ids": [1, 2]}; at least one is required. Only the rows not
+    already in the target state are updated, with one conditional UPDATE.
+    Returns {"changed": [ids], "unchanged": [ids]} and, when ids were given,
+    "not_found": [the ones that do not exist or do not match the filters]
+    """
+    app.logger.info("Request to set activated=%s on recommendations matching %s",
+                    activated, request.args)
+    filters = bulk_filters()
+    if filters == {}:
+        raise DataValidationError("Invalid request: give a filter or a list of ids")
+    changed, unchanged = [], []
+    if filters is not None:
+        changed, unchanged = RecommendationModel.set_activated(activated, **filters)
+
+    message = {"changed": changed, "unchanged": unchanged}
+    if request.get_data():
+        found = set(changed) | set(unchanged)
+        message["not_found"] = [rec_id for rec_id in read_ids(request.get_json())
+                                if rec_id not in found]
+    app.logger.info("Changed %d recommendations, %d unchanged", len(changed), len(unchanged))
+    return make_response(jsonify(message), status.HTTP_200_OK)
+
+
+######################################################################
+# CACHE STATISTICS
+######################################################################
+@app.route("/debug/cache", methods=["GET"])
+def cache_stats():
+    """Returns the hit, miss and eviction counters of this worker's cache"""
+    return make_response(jsonify(recommendation_cache.stats()), status.HTTP_200_OK)
+
+
+@app.route("/debug/adjacency-index", methods=["GET"])
+def adjacency_index_stats():
+    """Returns the size of this worker's adjacency index"""
+    return make_response(jsonify(adjacency_index.stats()), status.HTTP_200_OK)
+
+
+@app.route("/debug/pool", methods=["GET"])
+def pool_statistics():
+    """Returns the state of this worker's connection pool and its checkout waits"""
+    return make_response(jsonify(pool_stats(db.engine.pool)), status.HTTP_200_OK)
+
+
+@app.route("/debug/slow-queries", methods=["GET"])
+def slow_queries():
+    """Returns this worker's most recent slow statements and their plans"""
+    return make_response(jsonify(slow_query_log.stats()), status.HTTP_200_OK)
+
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Returns the request metrics of every worker in the Prometheus text format"""
+    return Response(metrics_text(), status.HTTP_200_OK, content_type=CONTENT_TYPE_LATEST)
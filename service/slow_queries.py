@@ -0,0 +1,263 @@
+"""
+Module: slow_queries
+Slow-query log with EXPLAIN plans
+
+Every SQL statement sent through SQLAlchemy is timed with engine events.
+One that runs for longer than SLOW_QUERY_MS is logged with its parameters,
+the route of the request and the model method that sent it, and kept in a
+short history served by /debug/slow-queries. A sample of the slow
+statements is also explained by a background thread, so that the request
+that ran them does not wait: plain SELECTs with EXPLAIN (ANALYZE, BUFFERS),
+which runs them again, and everything else with a plain EXPLAIN, which
+does not. A SELECT that locks rows or calls a function that may have side
+effects (pg_advisory_lock, nextval, ...) is not run again. At most
+SLOW_QUERY_EXPLAINS_PER_MINUTE plans are captured, each under a statement
+timeout and in a transaction that is rolled back. Each worker process has
+its own log. The advisory lock and the DDL of the migrations are expected
+to be slow and are not logged: migrate() runs them with the execution
+option slow_query_log=False.
+"""
+import collections
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Longest parameter text kept per statement
+MAX_PARAMETERS_LENGTH = 1000
+
+# Names before a "(" that a SELECT may contain and still be run again by
+# EXPLAIN ANALYZE: SQL keywords and side-effect free functions
+ANALYZE_SAFE_CALLS = {
+    "all", "and", "any", "as", "by", "cast", "coalesce", "count", "else", "exists",
+    "from", "in", "join", "lateral", "like", "lower", "max", "min", "not", "on", "or",
+    "over", "row_number", "select", "sum", "then", "union", "unnest", "using", "values",
+    "when", "where",
+}
+CALL = re.compile(r"([A-Za-z_][\w.]*)\s*\(")
+LOCKING_CLAUSE = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE)
+# Statements never logged, whatever their execution options
+IGNORED = re.compile(r"\bpg_advisory_", re.IGNORECASE)
+
+
+def analyzable(statement: str) -> bool:
+    """True for a plain SELECT, which EXPLAIN ANALYZE can safely run again"""
+    if statement.lstrip()[:6].upper() != "SELECT" or LOCKING_CLAUSE.search(statement):
+        return False
+    return all(name.lower() in ANALYZE_SAFE_CALLS for name in CALL.findall(statement))
+
+
+def calling_model_method() -> str:
+    """Returns "Class.method" of the outermost service.models frame on the stack"""
+    caller = None
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    while frame is not None:
+        if frame.f_globals.get("__name__") == "service.models":
+            owner = frame.f_locals.get("cls", frame.f_locals.get("self"))
+            if isinstance(owner, type):
+                caller = "%s.%s" % (owner.__name__, frame.f_code.co_name)
+            elif owner is not None:
+                caller = "%s.%s" % (type(owner).__name__, frame.f_code.co_name)
+            else:
+                caller = frame.f_code.co_name
+        frame = frame.f_back
+    return caller
+
+
+def current_route() -> str:
+    """Returns "METHOD rule" of the current request, None outside of one"""
+    if not has_request_context():
+        return None
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return "%s %s" % (request.method, rule)
+
+
+class SlowQueryLog:
+    """
+    The slow statements of this process and the thread that explains them
+    Args:
+        threshold_ms (float): statements running longer are slow, 0 disables the log
+        sample_rate (float): the fraction of slow statements to explain
+        explains_per_minute (int): the most plans captured in any minute
+        history (int): the number of recent slow statements kept
+        explain_timeout_ms (int): statement timeout of each EXPLAIN
+    """
+
+    def __init__(self, threshold_ms: float = 0, sample_rate: float = 1.0,
+                 explains_per_minute: int = 6, history: int = 50,
+                 explain_timeout_ms: int = 5000, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=16)
+        self._thread = None
+        self.configure(threshold_ms, sample_rate, explains_per_minute, history, explain_timeout_ms)
+
+    def configure(self, threshold_ms: float, sample_rate: float, explains_per_minute: int,
+                  history: int, explain_timeout_ms: int):
+        """Changes the settings, forgetting the statements seen so far"""
+        with self._lock:
+            self.threshold = threshold_ms / 1000
+            self.sample_rate = sample_rate
+            self.explains_per_minute = explains_per_minute
+            self.explain_timeout_ms = explain_timeout_ms
+            self.recent = collections.deque(maxlen=history)
+            self.slow = 0
+            self.explained = 0
+            self.skipped = 0
+            self._window_start = self._clock()
+            self._window_explains = 0
+
+    def record(self, engine, statement: str, parameters, seconds: float, executemany: bool):
+        """Logs a statement that ran for seconds if it was slow"""
+        if not self.threshold or seconds < self.threshold or IGNORED.search(statement):
+            return
+        entry = {
+            "at": time.time(),
+            "duration_ms": round(seconds * 1000, 2),
+            "statement": statement,
+            "parameters": repr(parameters)[:MAX_PARAMETERS_LENGTH],
+            "route": current_route(),
+            "model_method": calling_model_method(),
+            "plan": None,
+            "explain": None,
+        }
+        with self._lock:
+            self.slow += 1
+            self.recent.append(entry)
+            entry["explain"] = self._explain_decision(executemany)
+        if entry["explain"] != "pending":
+            self._log(entry)
+            return
+        try:
+            self._queue.put_nowait((engine, entry, parameters))
+        except queue.Full:
+            with self._lock:
+                entry["explain"] = "queue full"
+                self.skipped += 1
+            self._log(entry)
+            return
+        self._start_thread()
+
+    def _explain_decision(self, executemany: bool) -> str:
+        """Returns "pending" if the entry should be explained, else why not"""
+        if executemany:
+            return "executemany"
+        if random.random() >= self.sample_rate:
+            self.skipped += 1
+            return "not sampled"
+        now = self._clock()
+        if now - self._window_start >= 60:
+            self._window_start = now
+            self._window_explains = 0
+        if self._window_explains >= self.explains_per_minute:
+            self.skipped += 1
+            return "rate limited"
+        self._window_explains += 1
+        return "pending"
+
+    def _start_thread(self):
+        """Starts the explaining thread of this process if it is not running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="slow-query-explain", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        """Explains the queued statements"""
+        while True:
+            engine, entry, parameters = self._queue.get()
+            try:
+                plan, outcome = self.explain(engine, entry["statement"], parameters), "captured"
+            except Exception as error:  # pylint: disable=broad-except
+                plan, outcome = None, "failed: %s" % error
+            with self._lock:
+                entry["plan"] = plan
+                entry["explain"] = outcome
+                if plan is not None:
+                    self.explained += 1
+            self._log(entry)
+            self._queue.task_done()
+
+    def explain(self, engine, statement: str, parameters) -> str:
+        """Returns the plan of a statement, run in a transaction that is rolled back"""
+        if analyzable(statement):
+            sql = "EXPLAIN (ANALYZE, BUFFERS) " + statement
+        else:
+            sql = "EXPLAIN " + statement
+        # a raw connection, so that the EXPLAIN is not timed itself
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SET LOCAL statement_timeout = %d" % self.explain_timeout_ms)
+            cursor.execute(sql, parameters)
+            return "\n".join(row[0] for row in cursor.fetchall())
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def after_fork(self):
+        """Drops the parent's queue and thread, which the fork did not copy"""
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=16)
+        self._thread = None
+
+    def join(self):
+        """Waits until every queued statement is explained"""
+        self._queue.join()
+
+    @staticmethod
+    def _log(entry):
+        """Logs one slow statement"""
+        logger.warning(
+            "Slow query (%.1f ms) in %s from %s: %s; parameters %s; plan (%s)%s",
+            entry["duration_ms"], entry["model_method"], entry["route"], entry["statement"],
+            entry["parameters"], entry["explain"],
+            "\n" + entry["plan"] if entry["plan"] else "",
+        )
+
+    def stats(self) -> dict:
+        """Returns the counters and the recent slow statements, newest first"""
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "slow": self.slow,
+                "explained": self.explained,
+                "skipped": self.skipped,
+                "recent": [dict(entry) for entry in reversed(self.recent)],
+            }
+
+
+# The log of this process, configured by init_db()
+slow_query_log = SlowQueryLog()
+os.register_at_fork(after_in_child=slow_query_log.after_fork)
+
+
+######################################################################
+# SQLALCHEMY EVENTS
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Notes when a statement starts"""
+    if slow_query_log.threshold and conn.get_execution_options().get("slow_query_log", True):
+        conn.info["slow_query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Logs the statement if it was slow"""
+    start = conn.info.pop("slow_query_start", None)
+    if start is not None:
+        seconds = time.perf_counter() - start
+        slow_query_log.record(conn.engine, statement, parameters, seconds, executemany)
@@ -0,0 +1,178 @@
+"""
+Module: snapshot
+Adjacency index snapshots shared by every worker through mmap
+
+flask recommendations snapshot writes the Recommendations to a binary file
+with the CSRGraph layout:
+
+    header          magic, byte order, version, counts, created_at
+    products        "i" x products      sorted original_product_ids
+    offsets         "q" x products + 1  edge range of each product
+    ids, targets    "i" x edges
+    name_refs,
+    target_refs     "I" x edges         indexes into the string table
+    reasons,
+    activated       "b" x edges
+    scores          "d" x edges
+    ranks           "i" x edges         0 for a null rank
+    string_offsets  "q" x strings + 1
+    string_data     UTF-8, every distinct name once
+
+with each column aligned to 8 bytes. Workers map the file read-only and
+use memoryviews of the mapping as the graph columns, so nothing is copied
+at load time and N workers share one copy in the page cache. A new
+snapshot is written to a temporary file and renamed over the old one;
+SnapshotLoader maps it on the index's next refresh, while lookups already
+running keep the old mapping alive.
+"""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from service.adjacency import CSRGraph
+
+MAGIC = b"RECSNAP\x00"
+VERSION = 1
+
+# magic, little endian flag, version, products, edges, strings, string bytes, created_at
+HEADER = struct.Struct("<8sB3xIqqqqd")
+
+
+def _layout(products: int, edges: int, strings: int) -> list:
+    """Returns (attribute, typecode, length) of every column in file order"""
+    return [
+        ("products", "i", products),
+        ("offsets", "q", products + 1),
+        ("ids", "i", edges),
+        ("targets", "i", edges),
+        ("name_refs", "I", edges),
+        ("target_refs", "I", edges),
+        ("reasons", "b", edges),
+        ("activated", "b", edges),
+        ("scores", "d", edges),
+        ("ranks", "i", edges),
+        ("string_offsets", "q", strings + 1),
+    ]
+
+
+def _aligned(offset: int) -> int:
+    """Rounds a file offset up to the next multiple of 8"""
+    return offset + (-offset % 8)
+
+
+class MappedStrings:
+    """The string table of a snapshot, decoded on access"""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+
+class MappedGraph(CSRGraph):
+    """
+    A CSRGraph whose columns are read-only views of a mapped snapshot file
+    Args:
+        path (str): the snapshot file
+        reasons (Enum): the Reason enumeration the reason codes belong to
+    """
+
+    def __init__(self, path: str, reasons):  # pylint: disable=super-init-not-called
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.file_id = (stat.st_dev, stat.st_ino)
+        view = memoryview(self.mmap)
+        if len(view) < HEADER.size:
+            raise ValueError("%s is not a recommendations snapshot" % path)
+        magic, little, version, products, edges, strings, string_bytes, created_at = (
+            HEADER.unpack_from(view)
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d recommendations snapshot" % (path, VERSION))
+        if little != (sys.byteorder == "little"):
+            raise ValueError("%s was written on a machine of the other byte order" % path)
+        self.created_at = created_at
+        offset = HEADER.size
+        for name, typecode, length in _layout(products, edges, strings):
+            offset = _aligned(offset)
+            end = offset + array(typecode).itemsize * length
+            if end > len(view):
+                raise ValueError("%s is truncated" % path)
+            setattr(self, name, view[offset:end].cast(typecode))
+            offset = end
+        if offset + string_bytes > len(view):
+            raise ValueError("%s is truncated" % path)
+        self.strings = MappedStrings(self.string_offsets, view[offset:offset + string_bytes])
+        self.reason_members = {reason.value: reason for reason in reasons}
+
+    def nbytes(self) -> int:
+        """Returns the size of the mapping, including the string table"""
+        return len(self.mmap)
+
+
+def write_snapshot(graph: CSRGraph, path: str, created_at: float) -> int:
+    """
+    Writes a graph to a snapshot file and swaps it in atomically
+    Args:
+        graph (CSRGraph): the graph to write
+        path (str): the snapshot file, replaced with os.replace()
+        created_at (float): wall clock time at which the rows were read
+    Returns the size of the file in bytes
+    """
+    encoded = [string.encode("utf-8") for string in graph.strings]
+    string_offsets = array("q", [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+    products, edges, strings = len(graph.products), len(graph.ids), len(encoded)
+    fd, temp_path = tempfile.mkstemp(prefix=".snapshot-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(HEADER.pack(
+                MAGIC, sys.byteorder == "little", VERSION, products, edges, strings,
+                string_offsets[-1], created_at,
+            ))
+            for name, typecode, length in _layout(products, edges, strings):
+                column = string_offsets if name == "string_offsets" else getattr(graph, name)
+                if len(column) != length or column.typecode != typecode:
+                    raise ValueError("Column %s does not match the snapshot layout" % name)
+                file.write(b"\0" * (-file.tell() % 8))
+                column.tofile(file)
+            file.writelines(encoded)
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return size
+
+
+class SnapshotLoader:
+    """
+    An AdjacencyIndex loader that maps a snapshot file
+    Returns the graph it mapped before for as long as the path names the
+    same file, and maps the new file once another snapshot has replaced it.
+    """
+
+    def __init__(self, path: str, reasons):
+        self.path = path
+        self.reasons = reasons
+        self.graph = None
+
+    def __call__(self) -> MappedGraph:
+        stat = os.stat(self.path)
+        if self.graph is None or self.graph.file_id != (stat.st_dev, stat.st_ino):
+            self.graph = MappedGraph(self.path, self.reasons)
+        return self.graph
@@ -16,7 +16,7 @@
 Test Factory to make fake objects for testing
 """
 import factory
-from factory.fuzzy import FuzzyChoice
+from factory.fuzzy import FuzzyChoice, FuzzyFloat
 from service.models import Reason, RecommendationModel
 
 
@@ -38,3 +38,4 @@ class RecFactory(factory.Factory):
 
     activated = FuzzyChoice(choices=[True, False])
     reason = FuzzyChoice(choices=[Reason.CROSS_SELL , Reason.UP_SELL , Reason.ACCESSORY, Reason.OTHER])
+    score = FuzzyFloat(0.0, 1.0)
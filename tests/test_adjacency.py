@@ -0,0 +1,116 @@
+"""
+Test cases for the in-memory adjacency index
+"""
+import unittest
+
+from service.adjacency import AdjacencyIndex, CSRGraph, serialize_row
+from service.models import Reason
+
+ROWS = [
+    (1, 10, "iPhone", 100, "AirPods", Reason.ACCESSORY, True, 0.5, 2),
+    (1, 11, "iPhone", 101, "Case", Reason.UP_SELL, False, 0.75, 1),
+    (2, 12, "Radio", 102, "Batteries", Reason.CROSS_SELL, True, 0.0, None),
+    (5, 13, "Printer", 103, "Ink", Reason.CROSS_SELL, True, 0.0, None),
+]
+
+
+######################################################################
+#  C S R   G R A P H   T E S T   C A S E S
+######################################################################
+class TestCSRGraph(unittest.TestCase):
+    """ Test Cases for CSRGraph """
+
+    def test_build_and_lookup(self):
+        """Edges are grouped by product"""
+        graph = CSRGraph.from_rows(ROWS)
+        self.assertEqual(list(graph.products), [1, 2, 5])
+        self.assertEqual(list(graph.offsets), [0, 2, 3, 4])
+        self.assertEqual(graph.edges(1), ROWS[:2])
+        self.assertEqual(graph.edges(5), ROWS[3:])
+        self.assertEqual(graph.edges(3), [])
+        self.assertEqual(graph.edges(9), [])
+        self.assertEqual(list(graph.rows()), ROWS)
+
+    def test_strings_are_interned(self):
+        """Repeated names are stored once"""
+        graph = CSRGraph.from_rows(ROWS)
+        self.assertEqual(graph.strings.count("iPhone"), 1)
+        self.assertEqual(len(graph.strings), 7)
+
+    def test_memory_per_edge(self):
+        """Arrays use 30 bytes per edge and 12 bytes per product"""
+        graph = CSRGraph.from_rows(ROWS)
+        self.assertEqual(graph.nbytes(), 30 * 4 + 12 * 3 + 8)
+
+    def test_serialize_row(self):
+        """Rows serialize like RecommendationModel.serialize()"""
+        self.assertEqual(
+            serialize_row(ROWS[0]),
+            {
+                "id": 10, "name": "iPhone", "original_product_id": 1,
+                "recommendation_product_name": "AirPods", "recommendation_product_id": 100,
+                "reason": "ACCESSORY", "activated": True, "score": 0.5, "rank": 2,
+            },
+        )
+
+
+######################################################################
+#  A D J A C E N C Y   I N D E X   T E S T   C A S E S
+######################################################################
+class TestAdjacencyIndex(unittest.TestCase):
+    """ Test Cases for AdjacencyIndex """
+
+    def setUp(self):
+        """This runs before each test"""
+        self.rows = list(ROWS)
+        self.index = AdjacencyIndex(refresh_seconds=0)
+        self.index.start(lambda: iter(self.rows), background=False)
+
+    def test_lookup(self):
+        """Lookups filter by activation and reason"""
+        self.assertTrue(self.index.ready)
+        self.assertEqual([rec["id"] for rec in self.index.lookup([1, 2])], [10, 11, 12])
+        self.assertEqual([rec["id"] for rec in self.index.lookup([1], activated=True)], [10])
+        self.assertEqual(
+            [rec["id"] for rec in self.index.lookup([1, 5], reasons=[Reason.UP_SELL, Reason.CROSS_SELL])],
+            [11, 13],
+        )
+
+    def test_lookup_top(self):
+        """Top lookups return the best scored rows of each product"""
+        self.assertEqual([rec["id"] for rec in self.index.lookup([5, 1], top=1)], [11, 13])
+        self.assertEqual([rec["id"] for rec in self.index.lookup([1], top=5)], [11, 10])
+        self.assertEqual([rec["id"] for rec in self.index.lookup([1], activated=True, top=1)], [10])
+
+    def test_apply_and_remove(self):
+        """Local writes are visible before a rebuild"""
+        self.index.apply((2, 20, "Radio", 104, "Antenna", Reason.ACCESSORY, True, 0.0, None))
+        self.assertEqual([rec["id"] for rec in self.index.lookup([2])], [12, 20])
+        self.index.apply((7, 12, "Radio", 102, "Batteries", Reason.CROSS_SELL, True, 0.0, None), previous_product_id=2)
+        self.assertEqual([rec["id"] for rec in self.index.lookup([2])], [20])
+        self.assertEqual([rec["id"] for rec in self.index.lookup([7])], [12])
+        self.index.remove(1, 10)
+        self.assertEqual([rec["id"] for rec in self.index.lookup([1])], [11])
+        self.assertEqual(self.index.stats()["overlay_products"], 3)
+
+    def test_rebuild_keeps_newer_overlay(self):
+        """A rebuild drops overlay rows it has loaded"""
+        self.index.remove(1, 10)
+        del self.rows[0]
+        self.index.refresh(background=False)
+        self.assertEqual(self.index.stats()["overlay_products"], 0)
+        self.assertEqual([rec["id"] for rec in self.index.lookup([1])], [11])
+
+    def test_invalidate(self):
+        """A bulk write makes the index rebuild before serving again"""
+        self.rows.append((9, 30, "Lamp", 105, "Bulb", Reason.ACCESSORY, True, 0.0, None))
+        self.index.invalidate(background=False)
+        self.assertTrue(self.index.ready)
+        self.assertEqual([rec["id"] for rec in self.index.lookup([9])], [30])
+
+    def test_stop(self):
+        """A stopped index ignores writes and is not ready"""
+        self.index.stop()
+        self.assertFalse(self.index.ready)
+        self.index.apply(ROWS[0])
+        self.assertEqual(self.index.stats()["overlay_products"], 0)
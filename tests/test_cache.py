@@ -0,0 +1,83 @@
+"""
+Test cases for the in-process Recommendation cache
+"""
+import unittest
+
+from service.cache import LRUCache
+
+
+class FakeClock:
+    """A clock the tests can move forward by hand"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for LRUCache """
+
+    def setUp(self):
+        """This runs before each test"""
+        self.clock = FakeClock()
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        """Values can be stored and read back"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, {"id": 1})
+        self.assertEqual(self.cache.get(1), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """The least recently used entry is evicted when full"""
+        self.cache.set(1, "a")
+        self.cache.set(2, "b")
+        self.cache.get(1)
+        self.cache.set(3, "c")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "a")
+        self.assertEqual(self.cache.get(3), "c")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        """Entries older than the TTL are misses"""
+        self.cache.set(1, "a")
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get(1), "a")
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_invalidate(self):
+        """Invalidated keys are removed"""
+        self.cache.set(1, "a")
+        self.cache.set(2, "b")
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "b")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_stale_set_is_dropped(self):
+        """A value loaded before an invalidation is not stored"""
+        version = self.cache.version()
+        self.cache.invalidate(1)
+        self.cache.set(1, "stale", version)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, "fresh", self.cache.version())
+        self.assertEqual(self.cache.get(1), "fresh")
+
+    def test_disabled(self):
+        """A cache with no room stores nothing"""
+        self.cache.configure(0, 10)
+        self.cache.set(1, "a")
+        self.assertIsNone(self.cache.get(1))
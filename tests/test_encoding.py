@@ -0,0 +1,71 @@
+"""
+Test cases for the fast JSON encoding of Recommendation rows
+"""
+import unittest
+
+from flask import json, jsonify
+from service import app
+from service.encoding import (
+    encode_array, encode_groups, encode_row, fast_encoding_allowed, row_to_dict
+)
+from service.models import Reason
+
+ROWS = [
+    (True, 1, "iPhone", 5, 1, Reason.ACCESSORY, 10, "AirPods", 0.1),
+    (False, 2, 'Café "Deluxe" ☕', 6, None, Reason.UP_SELL, 11, "Back\\slash\n", 1e-07),
+    (True, 3, "Lamp", 7, None, Reason.OTHER, 12, "Bulb", 0.0),
+]
+
+
+######################################################################
+#  E N C O D I N G   T E S T   C A S E S
+######################################################################
+class TestEncoding(unittest.TestCase):
+    """ Test Cases for the row encoder """
+
+    def test_row_to_dict(self):
+        """Rows convert to serialize() dictionaries"""
+        data = row_to_dict(ROWS[0])
+        self.assertEqual(data["reason"], "ACCESSORY")
+        self.assertEqual(data["recommendation_product_name"], "AirPods")
+        self.assertEqual(data["score"], 0.1)
+        self.assertEqual(data["rank"], 1)
+        self.assertEqual(len(data), 9)
+
+    def test_encode_row_matches_flask_json(self):
+        """A row encodes exactly like flask.json.dumps of its dictionary"""
+        with app.app_context():
+            for row in ROWS:
+                expected = json.dumps(row_to_dict(row), separators=(",", ":"))
+                self.assertEqual(encode_row(row), expected)
+
+    def test_encode_array_matches_jsonify(self):
+        """An array encodes exactly like jsonify of its dictionaries"""
+        with app.app_context():
+            for rows in ([], ROWS):
+                expected = jsonify([row_to_dict(row) for row in rows]).get_data(as_text=True)
+                self.assertEqual(encode_array(rows), expected)
+
+    def test_encode_groups_matches_jsonify(self):
+        """Lookup groups encode exactly like jsonify of their dictionaries"""
+        groups = [(5, ROWS), (7, [])]
+        with app.app_context():
+            expected = jsonify([
+                {"original_product_id": product_id,
+                 "recommendations": [row_to_dict(row) for row in rows]}
+                for product_id, rows in groups
+            ]).get_data(as_text=True)
+            self.assertEqual(encode_groups(groups), expected)
+            self.assertEqual(encode_groups([]), jsonify([]).get_data(as_text=True))
+
+    def test_fast_encoding_allowed(self):
+        """The fast path is only used with the default JSON settings"""
+        config = {
+            "JSON_SORT_KEYS": True,
+            "JSON_AS_ASCII": True,
+            "JSONIFY_PRETTYPRINT_REGULAR": False,
+            "DEBUG": False,
+        }
+        self.assertTrue(fast_encoding_allowed(config))
+        config["JSON_AS_ASCII"] = False
+        self.assertFalse(fast_encoding_allowed(config))
@@ -0,0 +1,127 @@
+"""
+Test cases for the queued and sampled logging
+"""
+import io
+import logging
+import os
+import unittest
+
+from service import app
+from service.logs import (
+    DeferredQueueHandler, SamplingFilter, configure_sampling, parse_sampling, start_queue
+)
+from service.models import logger as models_logger, query_logger
+
+
+class FakeClock:
+    """A monotonic clock moved by hand"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(level=logging.INFO):
+    """Returns a record of the models' query logger"""
+    return logging.LogRecord(
+        "service.models.queries", level, __file__, 1, "Processing row query ...", (), None
+    )
+
+
+######################################################################
+#  L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestLogs(unittest.TestCase):
+    """ Test Cases for the logging pipeline """
+
+    def test_sampling_fraction(self):
+        """A fraction keeps every Nth record, starting with the first"""
+        sampler = SamplingFilter("0.25")
+        kept = [sampler.filter(record()) for _ in range(10)]
+        self.assertEqual(kept, [True, False, False, False] * 2 + [True, False])
+        self.assertEqual(sampler.dropped, 7)
+        self.assertFalse(any(SamplingFilter("0").filter(record()) for _ in range(3)))
+        self.assertTrue(all(SamplingFilter("1").filter(record()) for _ in range(3)))
+        # warnings are never dropped
+        self.assertTrue(all(SamplingFilter("0").filter(record(logging.WARNING)) for _ in range(3)))
+
+    def test_sampling_rate(self):
+        """A rate keeps at most N records a second"""
+        clock = FakeClock()
+        sampler = SamplingFilter("2/s", clock=clock)
+        self.assertEqual([sampler.filter(record()) for _ in range(3)], [True, True, False])
+        clock.now = 1.0
+        self.assertTrue(sampler.filter(record()))
+        self.assertEqual(sampler.dropped, 1)
+
+    def test_parse_sampling(self):
+        """LOG_SAMPLING names loggers and their rates"""
+        self.assertEqual(parse_sampling(""), {})
+        self.assertEqual(
+            parse_sampling("service.models.queries=0.01, service=200/s"),
+            {"service.models.queries": "0.01", "service": "200/s"},
+        )
+        self.assertRaises(ValueError, parse_sampling, "service")
+        self.assertRaises(ValueError, SamplingFilter, "often")
+
+    def test_configure_sampling(self):
+        """Sampling filters replace the earlier ones of their logger"""
+        logger = logging.getLogger("tests.sampled")
+        configure_sampling("tests.sampled=0.5")
+        filters = configure_sampling("tests.sampled=0.1")
+        self.assertEqual(logger.filters, [filters["tests.sampled"]])
+        logger.removeFilter(filters["tests.sampled"])
+
+    def test_queue(self):
+        """Records are formatted and written by the listener thread"""
+        logger = logging.getLogger("tests.queued")
+        logger.propagate = False
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+        logger.handlers = [handler]
+        listener = start_queue(logger)
+        self.assertIsInstance(logger.handlers[0], DeferredQueueHandler)
+        logger.warning("Deleted %d Recommendations", 3)
+        pid = os.fork()
+        if pid == 0:
+            # the child gets a listener thread of its own
+            alive = listener._thread.is_alive()  # pylint: disable=protected-access
+            listener.stop()
+            os._exit(0 if alive else 1)  # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        listener.stop()
+        self.assertIn("[WARNING] Deleted 3 Recommendations\n", stream.getvalue())
+        logger.handlers = []
+
+    def test_model_records_are_queued(self):
+        """The models log through app.logger's queue, sampled by LOG_SAMPLING"""
+        saved = app.logger.handlers, app.logger.level, app.logger.propagate
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("[%(name)s] %(message)s"))
+        app.logger.handlers = [handler]
+        app.logger.setLevel(logging.INFO)
+        app.logger.propagate = False
+        listener = start_queue(app.logger)
+        filters = configure_sampling("service.models.queries=0.5")
+        try:
+            for number in range(4):
+                query_logger.info("Processing query %d", number)
+            models_logger.warning("Deleting Recommendations")
+            # the records reach the stream only through the queue handler
+            self.assertEqual(query_logger.handlers + models_logger.handlers, [])
+            self.assertTrue(query_logger.propagate and models_logger.propagate)
+            self.assertEqual([type(h) for h in app.logger.handlers], [DeferredQueueHandler])
+        finally:
+            listener.stop()
+            query_logger.removeFilter(filters["service.models.queries"])
+            app.logger.handlers, app.logger.level, app.logger.propagate = saved
+        self.assertEqual(stream.getvalue().splitlines(), [
+            "[service.models.queries] Processing query 0",
+            "[service.models.queries] Processing query 2",
+            "[service.models] Deleting Recommendations",
+        ])
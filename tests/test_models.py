@@ -5,8 +5,13 @@ import logging
 import unittest
 import os
 
+from sqlalchemy import inspect
+from werkzeug.datastructures import MultiDict
 from werkzeug.exceptions import NotFound
-from service.models import Reason, RecommendationModel, DataValidationError, db
+from service.models import (
+    Reason, RecommendationModel, DataValidationError, db,
+    SchemaVersion, MIGRATIONS, migrate, FanIn, Generation, check_schema, schema_version
+)
 from service import app
 
 from tests.factories import RecFactory
@@ -58,6 +63,40 @@ class TestRecommendationModel(unittest.TestCase):
     #  T E S T   C A S E S
     ######################################################################
 
+    def test_create_many_recommendations(self):
+        """Create Recommendations in bulk"""
+        recs = RecFactory.build_batch(7)
+        rows = [RecommendationModel.validate(rec.serialize()) for rec in recs]
+        ids, errors = RecommendationModel.create_many(rows, batch_size=3)
+        self.assertEqual(errors, {})
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(RecommendationModel.all()), 7)
+        rec = RecommendationModel.find(ids[4])
+        self.assertEqual(rec.name, recs[4].name)
+        self.assertEqual(rec.reason, recs[4].reason)
+
+    def test_create_many_isolates_bad_rows(self):
+        """Rows rejected by the database do not abort the batch"""
+        recs = RecFactory.build_batch(4)
+        recs[1].name = "x" * 100
+        rows = [RecommendationModel.validate(rec.serialize()) for rec in recs]
+        ids, errors = RecommendationModel.create_many(rows, batch_size=10)
+        self.assertIsNone(ids[1])
+        self.assertEqual(list(errors), [1])
+        self.assertEqual(len(RecommendationModel.all()), 3)
+
+    def test_paginate_recommendations(self):
+        """Page through Recommendations by id"""
+        for rec in RecFactory.create_batch(5):
+            rec.create()
+        ids = sorted(rec.id for rec in RecommendationModel.all())
+        page = RecommendationModel.paginate(RecommendationModel.query, 2)
+        self.assertEqual([rec.id for rec in page], ids[:2])
+        page = RecommendationModel.paginate(RecommendationModel.query, 2, ids[1])
+        self.assertEqual([rec.id for rec in page], ids[2:4])
+        page = RecommendationModel.paginate(RecommendationModel.query, 2, ids[4])
+        self.assertEqual(page, [])
+
     def test_update_a_recommendation(self):
         """Update a Recommendation"""
         rec = RecFactory()
@@ -88,6 +127,180 @@ class TestRecommendationModel(unittest.TestCase):
         rec.delete()
         self.assertEqual(len(RecommendationModel.all()), 0)
 
+    def test_update_increments_version(self):
+        """Every update gives a Recommendation a new version and ETag"""
+        rec = RecFactory()
+        rec.create()
+        self.assertEqual(rec.version, 1)
+        etag = rec.etag()
+        rec.activated = not rec.activated
+        rec.update()
+        self.assertEqual(rec.version, 2)
+        self.assertNotEqual(rec.etag(), etag)
+
+    def test_writes_bump_generations(self):
+        """Writes bump the global counter and the counters of their products"""
+        rec = RecFactory(original_product_id=101)
+        before = Generation.current() + Generation.current([101, 102])[1:]
+        rec.create()
+        self.assertEqual(Generation.current()[0], before[0] + 1)
+        self.assertEqual(Generation.current([101, 102])[1:], (before[1] + 1, before[2]))
+        # moving a Recommendation changes both the old and the new product
+        rec.original_product_id = 102
+        rec.update()
+        self.assertEqual(Generation.current([101, 102])[1:], (before[1] + 2, before[2] + 1))
+        rec.delete()
+        self.assertEqual(Generation.current([101, 102])[1:], (before[1] + 2, before[2] + 2))
+        self.assertEqual(Generation.current()[0], before[0] + 3)
+        RecommendationModel.create_many([RecommendationModel.validate(rec.serialize())])
+        self.assertEqual(Generation.current([102])[1:], (before[2] + 3,))
+
+    def test_create_many_bumps_inserted_products(self):
+        """Only the products of the rows inserted are bumped"""
+        good = RecommendationModel.validate(RecFactory(original_product_id=121).serialize())
+        bad = RecommendationModel.validate(RecFactory(original_product_id=122).serialize())
+        bad["name"] = "x" * 100
+        before = Generation.current([121, 122])
+        ids, errors = RecommendationModel.create_many([good, bad])
+        self.assertEqual(list(errors), [1])
+        self.assertIsNone(ids[1])
+        after = Generation.current([121, 122])
+        self.assertEqual(after, (before[0], before[1] + 1, before[2]))
+
+    def test_delete_many(self):
+        """Delete the Recommendations that match filters in one statement"""
+        for product_id in (111, 111, 112, 113):
+            RecFactory(original_product_id=product_id).create()
+        before = Generation.current([111, 112, 113])
+        self.assertEqual(RecommendationModel.delete_many(original_product_id=[111, 112]), 3)
+        self.assertEqual(RecommendationModel.delete_many(original_product_id=111), 0)
+        after = Generation.current([111, 112, 113])
+        self.assertEqual(after, (before[0], before[1] + 1, before[2] + 1, before[3]))
+        self.assertEqual([rec.original_product_id for rec in RecommendationModel.all()], [113])
+
+    def test_delete_many_unfiltered_truncates(self):
+        """Delete every Recommendation when no filter is given"""
+        for rec in RecFactory.build_batch(3):
+            rec.create()
+        last_id, product_id = rec.id, rec.original_product_id
+        before = Generation.current([product_id])
+        self.assertEqual(RecommendationModel.delete_many(), 3)
+        self.assertEqual(RecommendationModel.all(), [])
+        # the product counters are not bumped, the truncate counter is
+        self.assertEqual(Generation.current([product_id]), (before[0] + 1, before[1]))
+        # ids are not reused
+        rec = RecFactory()
+        rec.create()
+        self.assertGreater(rec.id, last_id)
+
+    def test_fan_in(self):
+        """The fan-in counters follow every kind of write"""
+        def counts():
+            actual = dict(db.session.execute(
+                "SELECT recommendation_product_id, count(*) FROM recommendation_model "
+                "GROUP BY recommendation_product_id"
+            ).fetchall())
+            for product_id in set(actual) | {901, 902, 903}:
+                self.assertEqual(FanIn.current(product_id), actual.get(product_id, 0), product_id)
+            return actual
+
+        recs = [RecFactory(original_product_id=i, recommendation_product_id=901) for i in range(3)]
+        for rec in recs:
+            rec.create()
+        self.assertEqual(counts(), {901: 3})
+        recs[0].recommendation_product_id = 902
+        recs[0].update()
+        recs[1].name = "renamed"
+        recs[1].update()
+        self.assertEqual(counts(), {901: 2, 902: 1})
+        RecommendationModel.create_many([
+            RecommendationModel.validate(RecFactory(recommendation_product_id=903).serialize())
+            for _ in range(4)
+        ])
+        RecommendationModel.import_rows([
+            (1, RecommendationModel.validate(RecFactory(recommendation_product_id=902).serialize())),
+            (2, RecommendationModel.validate(recs[2].serialize())),
+        ])
+        self.assertEqual(counts(), {901: 2, 902: 2, 903: 4})
+        recs[1].delete()
+        RecommendationModel.delete_many(recommendation_product_id=903)
+        self.assertEqual(counts(), {901: 1, 902: 2})
+        db.session.query(RecommendationModel).delete()
+        db.session.commit()
+        self.assertEqual(counts(), {})
+        RecFactory(recommendation_product_id=901).create()
+        RecommendationModel.delete_many()
+        self.assertEqual(counts(), {})
+
+    def test_fan_in_recount(self):
+        """Installing the triggers recounts every product"""
+        for product_id in (901, 901, 902):
+            RecFactory(recommendation_product_id=product_id).create()
+        db.session.execute("UPDATE recommendation_fan_in SET count = 0")
+        db.session.commit()
+        with db.engine.begin() as conn:
+            FanIn.install(conn)
+        self.assertEqual((FanIn.current(901), FanIn.current(902)), (2, 1))
+
+    def test_set_activated(self):
+        """Activate the matching Recommendations with one conditional UPDATE"""
+        recs = []
+        for activated in (True, False, False):
+            rec = RecFactory(original_product_id=121, activated=activated)
+            rec.create()
+            recs.append(rec)
+        RecFactory(original_product_id=122, activated=False).create()
+        changed, unchanged = RecommendationModel.set_activated(True, original_product_id=121)
+        self.assertEqual(changed, [recs[1].id, recs[2].id])
+        self.assertEqual(unchanged, [recs[0].id])
+        self.assertEqual(RecommendationModel.find(recs[1].id).version, 2)
+        self.assertEqual(RecommendationModel.find(recs[0].id).version, 1)
+        self.assertEqual(len(RecommendationModel.find_by_activated(False).all()), 1)
+        self.assertRaises(DataValidationError, RecommendationModel.set_activated, True)
+
+    def test_top(self):
+        """Return the best scored Recommendations of each product"""
+        scores = ((141, 0.5), (141, 0.7), (141, 0.5), (142, 0.1))
+        recs = []
+        for product_id, score in scores:
+            rec = RecFactory(original_product_id=product_id, score=score, rank=len(recs) + 1)
+            rec.create()
+            recs.append(rec)
+        expected = [recs[1].id, recs[0].id, recs[3].id]
+        rows = RecommendationModel.top(2, original_product_id=[142, 141]).fetchall()
+        self.assertEqual([row.id for row in rows], expected)
+        self.assertEqual((rows[0].score, rows[0].rank), (0.7, 2))
+        rows = RecommendationModel.top(2, batch_size=10).fetchall()
+        self.assertEqual([row.id for row in rows], expected)
+
+    def test_validate_score_and_rank(self):
+        """Scores must be finite numbers and ranks positive integers"""
+        data = RecFactory().serialize()
+        for field, value in (("score", "high"), ("score", float("nan")), ("score", True),
+                             ("rank", 0), ("rank", 1.5)):
+            bad = dict(data, **{field: value})
+            self.assertRaises(DataValidationError, RecommendationModel().deserialize, bad)
+        del data["score"], data["rank"]
+        rec = RecommendationModel().deserialize(data)
+        self.assertEqual((rec.score, rec.rank), (0.0, None))
+
+    def test_lookup(self):
+        """Look up the Recommendations of many products in one query"""
+        recs = []
+        for product_id, activated, score in ((131, True, 0.2), (131, False, 0.9), (131, True, 0.2),
+                                             (132, True, 0.5), (133, True, 0.5)):
+            rec = RecFactory(original_product_id=product_id, activated=activated, score=score)
+            rec.create()
+            recs.append(rec)
+        groups = RecommendationModel.lookup([132, 131, 134], ids=[recs[4].id])
+        self.assertEqual([product_id for product_id, _ in groups], [132, 131, 134, 133])
+        self.assertEqual([row.id for row in groups[1][1]], [rec.id for rec in (recs[1], recs[0], recs[2])])
+        self.assertEqual(groups[2][1], [])
+        groups = RecommendationModel.lookup([131, 132], limit=1, activated=True)
+        self.assertEqual([[row.id for row in rows] for _, rows in groups],
+                         [[recs[0].id], [recs[3].id]])
+        self.assertEqual(RecommendationModel.lookup(), [])
+
     def test_create_a_recommendation(self):
         """ Create a recommendation and assert that it exists """
         rec = RecommendationModel(
@@ -190,6 +403,15 @@ class TestRecommendationModel(unittest.TestCase):
         rec = RecommendationModel()
         self.assertRaises(DataValidationError, rec.deserialize, data)
 
+    def test_validate_a_rec(self):
+        """Test validation of a Recommendation dictionary"""
+        data = RecFactory().serialize()
+        row = RecommendationModel.validate(data)
+        self.assertEqual(row["name"], data["name"])
+        self.assertEqual(row["reason"].name, data["reason"])
+        self.assertNotIn("id", row)
+        self.assertRaises(DataValidationError, RecommendationModel.validate, {"name": "foo"})
+
     def test_deserialize_bad_reason(self):
         """Test deserialization of bad available attribute"""
         test_rec = RecFactory()
@@ -338,6 +560,82 @@ class TestRecommendationModel(unittest.TestCase):
         self.assertEqual(recs[0].reason, Reason.ACCESSORY)  
 
 
+    def test_find_by_filters(self):
+        """Find Recommendations matching several filters"""
+        RecommendationModel(name="iPhone", original_product_id=1, recommendation_product_name="AirPods", recommendation_product_id=10, reason=Reason.ACCESSORY, activated=True).create()
+        RecommendationModel(name="iPhone", original_product_id=1, recommendation_product_name="Case", recommendation_product_id=11, reason=Reason.UP_SELL, activated=False).create()
+        RecommendationModel(name="Radio", original_product_id=2, recommendation_product_name="Batteries", recommendation_product_id=6, reason=Reason.CROSS_SELL, activated=True).create()
+        recs = RecommendationModel.find_by_filters(original_product_id=1, activated=True).all()
+        self.assertEqual([rec.recommendation_product_name for rec in recs], ["AirPods"])
+        recs = RecommendationModel.find_by_filters(reason=[Reason.ACCESSORY, Reason.CROSS_SELL]).all()
+        self.assertEqual(sorted(rec.name for rec in recs), ["Radio", "iPhone"])
+        self.assertEqual(RecommendationModel.find_by_filters().count(), 3)
+        self.assertRaises(DataValidationError, RecommendationModel.find_by_filters, color="red")
+
+    def test_filters_from_args(self):
+        """Parse query string arguments into filters"""
+        args = MultiDict([("reason", "up_sell,ACCESSORY"), ("activated", "false"), ("name", "a,b"), ("limit", "5")])
+        filters = RecommendationModel.filters_from_args(args)
+        self.assertEqual(filters, {"reason": [Reason.UP_SELL, Reason.ACCESSORY], "activated": [False], "name": ["a,b"]})
+        self.assertRaises(DataValidationError, RecommendationModel.filters_from_args, MultiDict([("id", "x")]))
+
+    def test_find_by_filters_uses_index(self):
+        """Combined filters are answered from the composite index"""
+        rows = [
+            {
+                "name": "product-%d" % (i // 10), "original_product_id": i // 10,
+                "recommendation_product_name": "target-%d" % i, "recommendation_product_id": i,
+                "reason": list(Reason)[i % 4], "activated": i % 3 != 0,
+            }
+            for i in range(5000)
+        ]
+        RecommendationModel.create_many(rows)
+        db.session.execute("ANALYZE recommendation_model")
+        query = RecommendationModel.find_by_filters(
+            original_product_id=[1, 2], activated=True, reason=[Reason.UP_SELL, Reason.ACCESSORY]
+        )
+        sql = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+        plan = "\n".join(row[0] for row in db.session.execute("EXPLAIN " + str(sql)))
+        self.assertIn("ix_recommendation_product_activated_reason", plan)
+        self.assertNotIn("Seq Scan", plan)
+
+    def test_search(self):
+        """Names are searched by prefix, ignoring case, from the prefix indexes"""
+        for name, target in (("Radio", "Battery"), ("radiator", "Radio antenna"),
+                             ("Printer", "radial fan"), ("RAD_X", "Ink"), ("Rad%", "Ink")):
+            RecFactory(name=name, recommendation_product_name=target, activated=True).create()
+        names = lambda rows: [(row.name, row.recommendation_product_name) for row in rows]
+        # "radiator" matches on both fields, and is returned once
+        self.assertEqual(names(RecommendationModel.search("RADI", 10)), [
+            ("Printer", "radial fan"), ("radiator", "Radio antenna"), ("Radio", "Battery"),
+        ])
+        self.assertEqual(names(RecommendationModel.search("radi", 2)), [
+            ("Printer", "radial fan"), ("radiator", "Radio antenna"),
+        ])
+        self.assertEqual(names(RecommendationModel.search("radi", 10, ("name",))), [
+            ("radiator", "Radio antenna"), ("Radio", "Battery"),
+        ])
+        # LIKE wildcards in the prefix match themselves
+        self.assertEqual(names(RecommendationModel.search("rad_", 10)), [("RAD_X", "Ink")])
+        self.assertEqual(names(RecommendationModel.search("rad%", 10)), [("Rad%", "Ink")])
+        self.assertEqual(RecommendationModel.search("radio antenna", 10, activated=[False]), [])
+
+        RecommendationModel.create_many([
+            {
+                "name": "product-%d" % i, "original_product_id": i,
+                "recommendation_product_name": "target-%d" % i, "recommendation_product_id": i,
+                "reason": Reason.UP_SELL, "activated": True,
+            }
+            for i in range(5000)
+        ])
+        db.session.execute("ANALYZE recommendation_model")
+        query = RecommendationModel.search_query("product-1", 10)
+        sql = query.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+        plan = "\n".join(row[0] for row in db.session.execute("EXPLAIN " + str(sql).replace("%%", "%")))
+        self.assertIn("ix_recommendation_name_prefix", plan)
+        self.assertIn("ix_recommendation_target_name_prefix", plan)
+        self.assertNotIn("Seq Scan", plan)
+
     # def test_repr(self):
     #     """Test repr"""
     #     RecommendationModel(name="iPhone", original_product_id=1, recommendation_product_name="AirPods", recommendation_product_id=10, reason = Reason.ACCESSORY).create()
@@ -361,3 +659,51 @@ class TestRecommendationModel(unittest.TestCase):
     def test_find_or_404_not_found(self):
         """Find or return 404 NOT found"""
         self.assertRaises(NotFound, RecommendationModel.find_or_404, 0)
+
+    ######################################################################
+    #  M I G R A T I O N   T E S T   C A S E S
+    ######################################################################
+
+    def test_schema_is_migrated(self):
+        """Schema is at the latest version with every filter index"""
+        self.assertEqual(SchemaVersion.current(), MIGRATIONS[-1][0])
+        # pg_indexes, since inspect() skips the expression indexes
+        indexes = {row[0] for row in db.session.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'recommendation_model'"
+        )}
+        for index in RecommendationModel.__table__.indexes:
+            self.assertIn(index.name, indexes)
+
+    def test_migrate_is_idempotent(self):
+        """Running the migrations again is a no-op"""
+        self.assertEqual(migrate(), MIGRATIONS[-1][0])
+        self.assertEqual(SchemaVersion.query.count(), len(MIGRATIONS))
+
+    def test_check_schema(self):
+        """Boot checks read the version and migrate only when it is behind"""
+        latest = MIGRATIONS[-1][0]
+        self.assertEqual(schema_version(), latest)
+        self.assertEqual(check_schema("check"), latest)
+        self.assertIsNone(check_schema("skip"))
+        self.assertRaises(ValueError, check_schema, "sometimes")
+        SchemaVersion.query.filter(SchemaVersion.version == latest).delete()
+        db.session.commit()
+        self.assertIsNone(check_schema("skip"))
+        self.assertEqual(schema_version(), latest - 1)
+        self.assertEqual(check_schema("check"), latest)
+        self.assertEqual(schema_version(), latest)
+
+    def test_migrate_command(self):
+        """flask recommendations migrate reports the schema version"""
+        result = app.test_cli_runner().invoke(args=["recommendations", "migrate"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("version %d" % MIGRATIONS[-1][0], result.output)
+
+    def test_migrate_rebuilds_dropped_index(self):
+        """A missing index is rebuilt when its migration is re-applied"""
+        db.session.execute("DROP INDEX IF EXISTS ix_recommendation_name")
+        SchemaVersion.query.filter(SchemaVersion.version >= 2).delete()
+        db.session.commit()
+        self.assertEqual(migrate(), MIGRATIONS[-1][0])
+        indexes = {idx["name"] for idx in inspect(db.engine).get_indexes("recommendation_model")}
+        self.assertIn("ix_recommendation_name", indexes)
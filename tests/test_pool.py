@@ -0,0 +1,111 @@
+"""
+Test cases for the connection pool telemetry
+"""
+import os
+import unittest
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+from service.pool import (
+    InstrumentedQueuePool, WaitHistogram, engine_options, pool_stats, pool_waits
+)
+
+CONFIG = {
+    "DB_POOL_SIZE": 4,
+    "DB_MAX_OVERFLOW": 2,
+    "DB_POOL_TIMEOUT": 5.0,
+    "DB_POOL_RECYCLE": 1800,
+    "DB_POOL_PRE_PING": True,
+    "DB_STATEMENT_TIMEOUT": 0,
+}
+
+
+class FakeConnection:
+    """A DBAPI connection that does nothing"""
+
+    closed = 0
+
+    def rollback(self):
+        """Called when the connection is returned to the pool"""
+
+    def close(self):
+        """Called when the pool discards the connection"""
+        FakeConnection.closed += 1
+
+
+######################################################################
+#  P O O L   T E L E M E T R Y   T E S T   C A S E S
+######################################################################
+class TestPoolTelemetry(unittest.TestCase):
+    """ Test Cases for the pool statistics """
+
+    def test_histogram_buckets(self):
+        """Waits are counted in the first bucket they fit"""
+        histogram = WaitHistogram(buckets=(0.01, 0.1))
+        histogram.record(0.001)
+        histogram.record(0.01)
+        histogram.record(0.05)
+        histogram.record(3.0, timed_out=True)
+        stats = histogram.stats()
+        self.assertEqual(stats["wait_ms_histogram"], {"10": 2, "100": 1, "+Inf": 1})
+        self.assertEqual(stats["checkouts"], 4)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["wait_seconds_max"], 3.0)
+        histogram.reset()
+        self.assertEqual(histogram.stats()["checkouts"], 0)
+
+    def test_engine_options(self):
+        """DB_* settings become SQLAlchemy engine options"""
+        options = engine_options(CONFIG)
+        self.assertIs(options["poolclass"], InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], 4)
+        self.assertEqual(options["max_overflow"], 2)
+        self.assertEqual(options["pool_recycle"], 1800)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertNotIn("connect_args", options)
+        options = engine_options(dict(CONFIG, DB_STATEMENT_TIMEOUT=2500))
+        self.assertEqual(options["connect_args"], {"options": "-c statement_timeout=2500"})
+
+    def test_checkouts_are_recorded(self):
+        """Every checkout of an InstrumentedQueuePool is timed"""
+        pool = InstrumentedQueuePool(FakeConnection, pool_size=1, max_overflow=1, timeout=0.01)
+        before = pool_waits.stats()["checkouts"]
+        first = pool.connect()
+        second = pool.connect()
+        stats = pool_stats(pool)
+        self.assertEqual(stats["checked_out"], 2)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["checkouts"], before + 2)
+        timeouts = pool_waits.stats()["timeouts"]
+        self.assertRaises(PoolTimeoutError, pool.connect)
+        self.assertEqual(pool_waits.stats()["timeouts"], timeouts + 1)
+        first.close()
+        second.close()
+        self.assertEqual(pool_stats(pool)["checked_out"], 0)
+
+    def test_stats_of_other_pools(self):
+        """Pools without a queue only report the checkout waits"""
+        stats = pool_stats(NullPool(FakeConnection))
+        self.assertEqual(stats["pool"], "NullPool")
+        self.assertNotIn("size", stats)
+
+    def test_forked_process_opens_its_own(self):
+        """A forked child does not reuse or close its parent's connections"""
+        pool = InstrumentedQueuePool(FakeConnection, pool_size=1, max_overflow=0)
+        proxy = pool.connect()
+        inherited = proxy.connection
+        proxy.close()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                closed = FakeConnection.closed
+                child = pool.connect()
+                ok = child.connection is not inherited and FakeConnection.closed == closed
+                child.close()
+            finally:
+                os._exit(0 if ok else 1)  # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        proxy = pool.connect()
+        self.assertIs(proxy.connection, inherited)
+        proxy.close()
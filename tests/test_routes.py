@@ -11,6 +11,7 @@ Test cases can be run with the following:
 """
 
 import os
+import json
 import logging
 import unittest
 
@@ -18,8 +19,10 @@ import unittest
 from urllib.parse import quote_plus
 
 from sqlalchemy import false
+from flask import jsonify
 from service import app, status
 from service.models import DataValidationError, Reason, RecommendationModel, db
+from service.adjacency import adjacency_index
 from .factories import RecFactory
 
 # Disable all but critical errors during normal test run
@@ -116,6 +119,149 @@ class TestYourRecommendationServer(unittest.TestCase):
         # There should be three recommendations
         self.assertEqual(len(rec_list), 3)
 
+    def test_list_recommendations_matches_serialize(self):
+        """The list body is byte-identical to jsonify of serialize()"""
+        self._create_recommendations(3)
+        rec = RecFactory()
+        rec.name = 'Caf\u00e9 "Deluxe"'
+        rec.create()
+        resp = self.app.get(BASE_URL)
+        expected = jsonify([rec.serialize() for rec in RecommendationModel.query.all()])
+        self.assertEqual(resp.get_data(), expected.get_data())
+        self.assertEqual(resp.mimetype, CONTENT_TYPE_JSON)
+
+    def test_list_recommendations_ndjson(self):
+        """Stream the list as NDJSON when asked through the Accept header"""
+        recs = self._create_recommendations(3)
+        resp = self.app.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        names = sorted(json.loads(line)["name"] for line in lines)
+        self.assertEqual(names, sorted(rec.name for rec in recs))
+
+    def test_list_recommendations_stream_param(self):
+        """Stream a filtered list as NDJSON with ?stream=true"""
+        recs = self._create_recommendations(4)
+        product_id = recs[0].original_product_id
+        resp = self.app.get(BASE_URL, query_string=f"stream=true&original_product_id={product_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        for line in resp.get_data(as_text=True).splitlines():
+            self.assertEqual(json.loads(line)["original_product_id"], product_id)
+
+    def test_list_recommendations_paginated(self):
+        """Page through the list with limit and cursor"""
+        recs = self._create_recommendations(5)
+        seen = []
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        while True:
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            page = resp.get_json()
+            self.assertLessEqual(len(page), 2)
+            seen.extend(rec["id"] for rec in page)
+            link = resp.headers.get("Link")
+            if not link:
+                self.assertIsNone(resp.headers.get("X-Next-Cursor"))
+                break
+            self.assertIn('rel="next"', link)
+            next_url = link[link.index("<") + 1:link.index(">")]
+            self.assertIn(resp.headers["X-Next-Cursor"], next_url)
+            resp = self.app.get(next_url)
+        self.assertEqual(seen, sorted(rec.id for rec in recs))
+
+    def test_list_recommendations_paginated_with_filter(self):
+        """Pagination keeps the filter parameters"""
+        recs = self._create_recommendations(4)
+        for rec in recs:
+            rec.name = "Pager"
+            self.app.put(f"{BASE_URL}/{rec.id}", json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+        self._create_recommendations(2)
+        resp = self.app.get(BASE_URL, query_string="name=Pager&limit=3")
+        self.assertEqual(len(resp.get_json()), 3)
+        self.assertIn("name=Pager", resp.headers["Link"])
+        resp = self.app.get(BASE_URL, query_string=f"name=Pager&limit=3&cursor={resp.headers['X-Next-Cursor']}")
+        self.assertEqual([rec["name"] for rec in resp.get_json()], ["Pager"])
+        self.assertNotIn("Link", resp.headers)
+
+    def test_list_recommendations_bad_page_parameters(self):
+        """Bad limit or cursor values are bad requests"""
+        for query in ("limit=0", "limit=abc", "cursor=!!!", "cursor=e30"):
+            resp = self.app.get(BASE_URL, query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_list_recommendations_from_adjacency_index(self):
+        """Product queries are answered by the adjacency index when it is ready"""
+        recs = self._create_recommendations(3)
+        product_id = recs[0].original_product_id
+        adjacency_index.start(lambda: RecommendationModel.adjacency_rows(app), background=False)
+        try:
+            lookups = adjacency_index.lookups
+            resp = self.app.get(BASE_URL, query_string=f"original_product_id={product_id}")
+            self.assertEqual(adjacency_index.lookups, lookups + 1)
+            self.assertEqual([rec["id"] for rec in resp.get_json()], [recs[0].id])
+            self.assertEqual(resp.get_json()[0], recs[0].serialize())
+            # a local update is visible straight away
+            data = recs[0].serialize()
+            data["name"] = "Indexed"
+            self.app.put(f"{BASE_URL}/{recs[0].id}", json=data, content_type=CONTENT_TYPE_JSON)
+            resp = self.app.get(BASE_URL, query_string=f"original_product_id={product_id}")
+            self.assertEqual(resp.get_json()[0]["name"], "Indexed")
+            self.app.delete(f"{BASE_URL}/{recs[0].id}")
+            resp = self.app.get(BASE_URL, query_string=f"original_product_id={product_id}")
+            self.assertEqual(resp.get_json(), [])
+        finally:
+            adjacency_index.stop()
+
+    def test_adjacency_index_repeated_filters(self):
+        """Repeated filter values give the same results from the index and the database"""
+        for activated in (True, False):
+            rec = RecFactory(original_product_id=601, activated=activated)
+            self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+        queries = (
+            "original_product_id=601,601",
+            "original_product_id=601&original_product_id=601",
+            "original_product_id=601&activated=false&activated=false",
+            "original_product_id=601&activated=true&activated=false",
+        )
+        expected = [self.app.get(BASE_URL, query_string=query).get_json() for query in queries]
+        self.assertEqual([len(rows) for rows in expected], [2, 2, 1, 2])
+        self.assertFalse(expected[2][0]["activated"])
+        adjacency_index.start(lambda: RecommendationModel.adjacency_rows(app), background=False)
+        try:
+            lookups = adjacency_index.lookups
+            for query, rows in zip(queries, expected):
+                resp = self.app.get(BASE_URL, query_string=query)
+                self.assertCountEqual(resp.get_json(), rows, query)
+            self.assertEqual(adjacency_index.lookups, lookups + len(queries))
+        finally:
+            adjacency_index.stop()
+
+    def test_list_top_recommendations(self):
+        """?top=K returns the K best scored Recommendations of each product"""
+        recs = []
+        for product_id, score in ((501, 0.1), (501, 0.9), (501, 0.5), (502, 0.3)):
+            rec = RecFactory(original_product_id=product_id, score=score, rank=None)
+            resp = self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+            recs.append(resp.get_json()["id"])
+        expected = [recs[1], recs[2], recs[3]]
+        resp = self.app.get(BASE_URL, query_string="original_product_id=502,501&top=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([rec["id"] for rec in resp.get_json()], expected)
+        self.assertEqual(resp.get_json()[0]["score"], 0.9)
+        resp = self.app.get(BASE_URL, query_string="top=2&stream=true")
+        self.assertEqual([json.loads(line)["id"] for line in resp.data.splitlines()], expected)
+        adjacency_index.start(lambda: RecommendationModel.adjacency_rows(app), background=False)
+        try:
+            resp = self.app.get(BASE_URL, query_string="original_product_id=502,501&top=2")
+            self.assertEqual([rec["id"] for rec in resp.get_json()], expected)
+        finally:
+            adjacency_index.stop()
+        for query in ("top=0", "top=abc", "top=2&limit=1"):
+            resp = self.app.get(BASE_URL, query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+
     def test_index(self):
         """Test the Home Page"""
         resp = self.app.get("/")
@@ -227,6 +373,167 @@ class TestYourRecommendationServer(unittest.TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_delete_recommendations_by_filter(self):
+        """Delete the Recommendations that match the list filters"""
+        recs = self._create_recommendations(4)
+        target = recs[0].original_product_id
+        expected = len([rec for rec in recs if rec.original_product_id == target])
+        self.app.get(f"{BASE_URL}/{recs[0].id}")  # cache it
+        resp = self.app.delete(BASE_URL, query_string={"original_product_id": target})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"deleted": expected})
+        resp = self.app.get(f"{BASE_URL}/{recs[0].id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 4 - expected)
+
+    def test_delete_recommendations_by_ids(self):
+        """Delete an explicit list of Recommendations"""
+        recs = self._create_recommendations(3)
+        resp = self.app.delete(BASE_URL, json={"ids": [recs[0].id, recs[2].id, 0]})
+        self.assertEqual(resp.get_json(), {"deleted": 2})
+        self.assertEqual([rec["id"] for rec in self.app.get(BASE_URL).get_json()], [recs[1].id])
+        resp = self.app.delete(BASE_URL, json={"ids": "all"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_all_recommendations(self):
+        """An unfiltered delete removes every Recommendation"""
+        self._create_recommendations(3)
+        etag = self.app.get(BASE_URL).headers["ETag"]
+        resp = self.app.delete(BASE_URL)
+        self.assertEqual(resp.get_json(), {"deleted": 3})
+        resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+
+    def test_delete_recommendations_bad_filter(self):
+        """Unknown or empty filters are rejected instead of deleting everything"""
+        self._create_recommendations(2)
+        for query_string in ("orignal_product_id=5", "original_product_id="):
+            resp = self.app.delete(BASE_URL, query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 2)
+
+    def test_deactivate_recommendations_by_filter(self):
+        """Deactivate every Recommendation of a product"""
+        recs = []
+        for activated in (True, True, False):
+            rec = RecFactory(original_product_id=401, activated=activated)
+            resp = self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+            recs.append(resp.get_json())
+        self.app.get(f"{BASE_URL}/{recs[0]['id']}")  # cache it
+        resp = self.app.put(f"{BASE_URL}/deactivate", query_string="original_product_id=401")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data, {"changed": [recs[0]["id"], recs[1]["id"]],
+                                "unchanged": [recs[2]["id"]]})
+        self.assertFalse(self.app.get(f"{BASE_URL}/{recs[0]['id']}").get_json()["activated"])
+
+    def test_activate_recommendations_by_ids(self):
+        """Activate an explicit list of Recommendations"""
+        recs = []
+        for activated in (False, True):
+            rec = RecFactory(activated=activated)
+            resp = self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+            recs.append(resp.get_json()["id"])
+        resp = self.app.put(f"{BASE_URL}/activate", json={"ids": recs + [0]})
+        self.assertEqual(resp.get_json(), {"changed": [recs[0]], "unchanged": [recs[1]],
+                                           "not_found": [0]})
+        resp = self.app.put(f"{BASE_URL}/activate")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lookup_recommendations(self):
+        """Look up the Recommendations of many products in one request"""
+        created = []
+        for product_id, score in ((501, 0.9), (501, 0.5), (502, 0.5)):
+            rec = RecFactory(original_product_id=product_id, reason=Reason.UP_SELL, score=score)
+            resp = self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+            created.append(resp.get_json())
+        resp = self.app.post(f"{BASE_URL}/lookup", json={
+            "original_product_ids": [502, 501, 503], "limit": 1, "reason": "up_sell",
+        })
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [
+            {"original_product_id": 502, "recommendations": [created[2]]},
+            {"original_product_id": 501, "recommendations": [created[0]]},
+            {"original_product_id": 503, "recommendations": []},
+        ])
+        resp = self.app.post(f"{BASE_URL}/lookup", json={"ids": [created[1]["id"]]})
+        self.assertEqual(resp.get_json(), [
+            {"original_product_id": 501, "recommendations": [created[1]]},
+        ])
+
+    def test_lookup_recommendations_bad_request(self):
+        """Lookups with bad keys or filters are rejected"""
+        for body in ({}, {"ids": "1"}, {"ids": [1], "limit": 0},
+                     {"ids": [1], "reason": "NOPE"}, {"ids": [1], "activated": "yes"}, [1]):
+            resp = self.app.post(f"{BASE_URL}/lookup", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_search_recommendations(self):
+        """Search Recommendations by the start of their names"""
+        created = {}
+        for name, target in (("Radio", "Battery"), ("radiator", "Coolant"), ("Printer", "Radial fan")):
+            rec = RecFactory(name=name, recommendation_product_name=target)
+            resp = self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+            created[name] = resp.get_json()
+        resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "RAD"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [created["Printer"], created["radiator"], created["Radio"]])
+        resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "rad", "limit": 1})
+        self.assertEqual(resp.get_json(), [created["Printer"]])
+        resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "rad", "field": "name"})
+        self.assertEqual(resp.get_json(), [created["radiator"], created["Radio"]])
+        resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "batt", "reason": "cross_sell"})
+        expected = [created["Radio"]] if created["Radio"]["reason"] == "CROSS_SELL" else []
+        self.assertEqual(resp.get_json(), expected)
+
+    def test_search_recommendations_bad_request(self):
+        """Searches without a prefix or with unknown fields are rejected"""
+        for args in ({}, {"q": " "}, {"q": "x" * 201}, {"q": "a", "field": "reason"},
+                     {"q": "a", "limit": 0}):
+            resp = self.app.get(f"{BASE_URL}/search", query_string=args)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, args)
+
+    def test_list_recommended_by(self):
+        """List the Recommendations that point at a product, one page at a time"""
+        created = []
+        for product_id in (1, 2, 3):
+            rec = RecFactory(original_product_id=product_id, recommendation_product_id=777)
+            resp = self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+            created.append(resp.get_json())
+        rec = RecFactory(recommendation_product_id=778)
+        self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+
+        resp = self.app.get("/products/777/recommended-by", query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), created[:2])
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+        next_url = resp.headers["Link"].split(";")[0].strip("<>")
+        self.assertIn("/products/777/recommended-by?", next_url)
+        resp = self.app.get(next_url)
+        self.assertEqual(resp.get_json(), created[2:])
+        self.assertNotIn("Link", resp.headers)
+
+        # a product_id in the query string does not clash with the path's
+        resp = self.app.get(
+            "/products/777/recommended-by", query_string={"product_id": 1, "limit": 1}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), created[:1])
+        next_url = resp.headers["Link"].split(";")[0].strip("<>")
+        self.assertIn("/products/777/recommended-by?", next_url)
+        resp = self.app.get(next_url)
+        self.assertEqual(resp.get_json(), created[1:2])
+
+        resp = self.app.get("/products/777/recommended-by/count")
+        self.assertEqual(resp.get_json(), {"recommendation_product_id": 777, "count": 3})
+        self.app.delete("/recommendations/{}".format(created[0]["id"]))
+        resp = self.app.get("/products/777/recommended-by/count")
+        self.assertEqual(resp.get_json()["count"], 2)
+        resp = self.app.get("/products/779/recommended-by")
+        self.assertEqual(resp.get_json(), [])
+        self.assertEqual(resp.headers["X-Total-Count"], "0")
+
     def test_get_rec(self):
         """Get a single Rec"""
         # get the id of a Rec
@@ -238,6 +545,82 @@ class TestYourRecommendationServer(unittest.TestCase):
         data = resp.get_json()
         self.assertEqual(data["name"], test_rec.name)
 
+    def test_get_rec_is_cached(self):
+        """A second read of a Rec is served from the cache"""
+        test_rec = self._create_recommendations(1)[0]
+        self.app.get(f"{BASE_URL}/{test_rec.id}")
+        hits = self.app.get("/debug/cache").get_json()["hits"]
+        resp = self.app.get(f"{BASE_URL}/{test_rec.id}")
+        self.assertEqual(resp.get_json()["name"], test_rec.name)
+        self.assertEqual(self.app.get("/debug/cache").get_json()["hits"], hits + 1)
+
+    def test_get_rec_after_write(self):
+        """Updates, activation and deletes are visible to cached reads"""
+        rec = RecFactory()
+        rec.activated = False
+        resp = self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+        data = resp.get_json()
+        self.app.get(f"{BASE_URL}/{data['id']}")
+        data["name"] = "Renamed"
+        self.app.put(f"{BASE_URL}/{data['id']}", json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(self.app.get(f"{BASE_URL}/{data['id']}").get_json()["name"], "Renamed")
+        self.app.put(f"{BASE_URL}/{data['id']}/activate")
+        self.assertTrue(self.app.get(f"{BASE_URL}/{data['id']}").get_json()["activated"])
+        self.app.delete(f"{BASE_URL}/{data['id']}")
+        resp = self.app.get(f"{BASE_URL}/{data['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_rec_conditional(self):
+        """A matching If-None-Match gets 304 until the Rec is updated"""
+        test_rec = self._create_recommendations(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{test_rec.id}")
+        etag = resp.headers["ETag"]
+        resp = self.app.get(f"{BASE_URL}/{test_rec.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+        data = test_rec.serialize()
+        data["name"] = "Renamed"
+        self.app.put(f"{BASE_URL}/{test_rec.id}", json=data, content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(f"{BASE_URL}/{test_rec.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["name"], "Renamed")
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_list_conditional(self):
+        """List ETags change only when a listed product is written"""
+        for product_id in (201, 202):
+            rec = RecFactory(original_product_id=product_id)
+            self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+        everything = self.app.get(BASE_URL).headers["ETag"]
+        one = self.app.get(BASE_URL, query_string="original_product_id=201").headers["ETag"]
+        self.assertNotEqual(everything, one)
+        resp = self.app.get(
+            BASE_URL, query_string="original_product_id=201", headers={"If-None-Match": one}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        # a write to another product leaves the filtered list unchanged
+        rec = RecFactory(original_product_id=202)
+        self.app.post(BASE_URL, json=rec.serialize(), content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(
+            BASE_URL, query_string="original_product_id=201", headers={"If-None-Match": one}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get(BASE_URL, headers={"If-None-Match": everything})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+
+    def test_pool_statistics(self):
+        """The pool statistics show the configured pool and its checkouts"""
+        self._create_recommendations(1)
+        resp = self.app.get("/debug/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["pool"], "InstrumentedQueuePool")
+        self.assertEqual(data["size"], app.config["DB_POOL_SIZE"])
+        self.assertGreater(data["checkouts"], 0)
+        self.assertEqual(sum(data["wait_ms_histogram"].values()), data["checkouts"])
+
     def test_get_recommendations_not_found(self):
         """Get a Rec thats not found"""
         resp = self.app.get("/recommendations/0")
@@ -305,25 +688,25 @@ class TestYourRecommendationServer(unittest.TestCase):
             self.assertEqual(rec["recommendation_product_name"], test_rec_name)   
 
 
-    # def test_query_recommendation_list_by_activated(self):
-    #     """Query Recommendations by Activated Status"""
-    #     recs = self._create_recommendations(10)
-    #     test_activated = recs[0].activated
-    #     activated_list = [rec for rec in recs if rec.activated == test_activated]
-
-    #     logging.info(
-    #         f"Activated={test_activated}: {len(activated_list)} = {activated_list}"
-    #     )
-    #     resp = self.app.get(
-    #         BASE_URL, query_string=f"activated={test_activated}"
-    #     )
-    #     self.assertEqual(resp.status_code, status.HTTP_200_OK)
-    #     data = resp.get_json()
-    #     self.assertEqual(len(data), len(activated_list))
+    def test_query_recommendation_list_by_activated(self):
+        """Query Recommendations by Activated Status"""
+        recs = self._create_recommendations(10)
+        test_activated = recs[0].activated
+        activated_list = [rec for rec in recs if rec.activated == test_activated]
+
+        logging.info(
+            f"Activated={test_activated}: {len(activated_list)} = {activated_list}"
+        )
+        resp = self.app.get(
+            BASE_URL, query_string=f"activated={test_activated}"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), len(activated_list))
         
-    #     # check the data just to be sure
-    #     for rec in data:
-    #         self.assertEqual(rec["activated"], test_activated)    
+        # check the data just to be sure
+        for rec in data:
+            self.assertEqual(rec["activated"], test_activated)    
 
     def test_query_recommendation_list_by_reason(self):
         """Query Recommendations by Reason"""
@@ -345,6 +728,43 @@ class TestYourRecommendationServer(unittest.TestCase):
         for rec in data:
             self.assertEqual(rec["reason"], test_reason) 
    
+    def test_query_recommendation_list_by_combined_filters(self):
+        """Query Recommendations with several filters at once"""
+        recs = self._create_recommendations(10)
+        test_rec = recs[0]
+        resp = self.app.get(
+            BASE_URL,
+            query_string={
+                "name": test_rec.name,
+                "reason": test_rec.reason.name,
+                "activated": str(test_rec.activated).lower(),
+            },
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        expected = [
+            rec.id for rec in recs
+            if rec.name == test_rec.name and rec.reason == test_rec.reason
+            and rec.activated == test_rec.activated
+        ]
+        self.assertEqual(sorted(rec["id"] for rec in resp.get_json()), sorted(expected))
+
+    def test_query_recommendation_list_by_reason_list(self):
+        """Query Recommendations by a list of reasons"""
+        recs = self._create_recommendations(10)
+        resp = self.app.get(BASE_URL, query_string="reason=UP_SELL,ACCESSORY")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        expected = [rec for rec in recs if rec.reason in (Reason.UP_SELL, Reason.ACCESSORY)]
+        data = resp.get_json()
+        self.assertEqual(len(data), len(expected))
+        for rec in data:
+            self.assertIn(rec["reason"], ["UP_SELL", "ACCESSORY"])
+
+    def test_query_recommendation_list_bad_filter(self):
+        """Query Recommendations with a filter value that cannot be parsed"""
+        for query in ("reason=NOPE", "original_product_id=abc", "activated=maybe"):
+            resp = self.app.get(BASE_URL, query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+
     # Testing Sad Paths
 
     # def test_recommendations_bad_content_type(self):
@@ -366,6 +786,20 @@ class TestYourRecommendationServer(unittest.TestCase):
         self.assertEqual(error_response["message"], "Invalid recommendation: body of request contained bad or no data string indices must be integers")
         self.assertEqual(error_response["status"], 400)
 
+    def test_create_recommendations_numeric_string_ids(self):
+        """Ids sent as numeric strings, as by the admin UI, are accepted"""
+        rec = RecFactory().serialize()
+        rec["original_product_id"] = "5"
+        rec["recommendation_product_id"] = " 6 "
+        resp = self.app.post(BASE_URL, json=rec, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["original_product_id"], 5)
+        self.assertEqual(data["recommendation_product_id"], 6)
+        rec["original_product_id"] = "five"
+        resp = self.app.post(BASE_URL, json=rec, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_recommendations_not_found(self):
         """Test for unknown path"""
         resp = self.app.get("testing123", content_type=CONTENT_TYPE_JSON)
@@ -384,6 +818,74 @@ class TestYourRecommendationServer(unittest.TestCase):
         self.assertEqual(error_response["message"], "405 Method Not Allowed: The method is not allowed for the requested URL.")
         self.assertEqual(error_response["status"], 405)
 
+    ######################################################################
+    # T E S T   B U L K   C R E A T E
+    ######################################################################
+
+    def test_create_recommendations_bulk(self):
+        """Create many Recommendations from a JSON array"""
+        recs = [RecFactory().serialize() for _ in range(5)]
+        resp = self.app.post(f"{BASE_URL}/bulk", json=recs, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 5)
+        self.assertEqual(len(data["ids"]), 5)
+        self.assertEqual(data["errors"], [])
+        resp = self.app.get(f"{BASE_URL}/{data['ids'][2]}")
+        self.assertEqual(resp.get_json()["name"], recs[2]["name"])
+
+    def test_create_recommendations_bulk_ndjson(self):
+        """Create many Recommendations from NDJSON and report bad rows"""
+        good = RecFactory().serialize()
+        missing = RecFactory().serialize()
+        del missing["reason"]
+        too_long = RecFactory().serialize()
+        too_long["name"] = "x" * 100
+        body = "\n".join(
+            [json.dumps(good), "{not json", json.dumps(missing), json.dumps(too_long), json.dumps(good)]
+        )
+        resp = self.app.post(f"{BASE_URL}/bulk", data=body, content_type="application/x-ndjson")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 2)
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2, 3])
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_create_recommendations_bulk_bad_ids(self):
+        """Rows with ids that are not INTEGERs are rejected one by one"""
+        good = RecFactory().serialize()
+        bad = []
+        for value in (10 ** 17, "x" * 20, [1], True, "5.5"):
+            row = RecFactory().serialize()
+            row["original_product_id"] = value
+            bad.append(row)
+        target = RecFactory().serialize()
+        target["recommendation_product_id"] = -2 ** 31 - 1
+        resp = self.app.post(f"{BASE_URL}/bulk", json=[good] + bad + [target])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2, 3, 4, 5, 6])
+        self.assertIn("Invalid original_product_id", data["errors"][0]["message"])
+        self.assertIn("Invalid recommendation_product_id", data["errors"][5]["message"])
+
+    def test_create_recommendations_bulk_all_invalid(self):
+        """A bulk request with no valid rows is a bad request"""
+        resp = self.app.post(f"{BASE_URL}/bulk", json=[{"name": "foo"}], content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["errors"][0]["index"], 0)
+
+    def test_create_recommendations_bulk_not_a_list(self):
+        """A bulk JSON body must be an array"""
+        resp = self.app.post(f"{BASE_URL}/bulk", json={"name": "foo"}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_recommendations_bulk_bad_content_type(self):
+        """Bulk create only accepts JSON and NDJSON"""
+        resp = self.app.post(f"{BASE_URL}/bulk", data="a,b", content_type="text/csv")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
     ######################################################################
     # T E S T   A C T I O N S
     ######################################################################